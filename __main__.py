@@ -7,9 +7,9 @@ from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 from typing import TextIO
 
-from aiohttp import web
-
 from config_model import MainConfig
+from event_loop import run_app
+from prefork import Supervisor
 from web_app import Application
 
 os.environ['no_proxy'] = '*'
@@ -92,6 +92,13 @@ if __name__ == '__main__':
         type=argparse.FileType('r'),
         dest='config_file',
     )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        help='Number of worker processes, pools are split between them',
+        default=1,
+        type=int,
+    )
     parsed_args = parser.parse_args()
     config = load_config(config_file=parsed_args.config_file)
 
@@ -101,10 +108,13 @@ if __name__ == '__main__':
     )
 
     try:
-        web.run_app(
-            app=Application(config),
-            host=config.app.host,
-            port=config.app.port,
-        )
+        if parsed_args.workers > 1:
+            Supervisor(
+                config=config,
+                workers=parsed_args.workers,
+                config_path=parsed_args.config_file.name,
+            ).run()
+        else:
+            run_app(app=Application(config), config=config.app)
     except Exception as exception:
         logger.exception('Starting app was failed. {0}'.format(exception))
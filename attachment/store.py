@@ -0,0 +1,346 @@
+"""
+Attachment store module.
+
+Files are stored once by SHA-256 of content in sharded directories,
+e.g. `ab/cd/abcd...`, so the same file attached to many letters takes
+disk space once. Uploads are hashed while being written to temporary
+file and moved in place with atomic rename. Letters reference files
+through `letter_attachment` table, number of references is kept by
+trigger and unreferenced files are removed after grace period.
+"""
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterable, BinaryIO, List, NamedTuple, Optional
+
+import sqlalchemy as sa
+from aiohttp import web
+from sqlalchemy.dialects.postgresql import insert
+
+from config_model import StorageConfig
+from db.psql_engine import PostgresEngine
+from db.schema import Attachment, LetterAttachment
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = 'tmp'
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+
+class Upload(NamedTuple):
+    """Uploaded file, not moved to store yet."""
+
+    path: str
+    sha256: str
+    size: int
+
+
+def _write_chunk(temp: BinaryIO, digest: 'hashlib._Hash', chunk: bytes):
+    temp.write(chunk)
+    digest.update(chunk)
+
+
+class AttachmentStore(object):
+    """Content-addressed store of attachment files."""
+
+    def __init__(self, config: StorageConfig, db_engine: PostgresEngine):
+        """
+        Init class instance.
+
+        Args:
+            config (StorageConfig): store config
+            db_engine (PostgresEngine): db engine
+
+        """
+        self.config = config
+        self.db_engine = db_engine
+        self.root = os.path.abspath(config.root)
+        self._task: Optional[asyncio.Task] = None
+        self._stored = registry.counter('attachments_stored')
+        self._deduplicated = registry.counter('attachments_deduplicated')
+        self._removed = registry.counter('attachments_removed')
+
+    def path(self, sha256: str) -> str:
+        """
+        Get path of stored file.
+
+        Args:
+            sha256 (str): hex digest of file content
+
+        Returns:
+            path (str): file path
+
+        """
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    async def write(self, chunks: AsyncIterable[bytes]) -> Upload:
+        """
+        Write upload to temporary file, hashing it while writing.
+
+        Args:
+            chunks (AsyncIterable[bytes]): upload content
+
+        Returns:
+            upload (Upload): temporary file with its hash and size
+
+        Raises:
+            HTTPRequestEntityTooLarge: if upload is larger than `max_size`
+
+        """
+        loop = asyncio.get_running_loop()
+        temp_dir = os.path.join(self.root, TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        path = os.path.join(temp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'wb') as temp:
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.config.max_size:
+                        raise web.HTTPRequestEntityTooLarge(
+                            max_size=self.config.max_size,
+                            actual_size=size,
+                        )
+                    await loop.run_in_executor(
+                        None,
+                        _write_chunk,
+                        temp,
+                        digest,
+                        chunk,
+                    )
+            except BaseException:
+                temp.close()
+                os.remove(path)
+                raise
+        return Upload(path=path, sha256=digest.hexdigest(), size=size)
+
+    def discard(self, upload: Upload):
+        """
+        Remove temporary file of upload.
+
+        Args:
+            upload (Upload): upload to remove
+
+        """
+        try:
+            os.remove(upload.path)
+        except FileNotFoundError:
+            return
+
+    async def link(
+        self,
+        upload: Upload,
+        letter: int,
+        filename: str,
+        content_type: str = DEFAULT_CONTENT_TYPE,
+    ) -> int:
+        """
+        Attach upload to letter and move it to store.
+
+        File is moved after reference is committed, so garbage collection
+        can not remove file which has just been referenced again.
+
+        Args:
+            upload (Upload): uploaded file
+            letter (int): letter id
+            filename (str): attachment file name
+            content_type (str): attachment MIME type
+
+        Returns:
+            letter_attachment_id (int): id of letter attachment
+
+        """
+        now = datetime.datetime.utcnow()
+        upsert = insert(Attachment).values(
+            sha256=upload.sha256,
+            size=upload.size,
+            refcount=0,
+            created=now,
+            released=now,
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[Attachment.sha256],
+            set_={'size': upsert.excluded.size},
+        ).returning(Attachment.id)
+        position = sa.select(
+            sa.func.coalesce(sa.func.max(LetterAttachment.position) + 1, 0),
+        ).where(
+            LetterAttachment.letter == letter,
+        ).scalar_subquery()
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                attachment_id = (await session.execute(upsert)).scalar_one()
+                letter_attachment_id = (
+                    await session.execute(
+                        sa.insert(LetterAttachment).values(
+                            letter=letter,
+                            attachment=attachment_id,
+                            filename=filename,
+                            content_type=content_type,
+                            position=position,
+                        ).returning(LetterAttachment.id),
+                    )
+                ).scalar_one()
+        self._commit(upload)
+        return letter_attachment_id
+
+    async def get_letter_attachments(self, letter: int) -> List[dict]:
+        """
+        Get attachments of letter in order they were attached.
+
+        Args:
+            letter (int): letter id
+
+        Returns:
+            attachments (List[dict]): file name, MIME type, hash, size
+                and path of attachments
+
+        """
+        async with self.db_engine.session() as session:
+            rows = (await session.execute(self._select(letter))).all()
+        return [self._to_dict(row) for row in rows]
+
+    async def get_letter_attachment(
+        self,
+        letter: int,
+        number: int,
+    ) -> Optional[dict]:
+        """
+        Get single attachment of letter by its number.
+
+        Args:
+            letter (int): letter id
+            number (int): attachment number, from 0
+
+        Returns:
+            attachment (Optional[dict]): file name, MIME type, hash, size
+                and path of attachment, None if it does not exist
+
+        """
+        stmt = self._select(letter).offset(number).limit(1)
+        async with self.db_engine.session() as session:
+            row = (await session.execute(stmt)).first()
+        if row is None:
+            return None
+        return self._to_dict(row)
+
+    def start(self):
+        """Start removal of unreferenced files."""
+        self._task = asyncio.create_task(self._collect_periodically())
+
+    async def stop(self):
+        """Stop removal of unreferenced files."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def collect(self) -> int:
+        """
+        Remove files which are not referenced longer than grace period.
+
+        Grace period keeps files of letters which were deleted while
+        message is still waiting in outbox. Rows are locked until files
+        are removed, so concurrent upload of the same content waits and
+        moves its file in place afterwards.
+
+        Returns:
+            removed (int): number of removed files
+
+        """
+        threshold = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.config.gc_grace,
+        )
+        stmt = sa.select(Attachment).where(
+            Attachment.refcount <= 0,
+            Attachment.released < threshold,
+        ).with_for_update(
+            skip_locked=True,
+        )
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                unreferenced = (await session.execute(stmt)).scalars().all()
+                for attachment in unreferenced:
+                    try:
+                        os.remove(self.path(attachment.sha256))
+                    except FileNotFoundError:
+                        logger.warning(
+                            'Attachment {0} file is missing.'.format(
+                                attachment.sha256,
+                            ),
+                        )
+                    await session.delete(attachment)
+        self._removed.inc(len(unreferenced))
+        self._sweep_temp()
+        return len(unreferenced)
+
+    def _select(self, letter: int) -> sa.sql.Select:
+        return sa.select(
+            LetterAttachment.filename,
+            LetterAttachment.content_type,
+            Attachment.sha256,
+            Attachment.size,
+        ).join(
+            Attachment,
+            Attachment.id == LetterAttachment.attachment,
+        ).where(
+            LetterAttachment.letter == letter,
+        ).order_by(
+            LetterAttachment.position,
+            LetterAttachment.id,
+        )
+
+    def _to_dict(self, row: sa.engine.Row) -> dict:
+        return dict(
+            row._mapping,  # noqa:WPS437
+            path=self.path(row.sha256),
+        )
+
+    def _commit(self, upload: Upload):
+        path = self.path(upload.sha256)
+        if os.path.exists(path):
+            self._deduplicated.inc()
+            self.discard(upload)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(upload.path, path)
+        self._stored.inc()
+
+    def _sweep_temp(self):
+        """Remove temporary files of interrupted and abandoned uploads."""
+        temp_dir = os.path.join(self.root, TEMP_DIR)
+        if not os.path.isdir(temp_dir):
+            return
+        threshold = time.time() - self.config.gc_grace
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < threshold:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+
+    async def _collect_periodically(self):
+        while True:  # noqa:WPS457
+            try:
+                removed = await self.collect()
+            except Exception as exception:
+                logger.exception(
+                    'Attachments collecting was failed. {0}'.format(
+                        exception,
+                    ),
+                )
+            else:
+                if removed:
+                    logger.info(
+                        'Unreferenced attachments removed: {0}'.format(
+                            removed,
+                        ),
+                    )
+            await asyncio.sleep(self.config.gc_interval)
@@ -0,0 +1,302 @@
+"""
+Resumable upload module.
+
+Upload session is a pair of files in temporary directory of attachment
+store: `<id>.part` with received bytes and `<id>.json` with metadata.
+Chunks are written at their offsets with `os.pwrite`, so a chunk may be
+sent again after dropped connection. Size of part file is the offset
+to continue from. Session is locked with `flock` while chunk is being
+written, so it can not be written by two requests, even from different
+worker processes. Finalized upload is hashed and moved to the store.
+Files of session are touched on every request, so only sessions idle
+for grace period are removed with other temporary files.
+"""
+import asyncio
+import datetime
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from typing import AsyncIterable, Iterator
+
+from aiohttp import web
+
+from attachment.store import TEMP_DIR, AttachmentStore, Upload
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_PATTERN = re.compile('^[0-9a-f]{32}$')
+HASH_CHUNK_SIZE = 1048576
+
+
+def _pwrite_all(fd: int, chunk: bytes, offset: int):
+    view = memoryview(chunk)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        while True:
+            chunk = part.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+class UploadManager(object):
+    """Resumable upload sessions."""
+
+    def __init__(self, store: AttachmentStore):
+        """
+        Init class instance.
+
+        Args:
+            store (AttachmentStore): store of finalized uploads
+
+        """
+        self.store = store
+        self.directory = os.path.join(store.root, TEMP_DIR)
+
+    def create(
+        self,
+        user: int,
+        letter: int,
+        filename: str,
+        content_type: str,
+        length: int,
+    ) -> str:
+        """
+        Create upload session.
+
+        Args:
+            user (int): user id
+            letter (int): letter id to attach file to
+            filename (str): attachment file name
+            content_type (str): attachment MIME type
+            length (int): size of file, bytes
+
+        Returns:
+            upload_id (str): upload session id
+
+        Raises:
+            HTTPRequestEntityTooLarge: if file is larger than `max_size`
+
+        """
+        if length > self.store.config.max_size:
+            raise web.HTTPRequestEntityTooLarge(
+                max_size=self.store.config.max_size,
+                actual_size=length,
+            )
+        os.makedirs(self.directory, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        with open(self._path(upload_id, 'json'), 'w') as meta:
+            json.dump(
+                {
+                    'user': user,
+                    'letter': letter,
+                    'filename': filename,
+                    'content_type': content_type,
+                    'length': length,
+                    'created': datetime.datetime.utcnow().isoformat(),
+                },
+                meta,
+            )
+        open(self._path(upload_id, 'part'), 'wb').close()  # noqa:WPS515
+        return upload_id
+
+    def status(self, upload_id: str, user: int) -> dict:
+        """
+        Get upload session state.
+
+        Args:
+            upload_id (str): upload session id
+            user (int): user id
+
+        Returns:
+            status (dict): session metadata and received bytes (`offset`)
+
+        """
+        meta = self._load(upload_id, user)
+        meta['offset'] = os.stat(self._path(upload_id, 'part')).st_size
+        return meta
+
+    async def append(
+        self,
+        upload_id: str,
+        user: int,
+        offset: int,
+        chunks: AsyncIterable[bytes],
+    ) -> int:
+        """
+        Write chunks to upload starting from offset.
+
+        Offset may be less than received bytes to send data again,
+        but gaps are not allowed.
+
+        Args:
+            upload_id (str): upload session id
+            user (int): user id
+            offset (int): position of first byte
+            chunks (AsyncIterable[bytes]): content
+
+        Returns:
+            offset (int): received bytes
+
+        Raises:
+            HTTPConflict: if offset is beyond received bytes
+            HTTPRequestEntityTooLarge: if content exceeds declared length
+
+        """
+        meta = self._load(upload_id, user)
+        loop = asyncio.get_running_loop()
+        with self._locked(upload_id) as fd:
+            received = os.fstat(fd).st_size
+            if offset > received:
+                raise web.HTTPConflict(
+                    text='Offset {0} is beyond received {1} bytes.'.format(
+                        offset,
+                        received,
+                    ),
+                )
+            async for chunk in chunks:
+                if offset + len(chunk) > meta['length']:
+                    raise web.HTTPRequestEntityTooLarge(
+                        max_size=meta['length'],
+                        actual_size=offset + len(chunk),
+                    )
+                await loop.run_in_executor(
+                    None,
+                    _pwrite_all,
+                    fd,
+                    chunk,
+                    offset,
+                )
+                offset += len(chunk)
+            self._touch(upload_id)
+            return os.fstat(fd).st_size
+
+    async def finalize(self, upload_id: str, user: int) -> dict:
+        """
+        Hash complete upload, move it to store and attach it to letter.
+
+        Args:
+            upload_id (str): upload session id
+            user (int): user id
+
+        Returns:
+            result (dict): id, hash and size of attachment
+
+        Raises:
+            HTTPConflict: if upload is not complete
+
+        """
+        meta = self._load(upload_id, user)
+        path = self._path(upload_id, 'part')
+        with self._locked(upload_id) as fd:
+            size = os.fstat(fd).st_size
+            if size != meta['length']:
+                raise web.HTTPConflict(
+                    text='Upload has {0} of {1} bytes.'.format(
+                        size,
+                        meta['length'],
+                    ),
+                )
+            sha256 = await asyncio.get_running_loop().run_in_executor(
+                None,
+                _hash_file,
+                path,
+            )
+            upload = Upload(path=path, sha256=sha256, size=size)
+            attachment_pk = await self.store.link(
+                upload=upload,
+                letter=meta['letter'],
+                filename=meta['filename'],
+                content_type=meta['content_type'],
+            )
+        os.remove(self._path(upload_id, 'json'))
+        return {
+            'attachment_pk': attachment_pk,
+            'sha256': sha256,
+            'size': size,
+        }
+
+    def _path(self, upload_id: str, ext: str) -> str:
+        return os.path.join(self.directory, '{0}.{1}'.format(upload_id, ext))
+
+    def _load(self, upload_id: str, user: int) -> dict:
+        """
+        Load session metadata.
+
+        Args:
+            upload_id (str): upload session id
+            user (int): user id
+
+        Returns:
+            meta (dict): session metadata
+
+        Raises:
+            HTTPNotFound: if session does not exist or belongs to other user
+
+        """
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise web.HTTPNotFound()
+        try:
+            with open(self._path(upload_id, 'json')) as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+        if meta['user'] != user:
+            raise web.HTTPNotFound()
+        self._touch(upload_id)
+        return meta
+
+    def _touch(self, upload_id: str):
+        """
+        Mark session as active, so it is not removed as abandoned.
+
+        Args:
+            upload_id (str): upload session id
+
+        """
+        for ext in ('json', 'part'):
+            try:
+                os.utime(self._path(upload_id, ext))
+            except FileNotFoundError:
+                continue
+
+    @contextmanager
+    def _locked(self, upload_id: str) -> Iterator[int]:
+        """
+        Open part file with exclusive lock.
+
+        Args:
+            upload_id (str): upload session id
+
+        Yields:
+            fd (int): file descriptor
+
+        Raises:
+            HTTPNotFound: if part file does not exist
+            HTTPConflict: if upload is being written by other request
+
+        """
+        try:
+            fd = os.open(self._path(upload_id, 'part'), os.O_WRONLY)
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise web.HTTPConflict(text='Upload is in progress.')
+            yield fd
+        finally:
+            os.close(fd)
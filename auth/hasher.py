@@ -0,0 +1,160 @@
+"""Password hashing in a dedicated process pool."""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+from aiohttp import web
+from passlib.hash import pbkdf2_sha256
+
+from config_model import AuthConfig
+from metrics import Summary, registry
+
+logger = logging.getLogger(__name__)
+
+
+def hash_password(password: str, rounds: int) -> str:
+    """
+    Hash password. Runs in pool process.
+
+    Args:
+        password (str): password
+        rounds (int): pbkdf2 rounds
+
+    Returns:
+        pass_hash (str): password hash
+
+    """
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+
+def verify_password(password: str, pass_hash: str) -> bool:
+    """
+    Verify password against hash. Runs in pool process.
+
+    Args:
+        password (str): password
+        pass_hash (str): password hash
+
+    Returns:
+        is_valid (bool): password matches hash
+
+    """
+    return pbkdf2_sha256.verify(password, pass_hash)
+
+
+class PasswordHasher(object):
+    """
+    Process pool for password hashing and verification.
+
+    Hashing is CPU bound and must not block the event loop.
+    Number of pending jobs is limited, extra jobs are rejected with 503.
+
+    """
+
+    def __init__(self, config: AuthConfig):
+        """
+        Init class instance.
+
+        Args:
+            config (AuthConfig): auth config
+
+        """
+        self.config = config
+        self.pool = None
+        self._pending = 0
+        self._pending_gauge = registry.gauge('password_hash_pending')
+        self._rejected = registry.counter('password_hash_rejected')
+        self._hash_latency = registry.summary('password_hash_seconds')
+        self._verify_latency = registry.summary('password_verify_seconds')
+
+    def start(self):
+        """Start process pool."""
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.config.hash_workers,
+        )
+        logger.info(
+            'Password hasher has been started with {0} workers.'.format(
+                self.config.hash_workers,
+            ),
+        )
+
+    def stop(self):
+        """Stop process pool, pending jobs are cancelled."""
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        logger.info('Password hasher has been stopped.')
+
+    async def hash(self, password: str) -> str:  # noqa:WPS125
+        """
+        Hash password.
+
+        Args:
+            password (str): password
+
+        Returns:
+            pass_hash (str): password hash
+
+        """
+        return await self._run(
+            self._hash_latency,
+            hash_password,
+            password,
+            self.config.hash_rounds,
+        )
+
+    async def verify(self, password: str, pass_hash: str) -> bool:
+        """
+        Verify password.
+
+        Args:
+            password (str): password
+            pass_hash (str): password hash
+
+        Returns:
+            is_valid (bool): password matches hash
+
+        """
+        return await self._run(
+            self._verify_latency,
+            verify_password,
+            password,
+            pass_hash,
+        )
+
+    async def _run(self, latency: Summary, func: Callable, *args):
+        """
+        Run function in pool.
+
+        Args:
+            latency (Summary): metric to observe job latency
+            func (Callable): function to run
+            args: function arguments
+
+        Returns:
+            result of function
+
+        Raises:
+            HTTPServiceUnavailable: if pool queue is full
+
+        """
+        max_pending = self.config.hash_workers + self.config.hash_queue_size
+        if self._pending >= max_pending:
+            self._rejected.inc()
+            logger.warning('Password hasher queue is full.')
+            raise web.HTTPServiceUnavailable(
+                headers={'Retry-After': str(self.config.retry_after)},
+            )
+        self._pending += 1
+        self._pending_gauge.set(self._pending)
+        try:
+            with latency.time():
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.pool,
+                    func,
+                    *args,
+                )
+        finally:
+            self._pending -= 1
+            self._pending_gauge.set(self._pending)
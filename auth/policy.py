@@ -1,20 +1,114 @@
 """Auth policy."""
+import hashlib
 import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional
 
 import jwt
 from aiohttp import web
 from aiohttp.multipart import CIMultiDictProxy
-from passlib.hash import pbkdf2_sha256
+from auth.hasher import PasswordHasher
 from service.user_service import UserService
 
 logger = logging.getLogger(__name__)
 
 JWT_SECRET_KEY = 'access_super_key'
 JWT_ALGORITHM = 'HS256'
+TOKEN_DATA_KEY = 'token_data'
+TOKEN_CACHE_SIZE = 10000
+
+
+class TokenCache(object):
+    """
+    Bounded LRU of verified JWT claims.
+
+    Tokens are keyed by their SHA-256 digest, so raw tokens are not kept
+    in memory. Entries are dropped once the token `exp` claim has passed.
+
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        """
+        Init class instance.
+
+        Args:
+            max_size (int): max number of cached tokens
+
+        """
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+
+    def __len__(self) -> int:
+        """
+        Get number of cached tokens.
+
+        Returns:
+            size (int): number of cached tokens
+
+        """
+        return len(self._tokens)
+
+    def get(self, token: str) -> Optional[dict]:
+        """
+        Get claims of already verified token.
+
+        Args:
+            token (str): raw JWT
+
+        Returns:
+            claims (Optional[dict]): decoded token or None if token is unknown
+                or expired
+
+        """
+        key = self._make_key(token)
+        cached = self._tokens.get(key)
+        if cached is None:
+            return None
+        claims, expires_at = cached
+        if expires_at is not None and expires_at <= time.time():
+            del self._tokens[key]  # noqa:WPS420
+            return None
+        self._tokens.move_to_end(key)
+        return claims
+
+    def put(self, token: str, claims: dict):
+        """
+        Remember verified token.
+
+        Args:
+            token (str): raw JWT
+            claims (dict): decoded token
+
+        """
+        key = self._make_key(token)
+        self._tokens[key] = (claims, claims.get('exp'))
+        self._tokens.move_to_end(key)
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+
+    def clear(self):
+        """Drop all cached tokens."""
+        self._tokens.clear()
+
+    @staticmethod
+    def _make_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+
+token_cache = TokenCache()
+
+# id of user of request being processed, used to schedule db access
+current_user_id: ContextVar[Optional[int]] = ContextVar(
+    'current_user_id',
+    default=None,
+)
 
 
 async def create_credentials(
     service: UserService,
+    hasher: PasswordHasher,
     username: str,
     password: str,
 ) -> dict:
@@ -23,6 +117,7 @@ async def create_credentials(
 
     Args:
         service (UserService): user-related service
+        hasher (PasswordHasher): password hasher
         username (str): username
         password (str): password
 
@@ -30,7 +125,7 @@ async def create_credentials(
         result (dict): result of creating
 
     """
-    pass_hash = pbkdf2_sha256.hash(
+    pass_hash = await hasher.hash(
         password,
     )
     return await service.create(
@@ -43,6 +138,31 @@ async def create_credentials(
     )
 
 
+async def verify_credentials(
+    hasher: PasswordHasher,
+    password: str,
+    pass_hash: str,
+) -> bool:
+    """
+    Verify user credentials.
+
+    Args:
+        hasher (PasswordHasher): password hasher
+        password (str): password
+        pass_hash (str): stored password hash
+
+    Returns:
+        is_valid (bool): password matches hash
+
+    """
+    if not pass_hash:
+        return False
+    return await hasher.verify(
+        password,
+        pass_hash,
+    )
+
+
 def get_token_data(headers: CIMultiDictProxy) -> dict:
     """
     Decode and check JWT.
@@ -53,14 +173,21 @@ def get_token_data(headers: CIMultiDictProxy) -> dict:
     Returns:
         token (dict): decoded token
 
+    Signature check is skipped for tokens found in `token_cache`.
+
     Raises:
         HTTPUnauthorized: if error decoding JWT
 
     """
     auth_header = headers.get('Authorization')
+    if not auth_header:
+        raise web.HTTPUnauthorized()
     token = auth_header.replace('Bearer ', '')
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
-        return jwt.decode(
+        decoded = jwt.decode(
             token,
             key=JWT_SECRET_KEY,
             algorithms=JWT_ALGORITHM,
@@ -72,12 +199,18 @@ def get_token_data(headers: CIMultiDictProxy) -> dict:
             ),
         )
         raise web.HTTPUnauthorized()
+    token_cache.put(token, decoded)
+    return decoded
 
 
 async def get_current_user_id(request: web.Request) -> int:
     """
     Get user id from JWT.
 
+    Claims stored on request by `check_login` middleware are used
+    if there are any, otherwise token is decoded and stored on request.
+    User id is also set to `current_user_id` context variable.
+
     Args:
         request (web.Request): aiohttp request
 
@@ -88,8 +221,12 @@ async def get_current_user_id(request: web.Request) -> int:
         HTTPUnauthorized: if JWT has no user data
 
     """
-    decoded = get_token_data(headers=request.headers)
+    decoded = request.get(TOKEN_DATA_KEY)
+    if decoded is None:
+        decoded = get_token_data(headers=request.headers)
+        request[TOKEN_DATA_KEY] = decoded
     user_id = decoded.get('user_id')
     if not user_id:
         raise web.HTTPUnauthorized()
+    current_user_id.set(user_id)
     return user_id
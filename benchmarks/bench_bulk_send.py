@@ -0,0 +1,203 @@
+"""
+Bulk sending benchmark.
+
+Sends one message to many recipients the way `send_bulk` does:
+recipients are split into transactions by `plan_batches`, queued in
+outbox and delivered by outbox workers under per-domain limits over
+SMTP pool to local SMTP sink. Outbox is kept in memory instead of db.
+Reports transactions and recipients per second for SMTP pool sizes.
+
+Run from project root: `python -m benchmarks.bench_bulk_send`
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Optional, Sequence
+
+from benchmarks.smtp_sink import SMTPSink
+from config_model import OutboxConfig, SMTPConfig
+from db.schema import Outbox, OutboxPayload
+from emailing.bulk import plan_batches
+from emailing.email_message import Splice
+from emailing.outbox import OutboxWorkerPool
+from emailing.smtp_client import SMTPClient
+
+DOMAINS = ('example.com', 'example.org', 'example.net', 'mail.test')
+PAYLOAD = (
+    b'From: bench@example.com\r\n'
+    b'To: undisclosed-recipients:;\r\n'
+    b'Subject: bulk benchmark\r\n'
+    b'\r\n'
+    b'Hello!\r\n'
+)
+
+
+class MemoryOutbox(OutboxWorkerPool):
+    """Outbox with queue in memory, delivery path is not changed."""
+
+    def __init__(self, smtp: SMTPClient, config: OutboxConfig):
+        """
+        Init class instance.
+
+        Args:
+            smtp (SMTPClient): SMTP client
+            config (OutboxConfig): outbox config
+
+        """
+        super().__init__(db_engine=None, smtp=smtp, config=config)
+        self.queue: list = []
+        self.statuses: dict = {}
+        self.done = asyncio.Event()
+        self._expected = 0
+
+    async def enqueue_many(  # noqa:WPS211
+        self,
+        user: int,
+        sender: str,
+        batches: Sequence[Sequence[str]],
+        payload: bytes,
+        letter: Optional[int] = None,
+        attachments: Optional[Sequence[Splice]] = None,
+    ) -> List[int]:
+        """
+        Queue transactions sharing one payload.
+
+        Args:
+            user (int): user id
+            sender (str): envelope sender
+            batches (Sequence[Sequence[str]]): recipients of transactions
+            payload (bytes): serialized message
+            letter (Optional[int]): letter id
+            attachments (Optional[Sequence[Splice]]): attachments splices
+
+        Returns:
+            outbox_ids (List[int]): ids of queued messages
+
+        """
+        content = OutboxPayload(id=1, payload=payload, attachments=None)
+        start = self._expected
+        for number, recipients in enumerate(batches, start=start):
+            message = Outbox(
+                id=number,
+                user=user,
+                sender=sender,
+                recipients=list(recipients),
+                attempts=0,
+            )
+            self.queue.append((message, content))
+        self._expected += len(batches)
+        self._wakeup.set()
+        return list(range(start, self._expected))
+
+    async def _claim(self):
+        batch = self.queue[:self.config.batch_size]
+        del self.queue[:len(batch)]  # noqa:WPS420
+        for message, _ in batch:
+            message.attempts += 1
+        return batch
+
+    async def _update(self, outbox_id: int, **values):
+        status = values['status']
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if sum(self.statuses.values()) >= self._expected:
+            self.done.set()
+
+
+async def run_once(args: argparse.Namespace, port: int, pool_size: int):
+    """
+    Send message to all recipients with given pool size.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+        port (int): sink port
+        pool_size (int): SMTP pool size
+
+    Returns:
+        result (tuple): number of transactions and statuses
+
+    """
+    smtp = SMTPClient(
+        config=SMTPConfig(
+            host='127.0.0.1',
+            port=port,
+            pool_size=pool_size,
+            max_rcpt_per_transaction=args.rcpt_limit,
+            max_messages_per_connection=10 ** 6,
+            domain_concurrency=args.domain_concurrency,
+        ),
+    )
+    await smtp.connect()
+    outbox = MemoryOutbox(
+        smtp=smtp,
+        config=OutboxConfig(workers=args.workers),
+    )
+    outbox.start()
+    recipients = [
+        'user{0}@{1}'.format(number, DOMAINS[number % len(DOMAINS)])
+        for number in range(args.recipients)
+    ]
+    try:
+        queued = await outbox.enqueue_many(
+            user=1,
+            sender='bench@example.com',
+            batches=plan_batches(recipients, args.rcpt_limit),
+            payload=PAYLOAD,
+        )
+        await outbox.done.wait()
+    finally:
+        await outbox.stop()
+        await smtp.close()
+    return len(queued), outbox.statuses
+
+
+async def main(args: argparse.Namespace):
+    """
+    Run benchmark.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+
+    """
+    sink = SMTPSink(delay=args.delay)
+    port = await sink.start()
+    print(
+        'recipients: {0}, rcpt limit: {1}, domain concurrency: {2}, '
+        'reply delay: {3} s'.format(
+            args.recipients,
+            args.rcpt_limit,
+            args.domain_concurrency,
+            args.delay,
+        ),
+    )
+    for pool_size in args.pool_sizes:
+        recipients_before = sink.recipients
+        started = time.perf_counter()
+        transactions, statuses = await run_once(args, port, pool_size)
+        elapsed = time.perf_counter() - started
+        print(
+            'pool {0:3d}: {1:6d} transactions, {2:9.1f} msg/s, '
+            '{3:9.1f} rcpt/s, {4}'.format(
+                pool_size,
+                transactions,
+                transactions / elapsed,
+                (sink.recipients - recipients_before) / elapsed,
+                statuses,
+            ),
+        )
+    await sink.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=20000)
+    parser.add_argument('--rcpt-limit', type=int, default=100)
+    parser.add_argument('--domain-concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.001)
+    parser.add_argument(
+        '--pool-sizes',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4, 8],
+    )
+    asyncio.run(main(parser.parse_args()))
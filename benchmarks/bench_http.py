@@ -0,0 +1,151 @@
+"""
+HTTP throughput benchmark of single worker.
+
+Starts one app worker on every selected event loop, serving `/metrics`
+route without db access, loads it from client processes over keep-alive
+connections and reports requests per second of the worker. With `--url`
+running server is loaded instead.
+
+Run from project root:
+`python -m benchmarks.bench_http --loops asyncio uvloop`
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+from config_model import WebAppConfig
+from event_loop import run_app
+from metrics import metrics_view
+
+
+def serve(loop: str, port: int):
+    """
+    Run worker with `/metrics` route.
+
+    Args:
+        loop (str): event loop, `asyncio` or `uvloop`
+        port (int): port to listen
+
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_view)
+    run_app(
+        app=app,
+        config=WebAppConfig(host='127.0.0.1', port=port, loop=loop),
+        access_log=None,
+        print=None,
+    )
+
+
+async def load(url: str, connections: int, seconds: float) -> int:
+    """
+    Send requests over keep-alive connections for given time.
+
+    Args:
+        url (str): requested url
+        connections (int): concurrent connections
+        seconds (float): duration
+
+    Returns:
+        requests (int): completed requests
+
+    """
+    deadline = time.perf_counter() + seconds
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def client() -> int:  # noqa:WPS430
+            completed = 0
+            while time.perf_counter() < deadline:
+                async with session.get(url) as response:
+                    await response.read()
+                completed += 1
+            return completed
+
+        return sum(
+            await asyncio.gather(*[client() for _ in range(connections)]),
+        )
+
+
+def run_client(url: str, connections: int, seconds: float, results):
+    """
+    Run load in client process.
+
+    Args:
+        url (str): requested url
+        connections (int): concurrent connections
+        seconds (float): duration
+        results: queue for number of completed requests
+
+    """
+    results.put(asyncio.run(load(url, connections, seconds)))
+
+
+def measure(args: argparse.Namespace, url: str) -> float:
+    """
+    Load url from client processes.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+        url (str): requested url
+
+    Returns:
+        rate (float): requests per second
+
+    """
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    clients: List[multiprocessing.Process] = [
+        multiprocessing.Process(
+            target=run_client,
+            args=(url, args.connections, args.seconds, results),
+        )
+        for _ in range(args.clients)
+    ]
+    for process in clients:
+        process.start()
+    completed = sum(results.get() for _ in clients)
+    for process in clients:
+        process.join()
+    return completed / args.seconds
+
+
+def main(args: argparse.Namespace):
+    """
+    Run benchmark.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+
+    """
+    if args.url:
+        print('{0}: {1:9.1f} req/s'.format(args.url, measure(args, args.url)))
+        return
+    for loop in args.loops:
+        server = multiprocessing.Process(target=serve, args=(loop, args.port))
+        server.start()
+        time.sleep(1)
+        url = 'http://127.0.0.1:{0}/metrics'.format(args.port)
+        try:
+            print('{0:8s} worker: {1:9.1f} req/s'.format(
+                loop,
+                measure(args, url),
+            ))
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='load running server instead')
+    parser.add_argument('--loops', nargs='+', default=['asyncio', 'uvloop'])
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    main(parser.parse_args())
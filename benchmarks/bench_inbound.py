@@ -0,0 +1,116 @@
+"""
+Inbound delivery benchmark.
+
+Delivers messages to running LMTP receiver over several concurrent
+connections and reports deliveries per second. Receiver must be
+enabled in config and recipient must be a local user.
+
+Run from project root:
+`python -m benchmarks.bench_inbound --port 2424 --recipient user@example.com`
+"""
+import argparse
+import asyncio
+import time
+
+MESSAGE = (
+    b'From: bench@example.org\r\n'
+    b'To: {recipient}\r\n'
+    b'Subject: inbound benchmark #{number}\r\n'
+    b'\r\n'
+    b'Hello!\r\n'
+)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read single, possibly multiline, reply.
+
+    Args:
+        reader (asyncio.StreamReader): server stream
+
+    Returns:
+        reply (bytes): last line of reply
+
+    Raises:
+        ConnectionError: if connection was closed
+
+    """
+    while True:  # noqa:WPS457
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError
+        if line[3:4] != b'-':
+            return line
+
+
+async def deliver(args: argparse.Namespace, count: int) -> int:
+    """
+    Deliver messages over single connection with pipelined envelope.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+        count (int): messages to deliver
+
+    Returns:
+        delivered (int): accepted deliveries
+
+    """
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    await read_reply(reader)
+    writer.write(b'LHLO bench\r\n')
+    await read_reply(reader)
+    delivered = 0
+    envelope = 'MAIL FROM:<bench@example.org>\r\nRCPT TO:<{0}>\r\nDATA\r\n'
+    for number in range(count):
+        writer.write(envelope.format(args.recipient).encode())
+        replies = [await read_reply(reader) for _ in range(3)]
+        if not replies[2].startswith(b'354'):
+            raise RuntimeError(replies)
+        writer.write(
+            MESSAGE.replace(
+                b'{recipient}',
+                args.recipient.encode(),
+            ).replace(
+                b'{number}',
+                str(number).encode(),
+            ) + b'.\r\n',
+        )
+        if (await read_reply(reader)).startswith(b'250'):
+            delivered += 1
+    writer.write(b'QUIT\r\n')
+    await read_reply(reader)
+    writer.close()
+    return delivered
+
+
+async def main(args: argparse.Namespace):
+    """
+    Run benchmark.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+
+    """
+    started = time.perf_counter()
+    delivered = await asyncio.gather(
+        *[
+            deliver(args, args.messages // args.connections)
+            for _ in range(args.connections)
+        ],
+    )
+    elapsed = time.perf_counter() - started
+    print('connections {0:3d}: {1:6d} delivered, {2:9.1f} msg/s'.format(
+        args.connections,
+        sum(delivered),
+        sum(delivered) / elapsed,
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2424)
+    parser.add_argument('--recipient', required=True)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
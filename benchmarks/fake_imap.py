@@ -0,0 +1,262 @@
+"""
+Local fake IMAP server for sync checks.
+
+Server keeps messages in memory and implements only commands used by
+sync client. Messages added with `append` are pushed to idling
+clients.
+
+Run from project root:
+`python -m benchmarks.fake_imap --port 1143 --messages 10000`
+"""
+import argparse
+import asyncio
+import re
+from typing import Dict, List, Set, Tuple
+
+COMMAND_PATTERN = re.compile(rb'^(\S+) (.*?)\r?\n$', re.S)
+MESSAGE = (
+    b'From: sender{number}@example.org\r\n'
+    b'To: user@example.com\r\n'
+    b'Subject: fake message #{number}\r\n'
+    b'Date: Tue, 18 Jan 2022 09:37:29 +0300\r\n'
+    b'\r\n'
+    b'Body of message #{number}.\r\n'
+)
+
+
+def make_message(number: int) -> bytes:
+    """
+    Make test message.
+
+    Args:
+        number (int): message number
+
+    Returns:
+        raw (bytes): message
+
+    """
+    return MESSAGE.replace(b'{number}', str(number).encode())
+
+
+def parse_uid_set(uid_set: str, last: int) -> Set[int]:
+    """
+    Parse UID sequence set, e.g. `1:3,7,9:*`.
+
+    Args:
+        uid_set (str): sequence set
+        last (int): value of `*`
+
+    Returns:
+        uids (Set[int]): UIDs
+
+    """
+    uids = set()
+    for part in uid_set.split(','):
+        first, _, end = part.partition(':')
+        first = last if first == '*' else int(first)
+        end = first if not end else (last if end == '*' else int(end))
+        uids.update(range(min(first, end), max(first, end) + 1))
+    return uids
+
+
+class FakeIMAPServer(object):
+    """In-memory IMAP server."""
+
+    def __init__(self, uidvalidity: int = 1, idle: bool = True):
+        """
+        Init class instance.
+
+        Args:
+            uidvalidity (int): UIDVALIDITY of folders
+            idle (bool): announce `IDLE` capability
+
+        """
+        self.uidvalidity = uidvalidity
+        self.idle = idle
+        self.folders: Dict[str, List[Tuple[int, bytes]]] = {'INBOX': []}
+        self.uidnext: Dict[str, int] = {'INBOX': 1}
+        self.connections = 0
+        self.fetched = 0
+        self.server = None
+        self._idlers: Set[asyncio.Event] = set()
+
+    def append(self, folder: str, raw: bytes) -> int:
+        """
+        Add message and notify idling clients.
+
+        Args:
+            folder (str): folder name
+            raw (bytes): message
+
+        Returns:
+            uid (int): UID of message
+
+        """
+        uid = self.uidnext.setdefault(folder, 1)
+        self.folders.setdefault(folder, []).append((uid, raw))
+        self.uidnext[folder] = uid + 1
+        for idler in self._idlers:
+            idler.set()
+        return uid
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """
+        Start server.
+
+        Args:
+            host (str): host to listen
+            port (int): port to listen, random if 0
+
+        Returns:
+            port (int): listened port
+
+        """
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop server."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        self.connections += 1
+        capabilities = 'IMAP4rev1 IDLE' if self.idle else 'IMAP4rev1'
+        writer.write(
+            '* OK [CAPABILITY {0}] fake ready\r\n'.format(
+                capabilities,
+            ).encode(),
+        )
+        selected = 'INBOX'
+        while True:  # noqa:WPS457
+            line = await reader.readline()
+            match = COMMAND_PATTERN.match(line)
+            if not match:
+                break
+            tag, command = match.group(1), match.group(2).decode()
+            name = command.split(' ', 1)[0].upper()
+            if name in {'EXAMINE', 'SELECT'}:
+                selected = command.split(' ', 1)[1].strip('"')
+                messages = self.folders.setdefault(selected, [])
+                writer.write(
+                    '* {0} EXISTS\r\n'
+                    '* OK [UIDVALIDITY {1}] UIDs valid\r\n'
+                    '* OK [UIDNEXT {2}] Predicted next UID\r\n'.format(
+                        len(messages),
+                        self.uidvalidity,
+                        self.uidnext.setdefault(selected, 1),
+                    ).encode(),
+                )
+            elif command.upper().startswith('UID SEARCH'):
+                self._search(writer, selected, command)
+            elif command.upper().startswith('UID FETCH'):
+                self._fetch(writer, selected, command)
+            elif name == 'IDLE':
+                await self._idle(reader, writer)
+            elif name == 'LOGOUT':
+                writer.write(b'* BYE fake\r\n' + tag + b' OK LOGOUT\r\n')
+                break
+            writer.write(tag + b' OK ' + name.encode() + b' completed\r\n')
+            await writer.drain()
+        await writer.drain()
+        writer.close()
+
+    def _search(self, writer: asyncio.StreamWriter, folder: str, command: str):
+        messages = self.folders[folder]
+        last = messages[-1][0] if messages else 0
+        uids = parse_uid_set(command.split()[-1], last)
+        writer.write(
+            '* SEARCH {0}\r\n'.format(
+                ' '.join(str(uid) for uid, _ in messages if uid in uids),
+            ).encode().replace(b' \r\n', b'\r\n'),
+        )
+
+    def _fetch(self, writer: asyncio.StreamWriter, folder: str, command: str):
+        messages = self.folders[folder]
+        last = messages[-1][0] if messages else 0
+        uids = parse_uid_set(command.split()[2], last)
+        headers_only = 'HEADER' in command.upper()
+        for number, (uid, raw) in enumerate(messages, 1):
+            if uid not in uids:
+                continue
+            self.fetched += 1
+            data = raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+            if not headers_only:
+                data = raw
+            writer.write(
+                '* {0} FETCH (UID {1} FLAGS () RFC822.SIZE {2} {3} {{{4}}}'
+                '\r\n'.format(
+                    number,
+                    uid,
+                    len(raw),
+                    'BODY[HEADER]' if headers_only else 'BODY[]',
+                    len(data),
+                ).encode() + data + b')\r\n',
+            )
+
+    async def _idle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        idler = asyncio.Event()
+        self._idlers.add(idler)
+        writer.write(b'+ idling\r\n')
+        await writer.drain()
+        done = asyncio.ensure_future(reader.readline())
+        try:
+            while not done.done():
+                notified = asyncio.ensure_future(idler.wait())
+                await asyncio.wait(
+                    [done, notified],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                notified.cancel()
+                if idler.is_set():
+                    idler.clear()
+                    writer.write(
+                        '* {0} EXISTS\r\n'.format(
+                            len(self.folders['INBOX']),
+                        ).encode(),
+                    )
+                    await writer.drain()
+        finally:
+            self._idlers.discard(idler)
+
+
+async def main(args: argparse.Namespace):
+    """
+    Run server with generated messages until interrupted.
+
+    Args:
+        args (argparse.Namespace): parsed arguments
+
+    """
+    server = FakeIMAPServer()
+    for number in range(args.messages):
+        server.append('INBOX', make_message(number))
+    port = await server.start(args.host, args.port)
+    print('fake IMAP server on port {0}'.format(port))
+    if not args.interval:
+        await asyncio.Event().wait()
+    while True:  # noqa:WPS457
+        await asyncio.sleep(args.interval)
+        server.append('INBOX', make_message(len(server.folders['INBOX'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1143)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=5.0,
+        help='seconds between new messages',
+    )
+    asyncio.run(main(parser.parse_args()))
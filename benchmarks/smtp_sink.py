@@ -0,0 +1,94 @@
+"""
+Local SMTP sink for benchmarks.
+
+Server accepts every message and drops it, reply delay emulates
+network round trip to real SMTP server.
+"""
+import asyncio
+
+EHLO_REPLY = (
+    b'250-sink\r\n'
+    b'250-PIPELINING\r\n'
+    b'250-SIZE 104857600\r\n'
+    b'250 8BITMIME\r\n'
+)
+
+
+class SMTPSink(object):
+    """SMTP sink server."""
+
+    def __init__(self, delay: float = 0):
+        """
+        Init class instance.
+
+        Args:
+            delay (float): seconds before every reply
+
+        """
+        self.delay = delay
+        self.messages = 0
+        self.recipients = 0
+        self.connections = 0
+        self.server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """
+        Start server.
+
+        Args:
+            host (str): host to listen
+            port (int): port to listen, random if 0
+
+        Returns:
+            port (int): listened port
+
+        """
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop server."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _reply(self, writer: asyncio.StreamWriter, reply: bytes):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        writer.write(reply)
+        await writer.drain()
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        self.connections += 1
+        await self._reply(writer, b'220 sink ready\r\n')
+        while True:  # noqa:WPS457
+            line = await reader.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command in {b'EHLO', b'LHLO'}:
+                await self._reply(writer, EHLO_REPLY)
+            elif command == b'RCPT':
+                self.recipients += 1
+                await self._reply(writer, b'250 ok\r\n')
+            elif command == b'DATA':
+                await self._reply(writer, b'354 go ahead\r\n')
+                await self._read_data(reader)
+                self.messages += 1
+                await self._reply(writer, b'250 queued\r\n')
+            elif command == b'QUIT':
+                await self._reply(writer, b'221 bye\r\n')
+                break
+            else:
+                await self._reply(writer, b'250 ok\r\n')
+        writer.close()
+
+    @staticmethod
+    async def _read_data(reader: asyncio.StreamReader):
+        while True:  # noqa:WPS457
+            line = await reader.readline()
+            if line in {b'.\r\n', b''}:
+                return
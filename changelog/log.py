@@ -0,0 +1,216 @@
+"""
+Letter change log module.
+
+`letter` trigger appends entry to `letter_change` table on every
+insert, update and delete, with sequence number increasing in commit
+order of user. Client keeps `seq` of the last change it has seen and
+gets changes after it merged into deltas: created letters, changed
+fields and deleted ids. Entries older than retention are removed, so
+client with older `seq` is asked to reload letters instead.
+"""
+import asyncio
+import datetime
+import logging
+from typing import Dict, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.orm import aliased
+
+from config_model import ChangeLogConfig
+from db.psql_engine import PostgresEngine
+from db.schema import LetterChange
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeLog(object):
+    """Reader and compactor of letter change log."""
+
+    def __init__(self, config: ChangeLogConfig, db_engine: PostgresEngine):
+        """
+        Init class instance.
+
+        Args:
+            config (ChangeLogConfig): change log config
+            db_engine (PostgresEngine): db engine
+
+        """
+        self.config = config
+        self.db_engine = db_engine
+        self._task: Optional[asyncio.Task] = None
+        self._read = registry.counter('changelog_read')
+        self._resyncs = registry.counter('changelog_resyncs')
+        self._compacted = registry.counter('changelog_compacted')
+
+    def start(self):
+        """Start periodic compaction."""
+        self._task = asyncio.create_task(self._compact_periodically())
+
+    async def stop(self):
+        """Stop compaction."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        logger.info('Change log has been stopped.')
+
+    async def changes(
+        self,
+        user_id: int,
+        since: int,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """
+        Get changes of user letters after sequence number.
+
+        Entries are read with single query, together with bounds of
+        the log. Changes of the same letter are merged, letter created
+        and deleted after `since` is not returned at all.
+
+        Args:
+            user_id (int): user id
+            since (int): `seq` of the last seen change, 0 if none
+            limit (Optional[int]): max entries, `page_size` if None
+
+        Returns:
+            delta (dict): `seq` to continue from, `created` letters,
+                `updated` fields with letter `id`, `deleted` ids,
+                `more` if limit was reached and `resync` if entries
+                after `since` were compacted and letters must be reloaded
+
+        Raises:
+            ValueError: if `limit` is less than 1
+
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('Limit must be positive')
+        limit = min(limit or self.config.page_size, self.config.page_size)
+        bounds = sa.select(
+            sa.func.min(LetterChange.seq).label('first'),
+            sa.func.max(LetterChange.seq).label('last'),
+        ).subquery('bounds')
+        entries = sa.select(
+            LetterChange.seq,
+            LetterChange.letter,
+            LetterChange.op,
+            LetterChange.fields,
+        ).where(
+            LetterChange.user == user_id,
+            LetterChange.seq > since,
+        ).order_by(
+            LetterChange.seq,
+        ).limit(
+            limit + 1,
+        ).subquery('entries')
+        stmt = sa.select(
+            bounds.c.first,
+            bounds.c.last,
+            entries,
+        ).select_from(
+            bounds.outerjoin(entries, sa.true()),
+        ).order_by(
+            entries.c.seq,
+        )
+        async with self.db_engine.session() as session:
+            rows = (await session.execute(stmt)).all()
+        first, last = rows[0].first, rows[0].last
+        if first is not None and since + 1 < first:
+            self._resyncs.inc()
+            return self._delta(seq=last, resync=True)
+        rows = [row for row in rows if row.seq is not None]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        self._read.inc(len(rows))
+        delta = self._delta(seq=rows[-1].seq if rows else since, more=more)
+        created: Dict[int, dict] = {}
+        updated: Dict[int, dict] = {}
+        deleted = set()
+        for row in rows:
+            if row.op == 'I':
+                created[row.letter] = row.fields
+            elif row.op == 'D':
+                updated.pop(row.letter, None)
+                if created.pop(row.letter, None) is None:
+                    deleted.add(row.letter)
+            elif row.letter in created:
+                created[row.letter].update(row.fields)
+            else:
+                updated.setdefault(row.letter, {'id': row.letter}).update(
+                    row.fields,
+                )
+        delta['created'] = list(created.values())
+        delta['updated'] = list(updated.values())
+        delta['deleted'] = sorted(deleted)
+        return delta
+
+    async def compact(self) -> int:
+        """
+        Remove entries which are not needed anymore.
+
+        Entries older than retention are removed, except the last one
+        keeping the current `seq`. Inserts and updates of letters which
+        were deleted later are removed, client gets only delete of them.
+
+        Returns:
+            removed (int): number of removed entries
+
+        """
+        threshold = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.config.retention,
+        )
+        last = sa.select(sa.func.max(LetterChange.seq)).scalar_subquery()
+        deleted = aliased(LetterChange)
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                expired = await session.execute(
+                    sa.delete(LetterChange).where(
+                        LetterChange.created < threshold,
+                        LetterChange.seq < last,
+                    ).execution_options(
+                        synchronize_session=False,
+                    ),
+                )
+                superseded = await session.execute(
+                    sa.delete(LetterChange).where(
+                        LetterChange.op != 'D',
+                        deleted.letter == LetterChange.letter,
+                        deleted.op == 'D',
+                        deleted.seq > LetterChange.seq,
+                    ).execution_options(
+                        synchronize_session=False,
+                    ),
+                )
+        removed = expired.rowcount + superseded.rowcount
+        self._compacted.inc(removed)
+        return removed
+
+    async def _compact_periodically(self):
+        while True:  # noqa:WPS457
+            try:
+                removed = await self.compact()
+            except Exception as exception:
+                logger.exception(
+                    'Change log compaction was failed. {0}'.format(exception),
+                )
+            else:
+                logger.info(
+                    'Change log was compacted, {0} entries removed.'.format(
+                        removed,
+                    ),
+                )
+            await asyncio.sleep(self.config.compact_interval)
+
+    @staticmethod
+    def _delta(
+        seq: Optional[int],
+        more: bool = False,
+        resync: bool = False,
+    ) -> dict:
+        return {
+            'seq': seq or 0,
+            'created': [],
+            'updated': [],
+            'deleted': [],
+            'more': more,
+            'resync': resync,
+        }
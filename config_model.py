@@ -5,7 +5,7 @@ Module describe structure of application config.
 """
 
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class SMTPConfig(BaseModel):
@@ -14,6 +14,13 @@ class SMTPConfig(BaseModel):
     host: str
     port: Optional[int] = 25
     domain: str = ''  # e.g. `@google.com`
+    timeout: float = 60.0  # seconds
+    pool_size: int = 4
+    max_messages_per_connection: int = 100  # connection is reopened after
+    keepalive_interval: float = 30.0  # seconds, `NOOP` for idle connections
+    domain_concurrency: int = 4  # concurrent deliveries per recipient domain
+    local_domain_concurrency: int = 16  # same for `domain`
+    max_rcpt_per_transaction: int = 100
 
 
 class WebAppConfig(BaseModel):
@@ -21,6 +28,13 @@ class WebAppConfig(BaseModel):
 
     host: str
     port: int = 8080
+    loop: str = 'auto'  # `auto`, `uvloop` or `asyncio`, auto prefers uvloop
+    executor_workers: int = 0  # threads of default executor, 0 for default
+    slow_callback_duration: float = 0.0  # seconds, logged if > 0, debug mode
+    keepalive_timeout: float = 75.0  # seconds, idle HTTP connection is closed
+    backlog: int = 128  # pending connections of listening socket
+    shutdown_timeout: float = 30.0  # seconds, draining of requests on stop
+    drain_exclude: List[str] = ['/socket.io/']  # routes not waited on stop
 
 
 class LoggerConfig(BaseModel):
@@ -38,6 +52,111 @@ class PostgresConfig(BaseModel):
     database: str
     hostname: str
     port: str = '5432'
+    pool_size: int = 5
+    max_overflow: int = 10
+    user_max_in_flight: int = 4  # concurrent queries of single user
+    user_weights: Dict[int, int] = {}  # round-robin weight by user id
+
+
+class OutboxConfig(BaseModel):
+    """Outbox delivery workers config."""
+
+    workers: int = 4
+    batch_size: int = 20  # messages claimed by worker at once
+    poll_interval: float = 5.0  # seconds, if no messages were enqueued
+    lease_timeout: float = 300.0  # seconds, claimed message is retried after
+    max_attempts: int = 8
+    retry_base_delay: float = 60.0  # seconds, delay after first failure
+    retry_max_delay: float = 3600.0  # seconds
+
+
+class AuthConfig(BaseModel):
+    """Password hashing config."""
+
+    hash_rounds: int = 29000
+    hash_workers: int = 2
+    hash_queue_size: int = 64  # pending jobs over workers before 503
+    retry_after: int = 1  # seconds, for 503 response
+
+
+class AdmissionConfig(BaseModel):
+    """Admission control config."""
+
+    enabled: bool = True
+    initial_limit: int = 20  # concurrent requests per route at start
+    min_limit: int = 2
+    max_limit: int = 200
+    routes: Dict[str, int] = {}  # max limit by route, e.g. `/api/crud/letter`
+    exclude: List[str] = ['/socket.io/', '/metrics']
+    queue_size: int = 100  # waiting requests per route before 503
+    queue_timeout: float = 5.0  # seconds
+    retry_after: int = 1  # seconds, for 503 response
+    latency_target: float = 0.05  # seconds, average db query latency
+    increase: float = 1.0  # additive increase of limit
+    decrease_factor: float = 0.75  # multiplicative decrease of limit
+    adjust_interval: float = 1.0  # seconds
+
+
+class StorageConfig(BaseModel):
+    """Attachment store config."""
+
+    root: str = 'attachments'  # directory of stored files
+    chunk_size: int = 65536  # bytes, read from upload at once
+    max_size: int = 52428800  # bytes, max size of single attachment
+    gc_interval: float = 3600.0  # seconds, between unreferenced files removal
+    gc_grace: float = 86400.0  # seconds, keep unreferenced file for outbox
+
+
+class InboundConfig(BaseModel):
+    """Inbound LMTP/SMTP receiver config."""
+
+    enabled: bool = False
+    host: str = '127.0.0.1'
+    port: int = 2424
+    protocol: str = 'lmtp'  # `lmtp` or `smtp`
+    domain: str = ''  # local domain, e.g. `@google.com`, SMTP one if empty
+    mailbox: str = 'Inbox'  # mailbox name for delivered letters
+    max_size: int = 26214400  # bytes, max message size
+    max_recipients: int = 100
+    timeout: float = 300.0  # seconds, client command timeout
+    parse_workers: int = 2  # processes parsing messages
+    batch_size: int = 500  # letters inserted with single statement
+    batch_delay: float = 0.005  # seconds, max wait for batch to fill
+
+
+class SyncConfig(BaseModel):
+    """Upstream IMAP sync config."""
+
+    enabled: bool = False
+    folders: Dict[str, str] = {'INBOX': 'Inbox'}  # mailbox name by folder
+    max_connections: int = 20  # open IMAP connections of all accounts
+    batch_size: int = 500  # headers fetched and inserted at once
+    poll_interval: float = 300.0  # seconds, if account can not `IDLE`
+    idle_timeout: float = 1740.0  # seconds, `IDLE` is restarted after
+    accounts_interval: float = 60.0  # seconds, between accounts reload
+    timeout: float = 60.0  # seconds, IMAP command timeout
+    retry_delay: float = 60.0  # seconds, after failed sync of account
+    bloom_error_rate: float = 0.001  # false positives of synced UIDs filter
+
+
+class ChangeLogConfig(BaseModel):
+    """Letter change log config."""
+
+    page_size: int = 1000  # max entries read at once
+    retention: float = 604800.0  # seconds, entries are removed after
+    compact_interval: float = 3600.0  # seconds, between compactions
+
+
+class SocketIOConfig(BaseModel):
+    """Socket.IO config."""
+
+    manager: str = 'local'  # `local`, `memory`, `unix` or `postgres`
+    channel: str = 'socketio'  # bus channel of pub/sub managers
+    socket_dir: str = '/tmp/mail_client_socketio'  # sockets of `unix` one
+    batch_interval: float = 0.1  # seconds, letter changes are merged for
+    queue_size: int = 50  # batches waiting for session before resync
+    ack_timeout: float = 10.0  # seconds, max wait for batch acknowledge
+    counter_interval: float = 2.0  # seconds, between unsubscribed counters
 
 
 class MainConfig(BaseModel):
@@ -47,3 +166,11 @@ class MainConfig(BaseModel):
     logger: LoggerConfig
     db: PostgresConfig
     smtp: SMTPConfig
+    outbox: OutboxConfig = OutboxConfig()
+    auth: AuthConfig = AuthConfig()
+    admission: AdmissionConfig = AdmissionConfig()
+    storage: StorageConfig = StorageConfig()
+    inbound: InboundConfig = InboundConfig()
+    sync: SyncConfig = SyncConfig()
+    socketio: SocketIOConfig = SocketIOConfig()
+    changelog: ChangeLogConfig = ChangeLogConfig()
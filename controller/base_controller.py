@@ -77,8 +77,17 @@ class BaseController(IController):
             return await self.service.delete(
                 entity_id=entity_id,
             )
-        elif command == 'send':  # TODO
-            return await self.service.send_email()
+        elif command == 'send':
+            return await self.service.send_email(
+                entity_id=entity_id,
+                user_id=user_id,
+            )
+        elif command == 'send_bulk':
+            return await self.service.send_bulk(
+                request_body=request_body,
+                entity_id=entity_id,
+                user_id=user_id,
+            )
         raise web.HTTPBadRequest()
 
     async def process_get(
@@ -0,0 +1,123 @@
+"""Added letter notify trigger
+
+Revision ID: 7e2a9c4b1f53
+Revises: 3c8d5e2f7a19
+Create Date: 2026-10-19 20:03:17.640215
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2a9c4b1f53'
+down_revision = '3c8d5e2f7a19'
+branch_labels = None
+depends_on = None
+
+# Payload keys: `u` user, `l` letter, `m` mailbox, `op` I/U/D,
+# `r` is_read, `d` unread delta of `m`, `pm` previous mailbox of moved
+# letter and `pd` unread delta of `pm`. Statements changing more than
+# 100 rows send one payload per user mailbox with rows number `n`
+# instead of `l` and `r`.
+NOTIFY_FUNCTION = """
+CREATE FUNCTION letter_notify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF (SELECT count(*) FROM new_rows) <= 100 THEN
+            PERFORM pg_notify('letter_change', json_build_object(
+                'u', n."user", 'l', n.id, 'm', n.mailbox, 'op', 'I',
+                'r', n.is_read, 'd', (NOT n.is_read)::int
+            )::text)
+            FROM new_rows n;
+        ELSE
+            PERFORM pg_notify('letter_change', json_build_object(
+                'u', n."user", 'm', n.mailbox, 'op', 'I', 'n', count(*),
+                'd', count(*) FILTER (WHERE NOT n.is_read)
+            )::text)
+            FROM new_rows n
+            GROUP BY n."user", n.mailbox;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF (SELECT count(*) FROM old_rows) <= 100 THEN
+            PERFORM pg_notify('letter_change', json_build_object(
+                'u', o."user", 'l', o.id, 'm', o.mailbox, 'op', 'D',
+                'r', o.is_read, 'd', -(NOT o.is_read)::int
+            )::text)
+            FROM old_rows o;
+        ELSE
+            PERFORM pg_notify('letter_change', json_build_object(
+                'u', o."user", 'm', o.mailbox, 'op', 'D', 'n', count(*),
+                'd', -count(*) FILTER (WHERE NOT o.is_read)
+            )::text)
+            FROM old_rows o
+            GROUP BY o."user", o.mailbox;
+        END IF;
+    ELSIF (SELECT count(*) FROM new_rows) <= 100 THEN
+        PERFORM pg_notify('letter_change', json_strip_nulls(json_build_object(
+            'u', n."user", 'l', n.id, 'm', n.mailbox, 'op', 'U',
+            'r', n.is_read,
+            'd', CASE
+                WHEN n.mailbox = o.mailbox
+                THEN (NOT n.is_read)::int - (NOT o.is_read)::int
+                ELSE (NOT n.is_read)::int
+            END,
+            'pm', NULLIF(o.mailbox, n.mailbox),
+            'pd', CASE
+                WHEN n.mailbox <> o.mailbox THEN -(NOT o.is_read)::int
+            END
+        ))::text)
+        FROM new_rows n JOIN old_rows o USING (id);
+    ELSE
+        PERFORM pg_notify('letter_change', json_build_object(
+            'u', changed.u, 'm', changed.m, 'op', 'U', 'n', sum(changed.c),
+            'd', sum(changed.d)
+        )::text)
+        FROM (
+            SELECT n."user" AS u, n.mailbox AS m, 1 AS c,
+                (NOT n.is_read)::int AS d
+            FROM new_rows n
+            UNION ALL
+            SELECT o."user", o.mailbox, 0, -(NOT o.is_read)::int
+            FROM old_rows o
+        ) changed
+        GROUP BY changed.u, changed.m;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    op.execute(NOTIFY_FUNCTION)
+    op.execute(
+        """
+        CREATE TRIGGER letter_notify_insert
+        AFTER INSERT ON letter
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION letter_notify();
+        """,
+    )
+    op.execute(
+        """
+        CREATE TRIGGER letter_notify_update
+        AFTER UPDATE ON letter
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION letter_notify();
+        """,
+    )
+    op.execute(
+        """
+        CREATE TRIGGER letter_notify_delete
+        AFTER DELETE ON letter
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION letter_notify();
+        """,
+    )
+
+
+def downgrade():
+    op.execute('DROP TRIGGER letter_notify_delete ON letter')
+    op.execute('DROP TRIGGER letter_notify_update ON letter')
+    op.execute('DROP TRIGGER letter_notify_insert ON letter')
+    op.execute('DROP FUNCTION letter_notify()')
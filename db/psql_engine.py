@@ -1,13 +1,21 @@
 """PostgreSQL async client module."""
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import sqlalchemy as sa
+from auth.policy import current_user_id
 from config_model import PostgresConfig
+from limiter.fair_queue import FairScheduler
+from metrics import registry
 from sqlalchemy.ext import asyncio as sa_asyncio
 from sqlalchemy.orm import sessionmaker
 
 logger = logging.getLogger(__name__)
 
+DB_LATENCY_METRIC = 'db_query_seconds'
+
 
 class PostgresEngine(object):   # noqa:WPS214
     """Class implements Postgresql async client."""
@@ -27,6 +35,12 @@ class PostgresEngine(object):   # noqa:WPS214
         self.connection = None
         self.session_maker = None
         self.meta = None
+        self.latency = registry.summary(DB_LATENCY_METRIC)
+        self.scheduler = FairScheduler(
+            capacity=config.pool_size + config.max_overflow,
+            user_limit=config.user_max_in_flight,
+            weights=config.user_weights,
+        )
 
     async def create_engine(self):
         """Create db engine: postgresql+asyncpg."""
@@ -39,11 +53,23 @@ class PostgresEngine(object):   # noqa:WPS214
                 self.config.database,
             ),
             query_cache_size=self.cache_size,
+            pool_size=self.config.pool_size,
+            max_overflow=self.config.max_overflow,
             pool_pre_ping=True,  # check conn every request
             future=True,  # auto begin
         )
         logger.info('Postgresql <engine> was created successfully.')
         self.meta = sa.MetaData(bind=self.engine)
+        sa.event.listen(
+            self.engine.sync_engine,
+            'before_cursor_execute',
+            self._before_cursor_execute,
+        )
+        sa.event.listen(
+            self.engine.sync_engine,
+            'after_cursor_execute',
+            self._after_cursor_execute,
+        )
 
     async def run_session_maker(self):
         """Run session maker factory to create db session."""
@@ -62,7 +88,46 @@ class PostgresEngine(object):   # noqa:WPS214
             )
         logger.info('Postgresql <session> was created successfully.')
 
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[sa_asyncio.AsyncSession]:
+        """
+        Open db session when current user gets its turn in pool queue.
+
+        Yields:
+            session (AsyncSession): db session
+
+        """
+        async with self.scheduler.slot(current_user_id.get()):
+            async with self.session_maker() as session:
+                yield session
+
     async def stop(self):
         """Dispose db engine."""
         await self.engine.dispose()
         logger.info('Postgresql has been stopped successfully.')
+
+    @staticmethod
+    def _before_cursor_execute(  # noqa:WPS211
+        conn,
+        cursor,
+        statement,
+        parameters,
+        context,
+        executemany,
+    ):
+        """Remember query start time, SQLAlchemy event handler."""
+        context.query_started = time.perf_counter()
+
+    def _after_cursor_execute(  # noqa:WPS211
+        self,
+        conn,
+        cursor,
+        statement,
+        parameters,
+        context,
+        executemany,
+    ):
+        """Observe query latency, SQLAlchemy event handler."""
+        self.latency.observe(
+            time.perf_counter() - context.query_started,
+        )
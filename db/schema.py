@@ -5,6 +5,7 @@ autogen command: alembic revision --autogenerate -m "msg"
 
 """
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -24,8 +25,32 @@ class Letter(Base):
     """Letter table schema."""
 
     __tablename__ = 'letter'
+    __table_args__ = (
+        sa.Index(
+            'ix_letter_sync_folder_id_external',
+            'sync_folder',
+            'id_external',
+            unique=True,
+            postgresql_where=sa.text('sync_folder IS NOT NULL'),
+        ),
+        sa.Index(
+            'ix_letter_user_mailbox_import_hash',
+            'user',
+            'mailbox',
+            'import_hash',
+            postgresql_where=sa.text('import_hash IS NOT NULL'),
+        ),
+    )
     id = sa.Column(sa.Integer, primary_key=True)
-    id_external = sa.Column(sa.Integer)  # id from mail server
+    id_external = sa.Column(sa.BigInteger)  # UID from mail server
+    # source folder of synced letter
+    sync_folder = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('sync_folder.id', ondelete='SET NULL'),
+        nullable=True,
+    )
+    # hash of `Message-ID` of imported letter, see `mail_import`
+    import_hash = sa.Column(sa.BigInteger, nullable=True)
     sender = sa.Column(sa.String, nullable=False)  # from
     to = sa.Column(sa.String, nullable=False, default=' ')
     subject = sa.Column(sa.String, nullable=True)
@@ -37,6 +62,12 @@ class Letter(Base):
     mailbox = sa.Column(sa.Integer, sa.ForeignKey('mailbox.id'), nullable=False)
     is_important = sa.Column(sa.Boolean, default=False)
     is_read = sa.Column(sa.Boolean, nullable=False)
+    # False for synced letter until its body is fetched from mail server
+    body_fetched = sa.Column(
+        sa.Boolean,
+        nullable=False,
+        server_default=sa.true(),
+    )
 
 
 class Star(Base):
@@ -55,3 +86,161 @@ class MailBox(Base):
     name = sa.Column(sa.String, nullable=False, unique=False)
     is_custom = sa.Column(sa.Boolean, default=True)
     user = sa.Column(sa.Integer, sa.ForeignKey('user.id'), nullable=True)
+
+
+class Attachment(Base):
+    """Attachment file table schema, file is stored once by content hash."""
+
+    __tablename__ = 'attachment'
+    id = sa.Column(sa.Integer, primary_key=True)
+    sha256 = sa.Column(sa.String(64), nullable=False, unique=True)
+    size = sa.Column(sa.BigInteger, nullable=False)
+    # number of letters referencing file, kept by `letter_attachment` trigger
+    refcount = sa.Column(sa.Integer, nullable=False, default=0)
+    created = sa.Column(sa.DateTime, nullable=False)
+    released = sa.Column(sa.DateTime, nullable=True)  # refcount became 0
+
+
+class LetterAttachment(Base):
+    """Letter attachment table schema."""
+
+    __tablename__ = 'letter_attachment'
+    id = sa.Column(sa.Integer, primary_key=True)
+    letter = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('letter.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+    attachment = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('attachment.id'),
+        nullable=False,
+    )
+    filename = sa.Column(sa.String, nullable=False)
+    content_type = sa.Column(sa.String, nullable=False)
+    position = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class ImportCheckpoint(Base):
+    """Progress of mail import from mbox or Maildir source."""
+
+    __tablename__ = 'import_checkpoint'
+    __table_args__ = (
+        sa.UniqueConstraint('user', 'mailbox', 'source'),
+    )
+    id = sa.Column(sa.Integer, primary_key=True)
+    user = sa.Column(sa.Integer, sa.ForeignKey('user.id'), nullable=False)
+    mailbox = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('mailbox.id'),
+        nullable=False,
+    )
+    source = sa.Column(sa.String, nullable=False)  # absolute path
+    position = sa.Column(sa.Integer, nullable=False)  # imported messages
+    key = sa.Column(sa.String, nullable=False)  # mbox offset, Maildir name
+    updated = sa.Column(sa.DateTime, nullable=False)
+
+
+class SyncAccount(Base):
+    """Upstream IMAP account table schema."""
+
+    __tablename__ = 'sync_account'
+    id = sa.Column(sa.Integer, primary_key=True)
+    user = sa.Column(sa.Integer, sa.ForeignKey('user.id'), nullable=False)
+    host = sa.Column(sa.String, nullable=False)
+    port = sa.Column(sa.Integer, nullable=True)  # by `use_ssl` if null
+    use_ssl = sa.Column(sa.Boolean, nullable=False, default=True)
+    login = sa.Column(sa.String, nullable=False)
+    password = sa.Column(sa.String, nullable=False)
+    is_active = sa.Column(sa.Boolean, nullable=False, default=True)
+
+
+class SyncFolder(Base):
+    """Sync high-water mark of upstream IMAP folder."""
+
+    __tablename__ = 'sync_folder'
+    __table_args__ = (
+        sa.UniqueConstraint('account', 'folder'),
+    )
+    id = sa.Column(sa.Integer, primary_key=True)
+    account = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('sync_account.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+    folder = sa.Column(sa.String, nullable=False)  # e.g. `INBOX`
+    mailbox = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('mailbox.id'),
+        nullable=False,
+        index=True,
+    )
+    uidvalidity = sa.Column(sa.BigInteger, nullable=False)
+    uidnext = sa.Column(sa.BigInteger, nullable=False)  # next UID to fetch
+    updated = sa.Column(sa.DateTime, nullable=False)
+
+
+class OutboxPayload(Base):
+    """Serialized message shared by outbox transactions."""
+
+    __tablename__ = 'outbox_payload'
+    id = sa.Column(sa.Integer, primary_key=True)
+    payload = sa.Column(sa.LargeBinary, nullable=False)  # serialized message
+    # offsets in payload and paths of attachments streamed from disk
+    attachments = sa.Column(sa.JSON, nullable=True)
+
+
+class Outbox(Base):
+    """Outgoing message queue table schema."""
+
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        sa.Index(
+            'ix_outbox_status_next_attempt_at',
+            'status',
+            'next_attempt_at',
+        ),
+    )
+    id = sa.Column(sa.Integer, primary_key=True)
+    letter = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('letter.id', ondelete='SET NULL'),
+        nullable=True,
+    )
+    user = sa.Column(sa.Integer, sa.ForeignKey('user.id'), nullable=False)
+    sender = sa.Column(sa.String, nullable=False)  # envelope `MAIL FROM`
+    recipients = sa.Column(sa.ARRAY(sa.String), nullable=False)
+    # message is stored once for all transactions of bulk sending
+    payload = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('outbox_payload.id'),
+        nullable=False,
+    )
+    status = sa.Column(sa.String, nullable=False, default='pending')
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    next_attempt_at = sa.Column(sa.DateTime, nullable=False)
+    created = sa.Column(sa.DateTime, nullable=False)
+    last_error = sa.Column(sa.String, nullable=True)
+
+
+class LetterChange(Base):
+    """Append-only log of letter changes, written by `letter` trigger."""
+
+    __tablename__ = 'letter_change'
+    __table_args__ = (
+        sa.Index('ix_letter_change_user_seq', 'user', 'seq'),
+    )
+    seq = sa.Column(sa.BigInteger, primary_key=True)
+    # no foreign keys, entries outlive deleted letters
+    user = sa.Column(sa.Integer, nullable=False)
+    letter = sa.Column(sa.Integer, nullable=False)
+    mailbox = sa.Column(sa.Integer, nullable=False)
+    op = sa.Column(sa.String(1), nullable=False)  # `I`, `U` or `D`
+    # inserted letter or changed fields, without body value
+    fields = sa.Column(JSONB, nullable=True)
+    created = sa.Column(
+        sa.DateTime,
+        nullable=False,
+        server_default=sa.text("timezone('utc', now())"),
+    )
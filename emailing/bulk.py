@@ -0,0 +1,38 @@
+"""
+Bulk sending module.
+
+Message is rendered once and sent to many recipients: recipients are
+grouped by domain and split into transactions up to server RCPT limit.
+Transactions are queued in outbox referencing single stored message and
+outbox workers spread them over pooled SMTP connections.
+"""
+from typing import Iterable, List
+
+from emailing.delivery import group_by_domain
+
+
+def plan_batches(
+    recipients: Iterable[str],
+    rcpt_limit: int,
+) -> List[List[str]]:
+    """
+    Split recipients into transactions.
+
+    Every transaction has recipients of single domain only,
+    duplicated addresses are removed.
+
+    Args:
+        recipients (Iterable[str]): recipients
+        rcpt_limit (int): max recipients per transaction
+
+    Returns:
+        batches (List[List[str]]): recipients of transactions
+
+    """
+    batches = []
+    for domain_recipients in group_by_domain(
+        dict.fromkeys(recipients),
+    ).values():
+        for start in range(0, len(domain_recipients), rcpt_limit):
+            batches.append(domain_recipients[start:start + rcpt_limit])
+    return batches
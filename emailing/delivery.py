@@ -0,0 +1,267 @@
+"""
+Delivery scheduling module.
+
+SMTP failures are classified as temporary or permanent. Temporary ones
+are retried with jittered exponential backoff. Due times of retries are
+kept in a heap and a single timer sleeps until the earliest one.
+Concurrent deliveries are limited per recipient domain.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+import aiosmtplib
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TEMPORARY = 'temporary'
+PERMANENT = 'permanent'
+
+TEMPORARY_ERRORS = (
+    ConnectionError,
+    asyncio.TimeoutError,
+    aiosmtplib.SMTPTimeoutError,
+    OSError,
+)
+
+
+def is_temporary_code(code: int) -> bool:
+    """
+    Check SMTP reply code for temporary failure.
+
+    Args:
+        code (int): SMTP reply code
+
+    Returns:
+        is_temporary (bool): code is 4xx, transient negative completion
+
+    """
+    return 400 <= code < 500  # noqa:WPS432
+
+
+def classify_error(exception: Exception) -> str:
+    """
+    Classify send exception as temporary or permanent failure.
+
+    Args:
+        exception (Exception): exception raised while sending
+
+    Returns:
+        kind (str): `TEMPORARY` or `PERMANENT`
+
+    """
+    if isinstance(exception, aiosmtplib.SMTPRecipientsRefused):
+        if any(
+            is_temporary_code(refused.code)
+            for refused in exception.recipients
+        ):
+            return TEMPORARY
+        return PERMANENT
+    if isinstance(exception, aiosmtplib.SMTPResponseException):
+        if is_temporary_code(exception.code):
+            return TEMPORARY
+        return PERMANENT
+    if isinstance(exception, TEMPORARY_ERRORS):
+        return TEMPORARY
+    return PERMANENT
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Get delay before next attempt, exponential backoff with equal jitter.
+
+    Args:
+        attempt (int): number of failed attempts, from 1
+        base (float): delay after first attempt, seconds
+        cap (float): max delay, seconds
+
+    Returns:
+        delay (float): seconds
+
+    """
+    ceiling = min(cap, base * 2 ** max(attempt - 1, 0))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)  # noqa:S311
+
+
+def get_domain(address: str) -> str:
+    """
+    Get domain of email address.
+
+    Args:
+        address (str): email address
+
+    Returns:
+        domain (str): lowercase domain
+
+    """
+    return address.rpartition('@')[2].lower()
+
+
+def group_by_domain(addresses: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Group email addresses by domain.
+
+    Args:
+        addresses (Iterable[str]): email addresses
+
+    Returns:
+        groups (Dict[str, List[str]]): addresses by domain
+
+    """
+    groups = defaultdict(list)
+    for address in addresses:
+        groups[get_domain(address)].append(address)
+    return dict(groups)
+
+
+class DomainLimiter(object):
+    """Limit of concurrent deliveries per recipient domain."""
+
+    def __init__(self, limit: int, local_domain: str, local_limit: int):
+        """
+        Init class instance.
+
+        Args:
+            limit (int): concurrent deliveries to remote domain
+            local_domain (str): local domain, e.g. `@google.com`
+            local_limit (int): concurrent deliveries to local domain
+
+        """
+        self.limit = limit
+        self.local_domain = local_domain.lstrip('@').lower()
+        self.local_limit = local_limit
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def acquire(self, domain: str) -> AsyncIterator[None]:
+        """
+        Hold delivery slot of domain while in `async with` block.
+
+        Semaphores are created on demand and dropped when unused,
+        so memory does not grow with number of seen domains.
+
+        Args:
+            domain (str): recipient domain
+
+        Yields:
+            None
+
+        """
+        semaphore = self._semaphores.get(domain)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._limit_for(domain))
+            self._semaphores[domain] = semaphore
+        self._users[domain] = self._users.get(domain, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[domain] -= 1
+            if not self._users[domain]:
+                self._users.pop(domain)
+                self._semaphores.pop(domain)
+
+    def _limit_for(self, domain: str) -> int:
+        if domain == self.local_domain:
+            return self.local_limit
+        return self.limit
+
+
+class RetryScheduler(object):
+    """
+    Timer of due retries.
+
+    Due times are kept in a heap, a single task sleeps until the earliest
+    one and then calls `on_due` callback with ids of due jobs.
+
+    """
+
+    def __init__(self, on_due: Callable[[List[int]], None]):
+        """
+        Init class instance.
+
+        Args:
+            on_due (Callable[[List[int]], None]): called with due job ids
+
+        """
+        self.on_due = on_due
+        self._heap = []
+        self._counter = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending = registry.gauge('delivery_retries_pending')
+
+    def __len__(self) -> int:
+        """
+        Get number of scheduled retries.
+
+        Returns:
+            size (int): number of scheduled retries
+
+        """
+        return len(self._heap)
+
+    def schedule(self, job_id: int, delay: float):
+        """
+        Schedule job retry.
+
+        Args:
+            job_id (int): job id
+            delay (float): seconds before retry
+
+        """
+        due = time.monotonic() + delay
+        is_earliest = not self._heap or due < self._heap[0][0]
+        heapq.heappush(self._heap, (due, next(self._counter), job_id))
+        self._pending.set(len(self._heap))
+        if is_earliest and self._changed:
+            self._changed.set()
+
+    def start(self):
+        """Start timer."""
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop timer, scheduled retries stay in storage."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pop_due(self) -> List[int]:
+        """
+        Pop ids of jobs which are due.
+
+        Returns:
+            due (List[int]): job ids
+
+        """
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        self._pending.set(len(self._heap))
+        return due
+
+    async def _run(self):
+        while True:  # noqa:WPS457
+            self._changed.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                due = self.pop_due()
+                if due:
+                    self.on_due(due)
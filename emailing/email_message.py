@@ -1,36 +1,180 @@
 """Module for implement message instance."""
+import base64
 import email
 import logging
-from email.mime.application import MIMEApplication
-from email.mime.audio import MIMEAudio
-from email.mime.image import MIMEImage
+import mimetypes
+import mmap
+import os
+import re
+import uuid
+from email import policy
+from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate, make_msgid
 from email.header import Header
-from typing import Optional, Sequence
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 from emailing.emailing_model import Email
 
 logger = logging.getLogger(__name__)
 
 
-IMAGE_EXT = (
-    'apng', 'avif', 'gif', 'jpeg', 'jpg', 'png', 'svg', 'bmp', 'ico', 'tiff',
-)
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+# `type/subtype` of RFC 2045 tokens, without parameters
+MIME_TOKEN = r"[!#$%&'*+\-.^_`{|}~0-9a-z]+"
+CONTENT_TYPE_PATTERN = re.compile('{0}/{0}'.format(MIME_TOKEN))
 
-AUDIO_EXT = (
-    'm4a', 'flac', 'mp3',
-)
+# 57 bytes are encoded into one 76 characters base64 line
+BASE64_LINE_BYTES = 57
+ATTACHMENT_CHUNK_SIZE = BASE64_LINE_BYTES * 1024
 
+# offset in serialized message and path of attachment to insert there
+Splice = Tuple[int, str]
 
-def get_mime_obj(filename: str):  # TODO File type processing
-    ext = filename.split('.')[-1]
-    if ext in IMAGE_EXT:
-        return MIMEImage, ext
-    elif ext in AUDIO_EXT:
-        return MIMEAudio, ext
-    return MIMEApplication, 'octet-stream'
+
+def normalize_content_type(content_type: Optional[str]) -> Optional[str]:
+    """
+    Normalize MIME type given by client.
+
+    Parameters are dropped and type is lowercased. Type which does not
+    match `type/subtype` grammar, e.g. with line breaks, is not valid
+    in headers and is rejected.
+
+    Args:
+        content_type (Optional[str]): MIME type, e.g. `Image/PNG`
+
+    Returns:
+        content_type (Optional[str]): MIME type, None if it is invalid
+
+    """
+    if not content_type:
+        return None
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    if CONTENT_TYPE_PATTERN.fullmatch(content_type) is None:
+        return None
+    return content_type
+
+
+def get_content_type(filename: str, content_type: Optional[str] = None) -> str:
+    """
+    Get MIME type of attachment.
+
+    Type given on upload is used if it is valid, if it is missing,
+    invalid or generic, type is guessed by file name extension,
+    case-insensitively.
+
+    Args:
+        filename (str): attachment file name
+        content_type (Optional[str]): type stored on upload
+
+    Returns:
+        content_type (str): MIME type, e.g. `image/png`
+
+    """
+    content_type = normalize_content_type(content_type)
+    if content_type and content_type != DEFAULT_CONTENT_TYPE:
+        return content_type
+    guessed, encoding = mimetypes.guess_type(filename)
+    if guessed is None or encoding is not None:
+        # compressed file is served as is, not as its content
+        return DEFAULT_CONTENT_TYPE
+    return guessed
+
+
+def encode_file(
+    path: str,
+    chunk_size: int = ATTACHMENT_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Encode file to base64 lines chunk by chunk.
+
+    File is memory-mapped, so pages are shared through page cache
+    when the same file is sent by several transactions at once.
+
+    Args:
+        path (str): file path
+        chunk_size (int): bytes encoded at once, multiple of 57
+
+    Yields:
+        chunk (bytes): base64 lines with CRLF line endings
+
+    """
+    with open(path, 'rb') as attachment:
+        if not os.fstat(attachment.fileno()).st_size:
+            return
+        with mmap.mmap(
+            attachment.fileno(),
+            0,
+            access=mmap.ACCESS_READ,
+        ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            for start in range(0, len(mapped), chunk_size):
+                yield base64.encodebytes(
+                    mapped[start:start + chunk_size],
+                ).replace(b'\n', b'\r\n')
+
+
+def iter_spliced(
+    payload: bytes,
+    splices: Sequence[Splice],
+    chunk_size: int = ATTACHMENT_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Iterate serialized message with attachments inserted from disk.
+
+    Args:
+        payload (bytes): message serialized with `Message.to_segments`
+        splices (Sequence[Splice]): attachments offsets and paths
+        chunk_size (int): bytes of attachment read at once
+
+    Yields:
+        chunk (bytes): part of message
+
+    """
+    position = 0
+    for offset, path in splices:
+        yield payload[position:offset]
+        yield from encode_file(path, chunk_size)
+        position = offset
+    yield payload[position:]
+
+
+class LazyAttachment(MIMEBase):
+    """
+    Attachment encoded from disk only while message is being sent.
+
+    Part has no payload in memory, use `Message.to_segments`
+    and `iter_spliced` to serialize message with it.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        filename: str,
+        content_type: Optional[str] = None,
+    ):
+        """
+        Init part instance.
+
+        Args:
+            path (str): file path
+            filename (str): attachment file name
+            content_type (Optional[str]): type stored on upload
+
+        """
+        super().__init__(
+            *get_content_type(filename, content_type).split('/', 1),
+        )
+        self.path = path
+        self['Content-Transfer-Encoding'] = 'base64'
+        self.add_header(
+            'Content-Disposition',
+            'attachment',
+            filename=filename,
+        )
 
 
 class Message(MIMEMultipart):
@@ -90,10 +234,18 @@ class Message(MIMEMultipart):
             self._add_chain()
 
     def add_attachments(self):
-        """Add attachments to letter."""
-        for filename in self.attachments:
+        """
+        Add attachments to letter.
+
+        Attachment is either file path or tuple of file path,
+        file name shown in letter and optionally MIME type.
+
+        """
+        for attachment in self.attachments:
+            if isinstance(attachment, str):
+                attachment = (attachment, attachment)
             try:
-                self._add_attachment(filename)
+                self._add_attachment(*attachment)
             except Exception as exception:
                 logger.exception(
                     'Adding an attachment was failed. {0}'.format(
@@ -117,25 +269,64 @@ class Message(MIMEMultipart):
             formatdate(localtime=True),
         )
 
-    def _add_attachment(self, filename: str):  # TODO file processing ??
+    def to_segments(self) -> Tuple[bytes, List[Splice]]:
+        """
+        Serialize message without attachments content.
+
+        Attachments are kept on disk, their offsets in serialized message
+        are returned to insert them with `iter_spliced` while sending.
+
+        Returns:
+            segments (Tuple[bytes, List[Splice]]): serialized message
+                and attachments splices
+
+        """
+        lazy_parts = [
+            part for part in self.get_payload()
+            if isinstance(part, LazyAttachment)
+        ]
+        markers = []
+        for part in lazy_parts:
+            marker = 'lazy-attachment-{0}'.format(uuid.uuid4().hex)
+            part.set_payload(marker)
+            markers.append((marker.encode(), part.path))
+        try:
+            serialized = self.as_bytes(policy=policy.SMTP)
+        finally:
+            for part in lazy_parts:
+                part.set_payload(None)
+        splices = []
+        for marker, path in markers:
+            offset = serialized.index(marker)
+            serialized = b''.join(
+                (serialized[:offset], serialized[offset + len(marker):]),
+            )
+            splices.append((offset, path))
+        return serialized, splices
+
+    def _add_attachment(
+        self,
+        path: str,
+        filename: str,
+        content_type: Optional[str] = None,
+    ):
         """
-        Add single attachment to msg.
+        Add single attachment to msg, file is read only while sending.
 
         Args:
-            filename (str): file to be attached
+            path (str): file to be attached
+            filename (str): file name shown in letter
+            content_type (Optional[str]): MIME type, guessed if None
 
         """
-        mime, ext = get_mime_obj(filename)
-        with open(filename, 'rb') as attachment:
-            part = mime(
-                attachment.read(),
-                _subtype='{0}'.format(ext),
+        with open(path, 'rb'):
+            self.attach(
+                LazyAttachment(
+                    path=path,
+                    filename=filename,
+                    content_type=content_type,
+                ),
             )
-        part.add_header(
-            'Content-Disposition',
-            'inline; filename= {0}'.format(filename),
-        )
-        self.attach(part)
 
     def _add_chain(self):
         """
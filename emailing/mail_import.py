@@ -0,0 +1,543 @@
+"""
+Mail import module.
+
+Messages are streamed from mbox file or Maildir directory, parsed in
+process pool and written to `letter` table with `COPY` in batches.
+Parser reads headers first and parses the whole MIME tree only when
+text body has to be found in multipart message. Progress is stored in
+`import_checkpoint` table in the same transaction as the batch,
+so interrupted import continues after the last written batch.
+Imported letters are keyed by hash of their `Message-ID`, or of the
+whole message if it has none, stored in `letter.import_hash`. Source
+can be rescanned from the beginning, then messages whose hashes are
+already stored in mailbox are skipped by Bloom filter guard before
+parsing, so the same message is not imported twice from any source.
+"""
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser, BytesParser
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db.psql_engine import PostgresEngine
+from db.schema import ImportCheckpoint
+from sync.bloom import ExternalIdGuard
+
+logger = logging.getLogger(__name__)
+
+MBOX = 'mbox'
+MAILDIR = 'maildir'
+MAILDIR_SUBDIRS = ('cur', 'new')
+MAILDIR_INFO = ':2,'
+
+LETTER_COLUMNS = (
+    'sender',
+    'to',
+    'subject',
+    'body',
+    'user',
+    'size',
+    'ts',
+    'mailbox',
+    'is_important',
+    'is_read',
+)
+IMPORT_COLUMNS = LETTER_COLUMNS + ('import_hash',)
+
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+MESSAGE_ID = re.compile(
+    rb'^message-id:[ \t]*(?:\r?\n[ \t]+)?(<[^>\r\n]*>)',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_header_parser = BytesHeaderParser(policy=policy.default)
+_parser = BytesParser(policy=policy.default)
+
+
+class SourceMessage(NamedTuple):
+    """Raw message read from source."""
+
+    position: int  # number of message in source, from 1
+    key: str  # where to continue after message: mbox offset, Maildir name
+    raw: bytes
+    flags: str  # Maildir flags, e.g. `FS`
+
+
+def iter_mbox(
+    path: str,
+    offset: int,
+    position: int,
+) -> Iterator[SourceMessage]:
+    """
+    Read messages from mbox file one by one.
+
+    Args:
+        path (str): mbox file path
+        offset (int): byte offset to start from
+        position (int): number of messages before offset
+
+    Yields:
+        message (SourceMessage): raw message, `>From ` lines unquoted
+
+    """
+    lines = []
+    with open(path, 'rb') as mbox:
+        mbox.seek(offset)
+        while True:
+            line = mbox.readline()
+            if not line or line.startswith(b'From '):
+                if lines and lines[-1] in {b'\n', b'\r\n'}:
+                    lines.pop()  # separator line before next `From `
+                if lines:
+                    position += 1
+                    yield SourceMessage(
+                        position=position,
+                        key=str(offset),
+                        raw=b''.join(lines),
+                        flags='',
+                    )
+                    lines = []
+                if not line:
+                    return
+            elif line.startswith(b'>') and line.lstrip(b'>').startswith(
+                b'From ',
+            ):
+                lines.append(line[1:])
+            else:
+                lines.append(line)
+            offset += len(line)
+
+
+def iter_maildir(
+    path: str,
+    after: str,
+    position: int,
+) -> Iterator[SourceMessage]:
+    """
+    Read messages from Maildir in order of file names.
+
+    Args:
+        path (str): Maildir directory path
+        after (str): file name of last imported message, empty to start
+        position (int): number of imported messages
+
+    Yields:
+        message (SourceMessage): raw message with its Maildir flags
+
+    """
+    names = sorted(
+        (entry.name, entry.path)
+        for subdir in MAILDIR_SUBDIRS
+        if os.path.isdir(os.path.join(path, subdir))
+        for entry in os.scandir(os.path.join(path, subdir))
+        if entry.is_file() and entry.name > after
+    )
+    for name, message_path in names:
+        position += 1
+        with open(message_path, 'rb') as message_file:
+            raw = message_file.read()
+        yield SourceMessage(
+            position=position,
+            key=name,
+            raw=raw,
+            flags=name.partition(MAILDIR_INFO)[2],
+        )
+
+
+def _header(message: EmailMessage, name: str) -> str:
+    try:
+        header_value = message.get(name)
+    except Exception:
+        return ''
+    return str(header_value or '')
+
+
+def _get_ts(message: EmailMessage) -> datetime.datetime:
+    try:
+        ts = parsedate_to_datetime(_header(message, 'Date'))
+    except (TypeError, ValueError):
+        return datetime.datetime.utcnow()
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _get_body(raw: bytes, headers: EmailMessage) -> str:
+    """
+    Get text body of message.
+
+    Whole MIME tree is parsed only for multipart messages.
+
+    Args:
+        raw (bytes): raw message
+        headers (EmailMessage): message parsed by headers
+
+    Returns:
+        body (str): plain text or html body, empty if there is no text
+
+    """
+    try:
+        if headers.get_content_maintype() == 'multipart':
+            part = _parser.parsebytes(raw).get_body(('plain', 'html'))
+            return part.get_content() if part else ''
+        if headers.get_content_maintype() != 'text':
+            return ''
+        payload = headers.get_payload(decode=True) or b''
+        return payload.decode(
+            headers.get_content_charset() or 'utf-8',
+            errors='replace',
+        )
+    except Exception:
+        return ''
+
+
+def message_hash(raw: bytes) -> int:
+    """
+    Get stable key of message for deduplication.
+
+    `Message-ID` is found in header block without parsing, message
+    without it is keyed by its content.
+
+    Args:
+        raw (bytes): raw message
+
+    Returns:
+        key (int): signed 64-bit hash, fits `BIGINT`
+
+    """
+    header_end = HEADER_END.search(raw)
+    message_id = MESSAGE_ID.search(
+        raw[:header_end.start()] if header_end else raw,
+    )
+    digest = hashlib.blake2b(
+        message_id.group(1) if message_id else raw,
+        digest_size=8,
+    ).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def parse_message(
+    message: SourceMessage,
+    user: int,
+    mailbox: int,
+) -> Tuple:
+    """
+    Map raw message to `letter` row.
+
+    Args:
+        message (SourceMessage): raw message
+        user (int): user id
+        mailbox (int): mailbox id
+
+    Returns:
+        record (Tuple): values in order of `LETTER_COLUMNS`
+
+    """
+    headers = _header_parser.parsebytes(message.raw)
+    flags = message.flags
+    if not flags:
+        status = _header(headers, 'Status') + _header(headers, 'X-Status')
+        flags = ''.join(
+            flag for flag, mbox_flag in (('S', 'R'), ('F', 'F'))
+            if mbox_flag in status
+        )
+    return (
+        _header(headers, 'From').replace('\x00', ''),
+        (_header(headers, 'To') or ' ').replace('\x00', ''),
+        _header(headers, 'Subject').replace('\x00', '') or None,
+        (_get_body(message.raw, headers) or ' ').replace('\x00', ''),
+        user,
+        len(message.raw),
+        _get_ts(headers),
+        mailbox,
+        'F' in flags,
+        'S' in flags,
+    )
+
+
+def parse_batch(
+    messages: List[SourceMessage],
+    user: int,
+    mailbox: int,
+) -> List[Tuple]:
+    """
+    Map batch of raw messages to `letter` rows, run in worker process.
+
+    Args:
+        messages (List[SourceMessage]): raw messages
+        user (int): user id
+        mailbox (int): mailbox id
+
+    Returns:
+        records (List[Tuple]): rows in order of `LETTER_COLUMNS`
+
+    """
+    return [parse_message(message, user, mailbox) for message in messages]
+
+
+def parse_import_batch(
+    messages: List[SourceMessage],
+    user: int,
+    mailbox: int,
+) -> List[Tuple]:
+    """
+    Map batch of imported messages to `letter` rows with their hashes.
+
+    Args:
+        messages (List[SourceMessage]): raw messages
+        user (int): user id
+        mailbox (int): mailbox id
+
+    Returns:
+        records (List[Tuple]): rows in order of `IMPORT_COLUMNS`
+
+    """
+    return [
+        (*parse_message(message, user, mailbox), message_hash(message.raw))
+        for message in messages
+    ]
+
+
+def _batched(
+    messages: Iterable[SourceMessage],
+    size: int,
+) -> Iterator[List[SourceMessage]]:
+    batch = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class MailImporter(object):
+    """Import of mbox or Maildir into `letter` table."""
+
+    def __init__(  # noqa:WPS211
+        self,
+        db_engine: PostgresEngine,
+        user: int,
+        mailbox: int,
+        source: str,
+        source_format: str,
+        batch_size: int = 2000,
+        workers: Optional[int] = None,
+        rescan: bool = False,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            db_engine (PostgresEngine): db engine with created engine
+            user (int): user id
+            mailbox (int): mailbox id
+            source (str): mbox file or Maildir directory path
+            source_format (str): `MBOX` or `MAILDIR`
+            batch_size (int): rows written with single `COPY`
+            workers (Optional[int]): parser processes, CPU count if None
+            rescan (bool): ignore checkpoint and skip stored messages
+
+        """
+        self.db_engine = db_engine
+        self.user = user
+        self.mailbox = mailbox
+        self.source = os.path.abspath(source)
+        self.source_format = source_format
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.rescan = rescan
+        self.guard = ExternalIdGuard(
+            db_engine=db_engine,
+            key='import_hash',
+        ) if rescan else None
+        self.imported = 0
+        self.skipped = 0
+        self._started = 0.0
+
+    async def run(self) -> int:
+        """
+        Import messages which were not imported yet.
+
+        Batches are parsed concurrently, but written in source order,
+        so checkpoint always points after the last written batch.
+
+        Returns:
+            imported (int): number of imported messages
+
+        """
+        loop = asyncio.get_running_loop()
+        self._started = time.perf_counter()
+        async with self.db_engine.engine.connect() as connection:
+            position, key = 0, ''
+            if not self.rescan:
+                position, key = await self._load_checkpoint(connection)
+            logger.info(
+                'Import of {0} starts after message #{1}.'.format(
+                    self.source,
+                    position,
+                ),
+            )
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for batch in _batched(
+                    self._iter_source(position, key),
+                    self.batch_size,
+                ):
+                    pending.append(
+                        (
+                            batch[-1],
+                            loop.run_in_executor(
+                                pool,
+                                parse_import_batch,
+                                await self._skip_stored(batch),
+                                self.user,
+                                self.mailbox,
+                            ),
+                        ),
+                    )
+                    if len(pending) >= self.workers * 2:
+                        await self._write(connection, *pending.popleft())
+                while pending:
+                    await self._write(connection, *pending.popleft())
+        logger.info(
+            'Import of {0} is finished, {1} messages, {2} skipped.'.format(
+                self.source,
+                self.imported,
+                self.skipped,
+            ),
+        )
+        return self.imported
+
+    @property
+    def _scope(self) -> dict:
+        return {'user': self.user, 'mailbox': self.mailbox}
+
+    def _iter_source(self, position: int, key: str) -> Iterator[SourceMessage]:
+        if self.source_format == MBOX:
+            return iter_mbox(self.source, int(key or 0), position)
+        return iter_maildir(self.source, key, position)
+
+    async def _skip_stored(
+        self,
+        batch: List[SourceMessage],
+    ) -> List[SourceMessage]:
+        """
+        Remove messages which are stored in mailbox on rescan.
+
+        Copies of the same message within batch are imported once.
+
+        Args:
+            batch (List[SourceMessage]): raw messages
+
+        Returns:
+            batch (List[SourceMessage]): messages to import
+
+        """
+        if self.guard is None:
+            return batch
+        hashes = {message_hash(message.raw): message for message in batch}
+        new = await self.guard.new_ids(self._scope, list(hashes))
+        self.skipped += len(batch) - len(new)
+        return [hashes[key] for key in new]
+
+    async def _load_checkpoint(
+        self,
+        connection: AsyncConnection,
+    ) -> Tuple[int, str]:
+        """
+        Get position to continue import from.
+
+        Args:
+            connection (AsyncConnection): db connection
+
+        Returns:
+            checkpoint (Tuple[int, str]): imported messages and source key
+
+        """
+        checkpoint = (
+            await connection.execute(
+                sa.select(
+                    ImportCheckpoint.position,
+                    ImportCheckpoint.key,
+                ).where(
+                    ImportCheckpoint.user == self.user,
+                    ImportCheckpoint.mailbox == self.mailbox,
+                    ImportCheckpoint.source == self.source,
+                ),
+            )
+        ).first()
+        await connection.rollback()
+        if checkpoint is None:
+            return 0, ''
+        return checkpoint.position, checkpoint.key
+
+    async def _write(
+        self,
+        connection: AsyncConnection,
+        last: SourceMessage,
+        parsed: 'asyncio.Future[List[Tuple]]',
+    ):
+        """
+        Write batch with `COPY` and move checkpoint in one transaction.
+
+        Args:
+            connection (AsyncConnection): db connection
+            last (SourceMessage): last message of batch
+            parsed (asyncio.Future[List[Tuple]]): rows of batch
+
+        """
+        records = await parsed
+        upsert = insert(ImportCheckpoint).values(
+            user=self.user,
+            mailbox=self.mailbox,
+            source=self.source,
+            position=last.position,
+            key=last.key,
+            updated=datetime.datetime.utcnow(),
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[
+                ImportCheckpoint.user,
+                ImportCheckpoint.mailbox,
+                ImportCheckpoint.source,
+            ],
+            set_={
+                'position': upsert.excluded.position,
+                'key': upsert.excluded.key,
+                'updated': upsert.excluded.updated,
+            },
+        )
+        async with connection.begin():
+            await connection.execute(upsert)
+            if records:
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    'letter',
+                    records=records,
+                    columns=IMPORT_COLUMNS,
+                )
+        if self.guard is not None:
+            self.guard.add(self._scope, [record[-1] for record in records])
+        self.imported += len(records)
+        elapsed = time.perf_counter() - self._started
+        logger.info(
+            'Imported {0} messages, {1:.0f} rows/s.'.format(
+                self.imported,
+                self.imported / elapsed if elapsed else 0,
+            ),
+        )
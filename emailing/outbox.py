@@ -0,0 +1,510 @@
+"""
+Outbox module.
+
+Messages are serialized once and stored in `outbox_payload` table,
+`outbox` rows are transactions referencing it, so bulk sending split
+into many transactions keeps single copy of message.
+Delivery workers claim batches of due messages with
+`SELECT ... FOR UPDATE SKIP LOCKED` and send them over SMTP pool,
+so delivery does not block HTTP requests. Recipients are delivered
+in groups by domain, temporary failures are rescheduled with backoff.
+Attachments are not stored in payload, they are encoded from disk
+while message is written to SMTP data stream.
+"""
+import asyncio
+import datetime
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiosmtplib
+import sqlalchemy as sa
+
+from config_model import OutboxConfig
+from db.psql_engine import PostgresEngine
+from db.schema import Outbox, OutboxPayload
+from emailing.delivery import (
+    TEMPORARY,
+    DomainLimiter,
+    RetryScheduler,
+    backoff_delay,
+    classify_error,
+    group_by_domain,
+    is_temporary_code,
+)
+from emailing.email_message import Splice, iter_spliced
+from emailing.smtp_client import SMTPClient
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+# recipients to retry and permanently refused recipients with errors
+_GroupResult = Tuple[List[str], Dict[str, str]]
+# claimed transaction with its message, shared by transactions of batch
+_Claimed = Tuple[Outbox, OutboxPayload]
+
+
+class OutboxWorkerPool(object):
+    """Pool of asyncio workers delivering messages from outbox."""
+
+    def __init__(
+        self,
+        db_engine: PostgresEngine,
+        smtp: SMTPClient,
+        config: OutboxConfig,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            db_engine (PostgresEngine): db engine
+            smtp (SMTPClient): SMTP client
+            config (OutboxConfig): outbox config
+
+        """
+        self.db_engine = db_engine
+        self.smtp = smtp
+        self.config = config
+        self.workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._is_running = False
+        self.domains = DomainLimiter(
+            limit=smtp.config.domain_concurrency,
+            local_domain=smtp.config.domain,
+            local_limit=smtp.config.local_domain_concurrency,
+        )
+        self.retries = RetryScheduler(on_due=self._on_retry_due)
+        self._sent = registry.counter('outbox_sent')
+        self._failed = registry.counter('outbox_failed')
+        self._retried = registry.counter('outbox_retried')
+        self._delivery_latency = registry.summary('outbox_delivery_seconds')
+
+    async def enqueue(
+        self,
+        user: int,
+        sender: str,
+        recipients: Sequence[str],
+        payload: bytes,
+        letter: Optional[int] = None,
+        attachments: Optional[Sequence[Splice]] = None,
+    ) -> int:
+        """
+        Store message in outbox and wake up workers.
+
+        Args:
+            user (int): user id
+            sender (str): envelope sender
+            recipients (Sequence[str]): envelope recipients
+            payload (bytes): serialized message
+            letter (Optional[int]): letter id
+            attachments (Optional[Sequence[Splice]]): attachments splices
+
+        Returns:
+            outbox_id (int): id of queued message
+
+        """
+        queued = await self.enqueue_many(
+            user=user,
+            sender=sender,
+            batches=[recipients],
+            payload=payload,
+            letter=letter,
+            attachments=attachments,
+        )
+        return queued[0]
+
+    async def enqueue_many(
+        self,
+        user: int,
+        sender: str,
+        batches: Sequence[Sequence[str]],
+        payload: bytes,
+        letter: Optional[int] = None,
+        attachments: Optional[Sequence[Splice]] = None,
+    ) -> List[int]:
+        """
+        Store one message for several recipient batches.
+
+        Message is stored once, every batch is a transaction row
+        referencing it.
+
+        Args:
+            user (int): user id
+            sender (str): envelope sender
+            batches (Sequence[Sequence[str]]): recipients of transactions
+            payload (bytes): serialized message
+            letter (Optional[int]): letter id
+            attachments (Optional[Sequence[Splice]]): attachments splices
+
+        Returns:
+            outbox_ids (List[int]): ids of queued messages
+
+        """
+        now = datetime.datetime.utcnow()
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                payload_id = (
+                    await session.execute(
+                        sa.insert(OutboxPayload).values(
+                            payload=payload,
+                            attachments=[
+                                list(splice) for splice in attachments or ()
+                            ] or None,
+                        ).returning(OutboxPayload.id),
+                    )
+                ).scalar()
+                outbox_ids = (
+                    await session.execute(
+                        sa.insert(Outbox).values(
+                            [
+                                {
+                                    'user': user,
+                                    'letter': letter,
+                                    'sender': sender,
+                                    'recipients': list(recipients),
+                                    'payload': payload_id,
+                                    'status': STATUS_PENDING,
+                                    'attempts': 0,
+                                    'next_attempt_at': now,
+                                    'created': now,
+                                }
+                                for recipients in batches
+                            ],
+                        ).returning(Outbox.id),
+                    )
+                ).scalars().all()
+        if self._wakeup:
+            self._wakeup.set()
+        return outbox_ids
+
+    def start(self):
+        """Start delivery workers."""
+        self._is_running = True
+        self._wakeup = asyncio.Event()
+        self.workers = [
+            asyncio.create_task(self._work(number))
+            for number in range(self.config.workers)
+        ]
+        self.retries.start()
+        logger.info(
+            'Outbox has been started with {0} workers.'.format(
+                self.config.workers,
+            ),
+        )
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop claiming messages and wait for claimed ones to be delivered.
+
+        Args:
+            timeout (Optional[float]): seconds, wait without limit if None
+
+        Returns:
+            drained (bool): False if deliveries were left after timeout,
+                their messages are claimed again after lease timeout
+
+        """
+        self._is_running = False
+        if self._wakeup:
+            self._wakeup.set()
+        if not self.workers:
+            return True
+        _, pending = await asyncio.wait(self.workers, timeout=timeout)
+        if pending:
+            logger.warning(
+                'Outbox was not drained, {0} workers are delivering.'.format(
+                    len(pending),
+                ),
+            )
+            return False
+        logger.info('Outbox has been drained.')
+        return True
+
+    async def stop(self):
+        """Stop delivery workers."""
+        self._is_running = False
+        await self.retries.stop()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info('Outbox has been stopped.')
+
+    async def _work(self, number: int):
+        """
+        Claim and deliver batches while there are due messages.
+
+        Args:
+            number (int): worker number
+
+        """
+        while self._is_running:
+            try:
+                batch = await self._claim()
+            except Exception as exception:
+                logger.exception(
+                    'Outbox worker #{0} claiming was failed. {1}'.format(
+                        number,
+                        exception,
+                    ),
+                )
+                batch = []
+            if batch:
+                await asyncio.gather(
+                    *[
+                        self._deliver(message, content)
+                        for message, content in batch
+                    ],
+                )
+                continue
+            self._wakeup.clear()
+            if not self._is_running:
+                return
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    self.config.poll_interval,
+                )
+            except asyncio.TimeoutError:
+                continue
+
+    async def _claim(self) -> List[_Claimed]:
+        """
+        Lock batch of due messages and mark them as being sent.
+
+        Claimed messages are leased, they are claimed again if worker
+        did not finish delivery in `lease_timeout`. Only transaction
+        rows are locked, so transactions of one bulk message are
+        claimed by many workers.
+
+        Returns:
+            batch (List[_Claimed]): claimed messages with their payloads
+
+        """
+        now = datetime.datetime.utcnow()
+        stmt = sa.select(Outbox, OutboxPayload).join(
+            OutboxPayload,
+            OutboxPayload.id == Outbox.payload,
+        ).where(
+            Outbox.status.in_((STATUS_PENDING, STATUS_SENDING)),
+            Outbox.next_attempt_at <= now,
+        ).order_by(
+            Outbox.next_attempt_at,
+        ).limit(
+            self.config.batch_size,
+        ).with_for_update(
+            skip_locked=True,
+            of=Outbox,
+        )
+        lease_until = now + datetime.timedelta(
+            seconds=self.config.lease_timeout,
+        )
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                batch = (await session.execute(stmt)).all()
+                for message, _ in batch:
+                    message.status = STATUS_SENDING
+                    message.attempts += 1
+                    message.next_attempt_at = lease_until
+        return batch
+
+    async def _deliver(self, message: Outbox, content: OutboxPayload):
+        """
+        Send message to recipients grouped by domain and store result.
+
+        Temporary failed recipients are retried later, permanently
+        refused ones are reported in `last_error`.
+
+        Args:
+            message (Outbox): claimed message
+            content (OutboxPayload): message payload
+
+        """
+        with self._delivery_latency.time():
+            results = await asyncio.gather(
+                *[
+                    self._deliver_group(message, content, domain, recipients)
+                    for domain, recipients in group_by_domain(
+                        message.recipients,
+                    ).items()
+                ],
+            )
+        to_retry = []
+        refused = {}
+        for group_retry, group_refused in results:
+            to_retry.extend(group_retry)
+            refused.update(group_refused)
+        last_error = '; '.join(
+            '{0}: {1}'.format(address, error)
+            for address, error in refused.items()
+        ) or None
+        if to_retry and message.attempts < self.config.max_attempts:
+            await self._reschedule(message, to_retry, last_error)
+            return
+        if to_retry or len(refused) == len(message.recipients):
+            self._failed.inc()
+            await self._update(
+                message.id,
+                status=STATUS_FAILED,
+                last_error=last_error or 'Max attempts were exceeded.',
+            )
+            return
+        self._sent.inc()
+        await self._update(
+            message.id,
+            status=STATUS_SENT,
+            last_error=last_error,
+        )
+
+    async def _deliver_group(
+        self,
+        message: Outbox,
+        content: OutboxPayload,
+        domain: str,
+        recipients: List[str],
+    ) -> _GroupResult:
+        """
+        Send message to recipients of single domain.
+
+        Args:
+            message (Outbox): claimed message
+            content (OutboxPayload): message payload
+            domain (str): recipients domain
+            recipients (List[str]): recipients
+
+        Returns:
+            result (_GroupResult): recipients to retry and refused ones
+
+        """
+        async with self.domains.acquire(domain):
+            try:
+                errors, _ = await self._send(message, content, recipients)
+            except aiosmtplib.SMTPRecipientsRefused as exception:
+                errors = {
+                    refused.recipient: (refused.code, refused.message)
+                    for refused in exception.recipients
+                }
+            except Exception as exception:
+                logger.warning(
+                    'Outbox message #{0} to {1} was failed. {2}'.format(
+                        message.id,
+                        domain,
+                        exception,
+                    ),
+                )
+                if classify_error(exception) == TEMPORARY:
+                    return recipients, {}
+                return [], {
+                    address: str(exception) for address in recipients
+                }
+        to_retry = []
+        refused = {}
+        for address, (code, reply) in errors.items():
+            if is_temporary_code(code):
+                to_retry.append(address)
+            else:
+                refused[address] = '{0} {1}'.format(code, reply)
+        return to_retry, refused
+
+    async def _send(
+        self,
+        message: Outbox,
+        content: OutboxPayload,
+        recipients: List[str],
+    ):
+        """
+        Send message, attachments are streamed from disk.
+
+        Args:
+            message (Outbox): claimed message
+            content (OutboxPayload): message payload
+            recipients (List[str]): recipients
+
+        Returns:
+            response of server: refused recipients and server message
+
+        """
+        if not content.attachments:
+            return await self.smtp.send_raw(
+                sender=message.sender,
+                recipients=recipients,
+                payload=content.payload,
+            )
+        return await self.smtp.send_stream(
+            sender=message.sender,
+            recipients=recipients,
+            chunks=lambda: iter_spliced(content.payload, content.attachments),
+        )
+
+    async def _reschedule(
+        self,
+        message: Outbox,
+        recipients: List[str],
+        last_error: Optional[str],
+    ):
+        """
+        Return message to queue for recipients which failed temporarily.
+
+        Args:
+            message (Outbox): claimed message
+            recipients (List[str]): recipients to retry
+            last_error (Optional[str]): errors of refused recipients
+
+        """
+        delay = backoff_delay(
+            attempt=message.attempts,
+            base=self.config.retry_base_delay,
+            cap=self.config.retry_max_delay,
+        )
+        self._retried.inc()
+        await self._update(
+            message.id,
+            status=STATUS_PENDING,
+            recipients=recipients,
+            next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=delay,
+            ),
+            last_error=last_error,
+        )
+        self.retries.schedule(message.id, delay)
+
+    def _on_retry_due(self, due: List[int]):
+        """
+        Wake up workers when retries are due.
+
+        Args:
+            due (List[int]): ids of due messages
+
+        """
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _update(self, outbox_id: int, **values):
+        """
+        Update outbox message.
+
+        Args:
+            outbox_id (int): outbox message id
+            values: values to update
+
+        """
+        stmt = sa.update(Outbox).where(
+            Outbox.id == outbox_id,
+        ).values(
+            **values,
+        )
+        try:
+            async with self.db_engine.session() as session:
+                async with session.begin():
+                    await session.execute(stmt)
+        except Exception as exception:
+            logger.exception(
+                'Outbox message #{0} updating was failed. {1}'.format(
+                    outbox_id,
+                    exception,
+                ),
+            )
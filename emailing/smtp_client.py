@@ -1,64 +1,378 @@
 """SMTP client module."""
+import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 from email.message import Message
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 import aiosmtplib
 from aiosmtplib.response import SMTPResponse
 
 from config_model import SMTPConfig
+from metrics import registry
 
 logger = logging.getLogger(__name__)
 
 SMTP_OK = 220
+SMTP_COMPLETED = 250
+SMTP_START_INPUT = 354
+MAX_CONSECUTIVE_FAILURES = 3
 
 
-class SMTPClient(object):
-    """SMTP client."""
+def stuff_dots(chunk: bytes, at_line_start: bool) -> bytes:
+    """
+    Escape leading dots of lines in message chunk, RFC 5321 4.5.2.
 
-    def __init__(self, config: SMTPConfig):
+    Args:
+        chunk (bytes): message chunk with CRLF line endings
+        at_line_start (bool): previous chunk ended with line break
+
+    Returns:
+        chunk (bytes): escaped chunk
+
+    """
+    chunk = chunk.replace(b'\n.', b'\n..')
+    if at_line_start and chunk.startswith(b'.'):
+        chunk = b'.' + chunk
+    return chunk
+
+
+async def sendmail_stream(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    chunks: Iterable[bytes],
+) -> Tuple[Dict[str, SMTPResponse], str]:
+    """
+    Run mail transaction writing message to `DATA` chunk by chunk.
+
+    Every chunk is written after transport buffer is drained, so only
+    one chunk of message is kept in memory at a time.
+
+    Args:
+        smtp (aiosmtplib.SMTP): connected client
+        sender (str): envelope sender
+        recipients (Sequence[str]): envelope recipients
+        chunks (Iterable[bytes]): serialized message with CRLF line endings
+
+    Returns:
+        response of server: refused recipients and server message
+
+    Raises:
+        SMTPRecipientsRefused: if all recipients were refused
+        SMTPDataError: if message was not accepted
+
+    """
+    await smtp._ehlo_or_helo_if_needed()  # noqa:WPS437
+    try:
+        await smtp.mail(sender)
+        errors = []
+        for recipient in recipients:
+            try:
+                await smtp.rcpt(recipient)
+            except aiosmtplib.SMTPRecipientRefused as exception:
+                errors.append(exception)
+        if len(errors) == len(recipients):
+            raise aiosmtplib.SMTPRecipientsRefused(errors)
+        response = await smtp.execute_command(b'DATA')
+        if response.code != SMTP_START_INPUT:
+            raise aiosmtplib.SMTPDataError(response.code, response.message)
+    except (
+        aiosmtplib.SMTPResponseException,
+        aiosmtplib.SMTPRecipientsRefused,
+    ):
+        try:
+            await smtp.rset()
+        except (ConnectionError, aiosmtplib.SMTPResponseException):
+            logger.debug('SMTP envelope reset was failed.')
+        raise
+    try:
+        at_line_start = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            smtp.protocol.write(stuff_dots(chunk, at_line_start))
+            await smtp.protocol._drain_helper()  # noqa:WPS437
+            at_line_start = chunk.endswith(b'\n')
+        smtp.protocol.write(b'.\r\n' if at_line_start else b'\r\n.\r\n')
+        response = await smtp.protocol.read_response(timeout=smtp.timeout)
+    except BaseException:
+        # server is waiting for the rest of message, connection is unusable
+        smtp.close()
+        raise
+    if response.code != SMTP_COMPLETED:
+        raise aiosmtplib.SMTPDataError(response.code, response.message)
+    return {
+        error.recipient: SMTPResponse(error.code, error.message)
+        for error in errors
+    }, response.message
+
+
+class SMTPConnection(object):
+    """Pooled SMTP connection with health tracking."""
+
+    def __init__(self, config: SMTPConfig, number: int):
         """
-        Init client instance.
+        Init connection instance.
 
         Args:
             config (SMTPConfig): SMTP config
+            number (int): connection number in pool
 
         """
+        self.number = number
         self.smtp = aiosmtplib.SMTP(
             hostname=config.host,
             port=config.port,
+            timeout=config.timeout,
         )
+        self.messages_sent = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def is_connected(self) -> bool:
+        """
+        Check connection state.
+
+        Returns:
+            is_connected (bool): connection is open
+
+        """
+        return self.smtp.is_connected
+
+    @property
+    def is_healthy(self) -> bool:
+        """
+        Check connection health.
+
+        Returns:
+            is_healthy (bool): connection has not failed several times in row
+
+        """
+        return self.consecutive_failures < MAX_CONSECUTIVE_FAILURES
 
     async def connect(self) -> SMTPResponse:
         """
-        Set up SMTP connection and return response.
+        Open connection.
 
         Returns:
-            response (SMTPResponse): response of command
+            response (SMTPResponse): server greeting
+
+        Raises:
+            ConnectionError: if connection was failed
 
         """
         try:
             response = await self.smtp.connect()
         except Exception as exception_conn:
+            self.mark_failed()
             logger.exception(
                 'Connection to server was failed. {0}'.format(
                     exception_conn,
                 ),
             )
             raise ConnectionError
-        if response[0] == SMTP_OK:
-            logger.info(
-                'SMTP started successfully: {0}'.format(
-                    response,
-                ),
-            )
-            return response
-        else:
+        if response[0] != SMTP_OK:
+            self.mark_failed()
+            self.smtp.close()
             logger.error(
                 'SMTP has problem to start: {0}'.format(
                     response,
                 ),
             )
             raise ConnectionError
+        self.messages_sent = 0
+        return response
+
+    async def noop(self):
+        """Check idle connection with `NOOP`, close it if server is gone."""
+        try:
+            await self.smtp.noop()
+        except Exception as exception:
+            self.mark_failed()
+            self.smtp.close()
+            logger.warning(
+                'SMTP connection #{0} keepalive was failed. {1}'.format(
+                    self.number,
+                    exception,
+                ),
+            )
+        else:
+            self.last_used = time.monotonic()
+
+    async def close(self):
+        """Close connection with `QUIT`."""
+        if not self.is_connected:
+            return
+        try:
+            await self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+    def mark_sent(self):
+        """Update stats after successful send."""
+        self.messages_sent += 1
+        self.consecutive_failures = 0
+        self.last_used = time.monotonic()
+
+    def mark_failed(self):
+        """Update stats after failure."""
+        self.failures += 1
+        self.consecutive_failures += 1
+
+
+class SMTPClient(object):
+    """
+    SMTP client.
+
+    Client keeps pool of SMTP connections. Connections are opened lazily,
+    checked with `NOOP` while idle, recycled after configured number of
+    messages and reopened after disconnect.
+
+    """
+
+    def __init__(self, config: SMTPConfig):
+        """
+        Init client instance.
+
+        Args:
+            config (SMTPConfig): SMTP config
+
+        """
+        self.config = config
+        self.connections: List[SMTPConnection] = [
+            SMTPConnection(config=config, number=number)
+            for number in range(config.pool_size)
+        ]
+        self._idle = asyncio.Queue()
+        for connection in self.connections:
+            self._idle.put_nowait(connection)
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._connected = registry.gauge('smtp_connections_connected')
+        self._reconnects = registry.counter('smtp_reconnects')
+        self._sent = registry.counter('smtp_messages_sent')
+
+    async def connect(self) -> SMTPResponse:
+        """
+        Check SMTP server with first connection and start keepalive.
+
+        Other connections are opened on demand.
+
+        Returns:
+            response (SMTPResponse): response of command
+
+        Raises:
+            ConnectionError: if server is not available
+
+        """
+        connection = await self._idle.get()
+        try:
+            response = await connection.connect()
+        finally:
+            self._idle.put_nowait(connection)
+            self._update_gauge()
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+        logger.info(
+            'SMTP started successfully, pool size: {0}'.format(
+                self.config.pool_size,
+            ),
+        )
+        return response
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[SMTPConnection]:
+        """
+        Take connected connection from pool.
+
+        Yields:
+            connection (SMTPConnection): exclusive connection
+
+        """
+        connection = await self._idle.get()
+        try:
+            await self._prepare(connection)
+            yield connection
+        except aiosmtplib.SMTPServerDisconnected:
+            connection.mark_failed()
+            connection.smtp.close()
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+            self._update_gauge()
+
+    async def send_message(self, msg: Message):
+        """
+        Send email message, reconnect once if connection was dropped.
+
+        Args:
+            msg (Message): email message
+
+        Returns:
+            response of server
+
+        """
+        return await self._send(
+            lambda smtp: smtp.send_message(message=msg),
+        )
+
+    async def send_raw(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        payload: bytes,
+    ):
+        """
+        Send serialized message, reconnect once if connection was dropped.
+
+        Args:
+            sender (str): envelope sender
+            recipients (Sequence[str]): envelope recipients
+            payload (bytes): serialized message
+
+        Returns:
+            response of server: refused recipients and server message
+
+        """
+        return await self._send(
+            lambda smtp: smtp.sendmail(sender, recipients, payload),
+        )
+
+    async def send_stream(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        chunks: Callable[[], Iterable[bytes]],
+    ):
+        """
+        Send message streamed by chunks, reconnect once if it was dropped.
+
+        Args:
+            sender (str): envelope sender
+            recipients (Sequence[str]): envelope recipients
+            chunks (Callable[[], Iterable[bytes]]): factory of message
+                chunks, called for every attempt
+
+        Returns:
+            response of server: refused recipients and server message
+
+        """
+        return await self._send(
+            lambda smtp: sendmail_stream(smtp, sender, recipients, chunks()),
+        )
 
     async def send_msg(self, msg: Message):
         """
@@ -66,14 +380,91 @@ class SMTPClient(object):
 
         Args:
             msg (Message): email message
+
+        Returns:
+            response of server or None if sending was failed
+
         """
         try:
-            return await self.smtp.send_message(
-                message=msg,
-            )
+            return await self.send_message(msg)
         except Exception as exception:
             logger.exception(
                 'Sending message(s) was failed. {0}'.format(
                     exception,
                 ),
             )
+
+    async def close(self):
+        """Stop keepalive and close all connections."""
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        await asyncio.gather(
+            *[connection.close() for connection in self.connections],
+        )
+        self._update_gauge()
+        logger.info('SMTP has been stopped successfully.')
+
+    async def _send(self, command: Callable[[aiosmtplib.SMTP], Awaitable]):
+        """
+        Run send command over pooled connection.
+
+        Args:
+            command (Callable[[aiosmtplib.SMTP], Awaitable]): send command
+
+        Returns:
+            response of server
+
+        Raises:
+            SMTPServerDisconnected: if connection was dropped twice
+
+        """
+        for attempt in range(2):
+            try:
+                async with self.connection() as connection:
+                    response = await command(connection.smtp)
+                    connection.mark_sent()
+            except aiosmtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                continue
+            self._sent.inc()
+            return response
+
+    async def _prepare(self, connection: SMTPConnection):
+        """
+        Recycle and (re)connect connection if required.
+
+        Args:
+            connection (SMTPConnection): connection to prepare
+
+        """
+        is_worn = (
+            connection.messages_sent >= self.config.max_messages_per_connection
+        )
+        if connection.is_connected and (is_worn or not connection.is_healthy):
+            await connection.close()
+        if not connection.is_connected:
+            if connection.failures:
+                self._reconnects.inc()
+            await connection.connect()
+
+    async def _keepalive(self):
+        """Send `NOOP` over connections which are idle for too long."""
+        while True:  # noqa:WPS457
+            await asyncio.sleep(self.config.keepalive_interval)
+            threshold = time.monotonic() - self.config.keepalive_interval
+            for _ in range(self._idle.qsize()):
+                connection = self._idle.get_nowait()
+                try:
+                    if connection.is_connected:
+                        if connection.last_used < threshold:
+                            await connection.noop()
+                finally:
+                    self._idle.put_nowait(connection)
+            self._update_gauge()
+
+    def _update_gauge(self):
+        self._connected.set(
+            sum(connection.is_connected for connection in self.connections),
+        )
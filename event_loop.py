@@ -0,0 +1,86 @@
+"""
+Event loop module.
+
+App runs on `uvloop` if it is installed, with fallback to default
+asyncio loop. Loop is tuned by `WebAppConfig`: size of default executor
+used by `run_in_executor(None, ...)` and threshold of slow callbacks
+logged by asyncio debug mode, server by keep-alive timeout, backlog
+of listening socket and time to wait for requests on stop.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from config_model import WebAppConfig
+
+try:
+    import uvloop
+except ImportError:  # optional dependency
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+LOOP_AUTO = 'auto'
+LOOP_UVLOOP = 'uvloop'
+LOOP_ASYNCIO = 'asyncio'
+
+
+def new_event_loop(config: WebAppConfig) -> asyncio.AbstractEventLoop:
+    """
+    Create event loop selected by config and set it as current one.
+
+    Args:
+        config (WebAppConfig): server config
+
+    Returns:
+        loop (asyncio.AbstractEventLoop): new loop
+
+    Raises:
+        ValueError: if loop is unknown
+
+    """
+    if config.loop not in {LOOP_AUTO, LOOP_UVLOOP, LOOP_ASYNCIO}:
+        raise ValueError('Unknown event loop {0}.'.format(config.loop))
+    if config.loop == LOOP_UVLOOP and uvloop is None:
+        logger.warning('uvloop is not installed, asyncio loop is used.')
+    if config.loop != LOOP_ASYNCIO and uvloop is not None:
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+    if config.executor_workers:
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=config.executor_workers),
+        )
+    if config.slow_callback_duration:
+        # slow callbacks are reported only in debug mode
+        loop.set_debug(True)
+        loop.slow_callback_duration = config.slow_callback_duration
+    asyncio.set_event_loop(loop)
+    logger.info(
+        'Event loop {0} has been created.'.format(type(loop).__module__),
+    )
+    return loop
+
+
+def run_app(app: web.Application, config: WebAppConfig, **kwargs):
+    """
+    Run app on new event loop until it is stopped.
+
+    Args:
+        app (web.Application): app to run
+        config (WebAppConfig): server config
+        kwargs: extra key parameters of `web.run_app`
+
+    """
+    web.run_app(
+        app=app,
+        host=config.host,
+        port=config.port,
+        keepalive_timeout=config.keepalive_timeout,
+        backlog=config.backlog,
+        shutdown_timeout=config.shutdown_timeout,
+        loop=new_event_loop(config),
+        **kwargs,
+    )
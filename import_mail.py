@@ -0,0 +1,125 @@
+"""
+Module to import mbox or Maildir into letter table.
+
+Usage: python import_mail.py -C config_app.json -u 1 -m 1 -f mbox inbox.mbox
+
+Import can be interrupted and started again with the same arguments,
+it continues after the last written batch. With `--rescan` source is
+read from the beginning and messages which are already stored are skipped.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from config_model import MainConfig
+from db.psql_engine import PostgresEngine
+from emailing.mail_import import MAILDIR, MBOX, MailImporter
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+async def run_import(config: MainConfig, args: argparse.Namespace) -> int:
+    """
+    Run import.
+
+    Args:
+        config (MainConfig): app config
+        args (argparse.Namespace): command line arguments
+
+    Returns:
+        imported (int): number of imported messages
+
+    """
+    db_engine = PostgresEngine(config=config.db)
+    await db_engine.create_engine()
+    importer = MailImporter(
+        db_engine=db_engine,
+        user=args.user,
+        mailbox=args.mailbox,
+        source=args.source,
+        source_format=args.source_format,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rescan=args.rescan,
+    )
+    try:
+        return await importer.run()
+    finally:
+        await db_engine.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-C',
+        '--config',
+        help='Required. Path to file with configurations',
+        required=True,
+        type=argparse.FileType('r'),
+        dest='config_file',
+    )
+    parser.add_argument(
+        '-u',
+        '--user',
+        help='Required. Id of user to import letters for',
+        required=True,
+        type=int,
+    )
+    parser.add_argument(
+        '-m',
+        '--mailbox',
+        help='Required. Id of mailbox to import letters to',
+        required=True,
+        type=int,
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        help='Source format',
+        choices=(MBOX, MAILDIR),
+        default=MBOX,
+        dest='source_format',
+    )
+    parser.add_argument(
+        '-b',
+        '--batch-size',
+        help='Letters written with single COPY',
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        help='Parser processes, CPU count by default',
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        '-r',
+        '--rescan',
+        help='Ignore checkpoint, skip messages already stored in mailbox',
+        action='store_true',
+    )
+    parser.add_argument(
+        'source',
+        help='Path to mbox file or Maildir directory',
+    )
+    parsed_args = parser.parse_args()
+    main_config = MainConfig(**json.loads(parsed_args.config_file.read()))
+
+    logger_handler = logging.StreamHandler(sys.stderr)
+    logger_handler.setFormatter(
+        logging.Formatter(
+            '{asctime} :: {name:22s} :: {levelname:8s} :: {message}',
+            style='{',
+        ),
+    )
+    logger.addHandler(logger_handler)
+
+    try:
+        asyncio.run(run_import(main_config, parsed_args))
+    except KeyboardInterrupt:
+        logger.info('Import was interrupted, it can be continued.')
@@ -0,0 +1,140 @@
+"""
+Group processing module.
+
+Items submitted by concurrent sessions are collected and handled with
+a single call when batch is full or after short delay, so every
+delivery does not pay for its own transaction or process round trip.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+import sqlalchemy as sa
+
+from db.psql_engine import PostgresEngine
+from db.schema import Letter
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_Pending = Tuple[Any, asyncio.Future]
+
+
+class Batcher(object):
+    """Group processing of items submitted concurrently."""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        batch_size: int,
+        delay: float,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            name (str): name of batcher, prefix of its metrics
+            handler (Callable[[List[Any]], Awaitable[List[Any]]]): returns
+                results of items in the same order
+            batch_size (int): max items handled at once
+            delay (float): seconds, max wait for batch to fill
+
+        """
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.delay = delay
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._batch_sizes = registry.summary('{0}_batch_size'.format(name))
+        self._latency = registry.summary('{0}_batch_seconds'.format(name))
+
+    async def submit(self, items: List[Any]) -> List[Any]:
+        """
+        Queue items and wait until their batch is handled.
+
+        Args:
+            items (List[Any]): items to handle
+
+        Returns:
+            results (List[Any]): results of items
+
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self._pending.append((item, future))
+            futures.append(future)
+        if len(self._pending) >= self.batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self._flush_now)
+        return list(await asyncio.gather(*futures))
+
+    async def stop(self):
+        """Handle queued items and wait for running batches."""
+        self._flush_now()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            self._pending = self._pending[self.batch_size:]
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[_Pending]):
+        """
+        Handle batch and resolve waiting sessions.
+
+        Args:
+            batch (List[_Pending]): items with futures of their results
+
+        """
+        try:
+            with self._latency.time():
+                results = await self.handler([item for item, _ in batch])
+        except Exception as exception:
+            logger.exception(
+                'Batch of {0} {1} items was failed. {2}'.format(
+                    len(batch),
+                    self.name,
+                    exception,
+                ),
+            )
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+        self._batch_sizes.observe(len(batch))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+async def insert_letters(
+    db_engine: PostgresEngine,
+    letters: List[dict],
+) -> List[int]:
+    """
+    Insert letters with single statement.
+
+    Args:
+        db_engine (PostgresEngine): db engine
+        letters (List[dict]): values of `letter` rows
+
+    Returns:
+        letter_ids (List[int]): ids of inserted letters
+
+    """
+    stmt = sa.insert(Letter).values(letters).returning(Letter.id)
+    async with db_engine.session() as session:
+        async with session.begin():
+            return (await session.execute(stmt)).scalars().all()
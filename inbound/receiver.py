@@ -0,0 +1,440 @@
+"""
+Inbound receiver module.
+
+Embedded LMTP (or SMTP) server accepting deliveries for local users.
+Messages of concurrent deliveries are parsed in process pool in batches
+and their letters are group-committed, delivery is confirmed only
+after its letters are committed.
+"""
+import asyncio
+import logging
+import re
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+
+from config_model import InboundConfig
+from db.psql_engine import PostgresEngine
+from db.schema import MailBox, User
+from emailing.delivery import get_domain
+from emailing.mail_import import LETTER_COLUMNS, SourceMessage, parse_batch
+from inbound.batcher import Batcher, insert_letters
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LMTP = 'lmtp'
+SMTP = 'smtp'
+ADDRESS_PATTERN = re.compile(r'^(?:MAIL FROM|RCPT TO):\s*<?([^>\s]*)>?', re.I)
+SIZE_PATTERN = re.compile(r'\sSIZE=(\d+)', re.I)
+MAX_CACHED_RECIPIENTS = 10000
+
+
+class Recipient(NamedTuple):
+    """Local recipient."""
+
+    address: str
+    user: int
+    username: str
+    mailbox: int
+
+
+class _Transaction(object):
+    """State of mail transaction."""
+
+    def __init__(self):
+        self.sender: Optional[str] = None
+        self.recipients: List[Recipient] = []
+
+
+class InboundReceiver(object):
+    """LMTP/SMTP server delivering messages into `letter` table."""
+
+    def __init__(
+        self,
+        config: InboundConfig,
+        db_engine: PostgresEngine,
+        domain: str = '',
+    ):
+        """
+        Init class instance.
+
+        Args:
+            config (InboundConfig): receiver config
+            db_engine (PostgresEngine): db engine
+            domain (str): local domain if it is not set in config
+
+        """
+        self.config = config
+        self.db_engine = db_engine
+        self.domain = (config.domain or domain).lstrip('@').lower()
+        self.hostname = socket.getfqdn()
+        self.parser = Batcher(
+            name='inbound_parse',
+            handler=self._parse,
+            batch_size=config.batch_size,
+            delay=config.batch_delay,
+        )
+        self.committer = Batcher(
+            name='inbound_commit',
+            handler=self._commit,
+            batch_size=config.batch_size,
+            delay=config.batch_delay,
+        )
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._recipients: Dict[str, Recipient] = {}
+        self._delivered = registry.counter('inbound_delivered')
+        self._rejected = registry.counter('inbound_rejected')
+        self._connections = registry.gauge('inbound_connections')
+
+    async def start(self):
+        """Start listening."""
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.config.parse_workers,
+        )
+        self.server = await asyncio.start_server(
+            self._handle,
+            self.config.host,
+            self.config.port,
+        )
+        logger.info(
+            'Inbound {0} receiver listens on {1}:{2}.'.format(
+                self.config.protocol.upper(),
+                self.config.host,
+                self.config.port,
+            ),
+        )
+
+    async def stop(self):
+        """Stop listening and commit received letters."""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.parser.stop()
+        await self.committer.stop()
+        if self._pool:
+            self._pool.shutdown()
+        logger.info('Inbound receiver has been stopped.')
+
+    async def resolve(self, address: str) -> Optional[Recipient]:
+        """
+        Find local user and mailbox of recipient address.
+
+        Address matches user whose username is either address itself
+        or its local part if address domain is local.
+
+        Args:
+            address (str): recipient address
+
+        Returns:
+            recipient (Optional[Recipient]): recipient, None if unknown
+
+        """
+        address = address.lower()
+        recipient = self._recipients.get(address)
+        if recipient:
+            return recipient
+        usernames = [address]
+        if get_domain(address) == self.domain:
+            usernames.append(address.rpartition('@')[0])
+        stmt = sa.select(
+            User.id,
+            User.username,
+            MailBox.id.label('mailbox'),
+        ).join(
+            MailBox,
+            sa.or_(MailBox.user == User.id, MailBox.user.is_(None)),
+        ).where(
+            sa.func.lower(User.username).in_(usernames),
+            MailBox.name == self.config.mailbox,
+        ).order_by(
+            MailBox.user.nullslast(),
+        ).limit(1)
+        async with self.db_engine.session() as session:
+            row = (await session.execute(stmt)).first()
+        if row is None:
+            return None
+        recipient = Recipient(
+            address=address,
+            user=row.id,
+            username=row.username,
+            mailbox=row.mailbox,
+        )
+        if len(self._recipients) >= MAX_CACHED_RECIPIENTS:
+            self._recipients.clear()
+        self._recipients[address] = recipient
+        return recipient
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        self._connections.inc()
+        try:
+            await self._serve(reader, writer)
+        except (asyncio.TimeoutError, ConnectionError):
+            logger.debug('Inbound connection was dropped.')
+        except Exception as exception:
+            logger.exception(
+                'Inbound session was failed. {0}'.format(exception),
+            )
+        finally:
+            self._connections.dec()
+            writer.close()
+
+    async def _serve(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        """
+        Run commands of client session.
+
+        Commands are processed in order they were received,
+        so clients may pipeline them.
+
+        Args:
+            reader (asyncio.StreamReader): client stream
+            writer (asyncio.StreamWriter): server stream
+
+        """
+        transaction = _Transaction()
+        await self._reply(
+            writer,
+            '220 {0} {1} ready'.format(
+                self.hostname,
+                self.config.protocol.upper(),
+            ),
+        )
+        while True:  # noqa:WPS457
+            try:
+                line = await self._readline(reader)
+            except ValueError:
+                # longer than stream limit, the line was discarded
+                await self._reply(writer, '500 5.5.2 Line too long')
+                continue
+            if not line:
+                return
+            command_line = line.decode('utf-8', errors='replace').rstrip()
+            command = command_line[:4].upper()
+            if command in {'LHLO', 'EHLO', 'HELO'}:
+                transaction = _Transaction()
+                await self._reply(writer, *self._hello(command))
+            elif command == 'MAIL':
+                await self._reply(
+                    writer,
+                    self._mail(command_line, transaction),
+                )
+            elif command == 'RCPT':
+                await self._reply(
+                    writer,
+                    await self._rcpt(command_line, transaction),
+                )
+            elif command == 'DATA':
+                await self._data(reader, writer, transaction)
+                transaction = _Transaction()
+            elif command == 'RSET':
+                transaction = _Transaction()
+                await self._reply(writer, '250 2.0.0 Ok')
+            elif command == 'NOOP':
+                await self._reply(writer, '250 2.0.0 Ok')
+            elif command == 'QUIT':
+                await self._reply(writer, '221 2.0.0 Bye')
+                return
+            else:
+                await self._reply(writer, '502 5.5.2 Command unknown')
+
+    def _hello(self, command: str) -> List[str]:
+        is_lmtp = self.config.protocol == LMTP
+        if is_lmtp != (command == 'LHLO'):
+            return ['500 5.5.1 Use {0}'.format('LHLO' if is_lmtp else 'EHLO')]
+        return [
+            '250-{0}'.format(self.hostname),
+            '250-PIPELINING',
+            '250-8BITMIME',
+            '250-ENHANCEDSTATUSCODES',
+            '250 SIZE {0}'.format(self.config.max_size),
+        ]
+
+    def _mail(self, command_line: str, transaction: _Transaction) -> str:
+        if transaction.sender is not None:
+            return '503 5.5.1 Sender already specified'
+        match = ADDRESS_PATTERN.match(command_line)
+        if not match:
+            return '501 5.5.4 Syntax: MAIL FROM:<address>'
+        size = SIZE_PATTERN.search(command_line)
+        if size and int(size.group(1)) > self.config.max_size:
+            self._rejected.inc()
+            return '552 5.3.4 Message too big'
+        transaction.sender = match.group(1)
+        return '250 2.1.0 Ok'
+
+    async def _rcpt(self, command_line: str, transaction: _Transaction) -> str:
+        if transaction.sender is None:
+            return '503 5.5.1 Need MAIL command'
+        match = ADDRESS_PATTERN.match(command_line)
+        if not match:
+            return '501 5.5.4 Syntax: RCPT TO:<address>'
+        if len(transaction.recipients) >= self.config.max_recipients:
+            return '452 4.5.3 Too many recipients'
+        recipient = await self.resolve(match.group(1))
+        if recipient is None:
+            self._rejected.inc()
+            return '550 5.1.1 User unknown'
+        transaction.recipients.append(recipient)
+        return '250 2.1.5 Ok'
+
+    async def _data(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        transaction: _Transaction,
+    ):
+        """
+        Receive message, store letters and reply when they are committed.
+
+        LMTP client gets reply for every recipient, SMTP one gets single
+        reply for the whole transaction.
+
+        Args:
+            reader (asyncio.StreamReader): client stream
+            writer (asyncio.StreamWriter): server stream
+            transaction (_Transaction): mail transaction
+
+        """
+        if not transaction.recipients:
+            await self._reply(writer, '503 5.5.1 Need RCPT command')
+            return
+        await self._reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+        raw = await asyncio.wait_for(
+            self._read_message(reader),
+            self.config.timeout,
+        )
+        if raw is None:
+            self._rejected.inc()
+            replies = ['552 5.3.4 Message too big']
+        else:
+            replies = await self._deliver(raw, transaction)
+        if self.config.protocol == LMTP:
+            if len(replies) == 1:
+                replies = replies * len(transaction.recipients)
+            await self._reply(writer, *replies)
+            return
+        await self._reply(writer, replies[0])
+
+    async def _deliver(
+        self,
+        raw: bytes,
+        transaction: _Transaction,
+    ) -> List[str]:
+        try:
+            record, = await self.parser.submit([raw])
+        except Exception:
+            return ['451 4.3.0 Message parsing failure']
+        parsed = dict(zip(LETTER_COLUMNS, record))
+        letters = [
+            dict(parsed, user=recipient.user, mailbox=recipient.mailbox)
+            for recipient in transaction.recipients
+        ]
+        try:
+            await self.committer.submit(letters)
+        except Exception:
+            return ['451 4.3.0 Temporary storage failure']
+        self._delivered.inc(len(letters))
+        return [
+            '250 2.0.0 <{0}> Delivered'.format(recipient.address)
+            for recipient in transaction.recipients
+        ]
+
+    async def _read_message(
+        self,
+        reader: asyncio.StreamReader,
+    ) -> Optional[bytes]:
+        """
+        Read message until terminating dot, removing dot-stuffing.
+
+        Lines longer than stream limit are read in parts, so message
+        of any line length is read up to the end and gets reply.
+
+        Args:
+            reader (asyncio.StreamReader): client stream
+
+        Returns:
+            raw (Optional[bytes]): message, None if it is too big
+
+        Raises:
+            ConnectionError: if client closed connection
+
+        """
+        chunks = []
+        size = 0
+        at_line_start = True
+        while True:  # noqa:WPS457
+            try:
+                chunk = await reader.readuntil(b'\n')
+            except asyncio.LimitOverrunError as exception:
+                chunk = await reader.readexactly(exception.consumed)
+            except asyncio.IncompleteReadError:
+                raise ConnectionError
+            if at_line_start:
+                if chunk in {b'.\r\n', b'.\n'}:
+                    break
+                if chunk.startswith(b'.'):
+                    chunk = chunk[1:]
+            at_line_start = chunk.endswith(b'\n')
+            size += len(chunk)
+            if size <= self.config.max_size:
+                chunks.append(chunk)
+        if size > self.config.max_size:
+            return None
+        return b''.join(chunks)
+
+    async def _readline(self, reader: asyncio.StreamReader) -> bytes:
+        return await asyncio.wait_for(reader.readline(), self.config.timeout)
+
+    async def _reply(self, writer: asyncio.StreamWriter, *lines: str):
+        writer.write(
+            ''.join('{0}\r\n'.format(line) for line in lines).encode(),
+        )
+        await writer.drain()
+
+    async def _parse(self, raws: List[bytes]) -> List[Tuple]:
+        """
+        Parse batch of messages in process pool.
+
+        Args:
+            raws (List[bytes]): raw messages
+
+        Returns:
+            records (List[Tuple]): rows in order of `LETTER_COLUMNS`
+
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool,
+            parse_batch,
+            [
+                SourceMessage(position=0, key='', raw=raw, flags='')
+                for raw in raws
+            ],
+            None,
+            None,
+        )
+
+    async def _commit(self, letters: List[dict]) -> List[int]:
+        """
+        Insert batch of letters.
+
+        Users are notified about new letters by `letter` table trigger.
+
+        Args:
+            letters (List[dict]): values of `letter` rows
+
+        Returns:
+            letter_ids (List[int]): ids of inserted letters
+
+        """
+        return await insert_letters(self.db_engine, letters)
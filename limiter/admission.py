@@ -0,0 +1,221 @@
+"""
+Admission control module.
+
+Every route has its own concurrency limit and a bounded wait queue.
+Limits are adapted with AIMD driven by observed DB latency:
+limit grows additively while DB is fast and the route is saturated
+and shrinks multiplicatively when DB latency exceeds the target.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from config_model import AdmissionConfig
+from metrics import Summary, registry
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter(object):
+    """Concurrency limiter with bounded wait queue."""
+
+    def __init__(self, name: str, config: AdmissionConfig, max_limit: int):
+        """
+        Init class instance.
+
+        Args:
+            name (str): limiter name, route path
+            config (AdmissionConfig): admission config
+            max_limit (int): upper bound of limit
+
+        """
+        self.name = name
+        self.config = config
+        self.max_limit = max_limit
+        self.limit = float(min(config.initial_limit, max_limit))
+        self.in_flight = 0
+        self.saturated = False
+        self._waiters = deque()
+        self._limit_gauge = registry.gauge(
+            'admission_limit:{0}'.format(name),
+        )
+        self._limit_gauge.set(int(self.limit))
+        self._rejected = registry.counter(
+            'admission_rejected:{0}'.format(name),
+        )
+
+    @property
+    def queued(self) -> int:
+        """
+        Get number of waiting requests.
+
+        Returns:
+            queued (int): number of waiting requests
+
+        """
+        return len(self._waiters)
+
+    async def acquire(self):
+        """
+        Acquire slot, wait in queue if limit is reached.
+
+        Raises:
+            HTTPServiceUnavailable: if queue is full or waiting timed out
+
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.saturated = self.saturated or self.in_flight >= self.limit
+            return
+        self.saturated = True
+        if len(self._waiters) >= self.config.queue_size:
+            self._reject()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.config.queue_timeout)
+        except asyncio.TimeoutError:
+            self._drop(waiter)
+            self._reject()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._drop(waiter)
+            raise
+
+    def release(self):
+        """Release slot and wake up waiting requests."""
+        self.in_flight -= 1
+        self._wake_up()
+
+    def increase(self):
+        """Increase limit additively."""
+        self.limit = min(
+            float(self.max_limit),
+            self.limit + self.config.increase,
+        )
+        self._limit_gauge.set(int(self.limit))
+        self._wake_up()
+
+    def decrease(self):
+        """Decrease limit multiplicatively."""
+        self.limit = max(
+            float(self.config.min_limit),
+            self.limit * self.config.decrease_factor,
+        )
+        self._limit_gauge.set(int(self.limit))
+
+    def _wake_up(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _drop(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+
+    def _reject(self):
+        self._rejected.inc()
+        raise web.HTTPServiceUnavailable(
+            headers={'Retry-After': str(self.config.retry_after)},
+        )
+
+
+class AdmissionController(object):
+    """Route limiters registry with AIMD adjusting loop."""
+
+    def __init__(self, config: AdmissionConfig, latency: Summary):
+        """
+        Init class instance.
+
+        Args:
+            config (AdmissionConfig): admission config
+            latency (Summary): observed DB latency
+
+        """
+        self.config = config
+        self.latency = latency
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._observed = latency.count
+
+    def limiter_for(self, request: web.Request) -> Optional[AdaptiveLimiter]:
+        """
+        Get limiter for request route.
+
+        Args:
+            request (web.Request): aiohttp request
+
+        Returns:
+            limiter (Optional[AdaptiveLimiter]): route limiter or None
+                if route is not limited
+
+        """
+        resource = request.match_info.route.resource
+        if resource is None:
+            return None
+        name = resource.canonical
+        if name in self.config.exclude:
+            return None
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                name=name,
+                config=self.config,
+                max_limit=self.config.routes.get(name, self.config.max_limit),
+            )
+            self.limiters[name] = limiter
+        return limiter
+
+    def start(self):
+        """Start adjusting loop."""
+        self._task = asyncio.create_task(self._adjust_loop())
+
+    async def stop(self):
+        """Stop adjusting loop."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                logger.info('Admission control has been stopped.')
+            self._task = None
+
+    def adjust(self):
+        """
+        Adjust limits of all routes according to DB latency.
+
+        Latency is taken into account only if queries were observed
+        since the last adjustment, average of idle DB is stale.
+        """
+        is_fresh = self.latency.count != self._observed
+        self._observed = self.latency.count
+        is_overloaded = (
+            is_fresh and self.latency.ewma > self.config.latency_target
+        )
+        for limiter in self.limiters.values():
+            if is_overloaded:
+                limiter.decrease()
+            elif limiter.saturated:
+                limiter.increase()
+            limiter.saturated = False
+
+    async def _adjust_loop(self):
+        while True:  # noqa:WPS457
+            await asyncio.sleep(self.config.adjust_interval)
+            try:
+                self.adjust()
+            except Exception as exception:
+                logger.exception(
+                    'Admission limits adjusting was failed. {0}'.format(
+                        exception,
+                    ),
+                )
@@ -0,0 +1,161 @@
+"""
+Fair queueing module.
+
+Access to DB pool is shared between users with weighted round-robin.
+Every user has own queue and a cap on in-flight queries, so one user
+running heavy searches can not occupy the whole pool.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHT = 1
+
+
+class FairScheduler(object):
+    """Weighted round-robin scheduler of pool slots."""
+
+    def __init__(
+        self,
+        capacity: int,
+        user_limit: int,
+        weights: Optional[Dict[Hashable, int]] = None,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            capacity (int): total number of slots, pool size
+            user_limit (int): max slots taken by single user
+            weights (Optional[Dict[Hashable, int]]): slots granted to user
+                per round, default is 1
+
+        """
+        self.capacity = capacity
+        self.user_limit = user_limit
+        self.weights = weights or {}
+        self.in_flight = 0
+        self._user_in_flight: Dict[Hashable, int] = {}
+        self._queues: Dict[Hashable, deque] = {}
+        self._credits: Dict[Hashable, int] = {}
+        self._ring = deque()
+        self._waiting_gauge = registry.gauge('db_fair_queue_waiting')
+        self._wait_latency = registry.summary('db_fair_queue_wait_seconds')
+
+    @asynccontextmanager
+    async def slot(self, user: Hashable) -> AsyncIterator[None]:
+        """
+        Hold slot while in `async with` block.
+
+        Args:
+            user (Hashable): user id, None for anonymous requests
+
+        Yields:
+            None
+
+        """
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    async def acquire(self, user: Hashable):
+        """
+        Wait for user turn and take slot.
+
+        Args:
+            user (Hashable): user id
+
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = deque()
+            self._queues[user] = queue
+            self._credits[user] = self._weight(user)
+            self._ring.append(user)
+        queue.append(waiter)
+        self._waiting_gauge.inc()
+        self._dispatch()
+        if waiter.done():
+            self._wait_latency.observe(0)
+            return
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(user)
+            else:
+                self._drop(user, waiter)
+            raise
+        self._wait_latency.observe(time.perf_counter() - started)
+
+    def release(self, user: Hashable):
+        """
+        Return slot taken by user.
+
+        Args:
+            user (Hashable): user id
+
+        """
+        self.in_flight -= 1
+        user_in_flight = self._user_in_flight[user] - 1
+        if user_in_flight:
+            self._user_in_flight[user] = user_in_flight
+        else:
+            self._user_in_flight.pop(user)
+        self._dispatch()
+
+    def _weight(self, user: Hashable) -> int:
+        return max(self.weights.get(user, DEFAULT_WEIGHT), 1)
+
+    def _dispatch(self):
+        """Grant free slots to waiting users in round-robin order."""
+        skipped = 0
+        while self.in_flight < self.capacity and skipped < len(self._ring):
+            user = self._ring[0]
+            queue = self._queues[user]
+            if not queue:
+                self._forget(user)
+                skipped = 0
+                continue
+            if self._user_in_flight.get(user, 0) >= self.user_limit:
+                self._ring.rotate(-1)
+                skipped += 1
+                continue
+            skipped = 0
+            self._grant(user, queue.popleft())
+            self._credits[user] -= 1
+            if self._credits[user] <= 0:
+                self._credits[user] = self._weight(user)
+                self._ring.rotate(-1)
+
+    def _grant(self, user: Hashable, waiter: asyncio.Future):
+        self._waiting_gauge.dec()
+        self.in_flight += 1
+        self._user_in_flight[user] = self._user_in_flight.get(user, 0) + 1
+        waiter.set_result(None)
+
+    def _drop(self, user: Hashable, waiter: asyncio.Future):
+        queue = self._queues.get(user)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        self._waiting_gauge.dec()
+
+    def _forget(self, user: Hashable):
+        self._ring.popleft()
+        self._queues.pop(user)
+        self._credits.pop(user)
@@ -0,0 +1,277 @@
+"""
+Metrics module.
+
+Simple in-process metrics: counters, gauges and latency summaries.
+All metrics are registered in `registry` and exposed with `metrics_view`.
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from aiohttp import web
+
+SUMMARY_WINDOW = 1024
+EWMA_WEIGHT = 0.1
+
+
+class Counter(object):
+    """Monotonically increasing counter."""
+
+    def __init__(self, name: str):
+        """
+        Init class instance.
+
+        Args:
+            name (str): metric name
+
+        """
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        """
+        Increase counter.
+
+        Args:
+            amount (int): value to add
+
+        """
+        self.value += amount
+
+    def to_dict(self) -> dict:
+        """
+        Convert metric to json-format.
+
+        Returns:
+            serialized (dict): metric value
+
+        """
+        return {'value': self.value}
+
+
+class Gauge(object):
+    """Value that can go up and down."""
+
+    def __init__(self, name: str):
+        """
+        Init class instance.
+
+        Args:
+            name (str): metric name
+
+        """
+        self.name = name
+        self.value = 0
+
+    def set(self, value: float):  # noqa:WPS125
+        """
+        Set gauge value.
+
+        Args:
+            value (float): new value
+
+        """
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        """
+        Increase gauge.
+
+        Args:
+            amount (float): value to add
+
+        """
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        """
+        Decrease gauge.
+
+        Args:
+            amount (float): value to subtract
+
+        """
+        self.value -= amount
+
+    def to_dict(self) -> dict:
+        """
+        Convert metric to json-format.
+
+        Returns:
+            serialized (dict): metric value
+
+        """
+        return {'value': self.value}
+
+
+class Summary(object):
+    """
+    Latency summary.
+
+    Keeps total count and sum, exponentially weighted moving average
+    and a sliding window of last observations for quantiles.
+
+    """
+
+    def __init__(self, name: str, window: int = SUMMARY_WINDOW):
+        """
+        Init class instance.
+
+        Args:
+            name (str): metric name
+            window (int): number of observations kept for quantiles
+
+        """
+        self.name = name
+        self.count = 0
+        self.total = 0.0  # noqa:WPS110
+        self.ewma = 0.0
+        self._window = deque(maxlen=window)
+
+    def observe(self, value: float):
+        """
+        Add observation.
+
+        Args:
+            value (float): observed value, seconds for latencies
+
+        """
+        if not self.count:
+            self.ewma = value
+        else:
+            self.ewma += EWMA_WEIGHT * (value - self.ewma)
+        self.count += 1
+        self.total += value
+        self._window.append(value)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:  # noqa:WPS125
+        """
+        Observe duration of `with` block.
+
+        Yields:
+            None
+
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q_value: float) -> float:
+        """
+        Get quantile of observations in window.
+
+        Args:
+            q_value (float): quantile, from 0 to 1
+
+        Returns:
+            quantile (float): observed value
+
+        """
+        if not self._window:
+            return 0.0
+        ordered = sorted(self._window)
+        return ordered[min(int(q_value * len(ordered)), len(ordered) - 1)]
+
+    def to_dict(self) -> dict:
+        """
+        Convert metric to json-format.
+
+        Returns:
+            serialized (dict): metric values
+
+        """
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'ewma': self.ewma,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Registry(object):
+    """Metrics registry."""
+
+    def __init__(self):
+        """Init class instance."""
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str) -> Counter:
+        """
+        Get or create counter.
+
+        Args:
+            name (str): metric name
+
+        Returns:
+            metric (Counter): counter
+
+        """
+        return self._get_or_create(name, Counter)
+
+    def gauge(self, name: str) -> Gauge:
+        """
+        Get or create gauge.
+
+        Args:
+            name (str): metric name
+
+        Returns:
+            metric (Gauge): gauge
+
+        """
+        return self._get_or_create(name, Gauge)
+
+    def summary(self, name: str) -> Summary:
+        """
+        Get or create summary.
+
+        Args:
+            name (str): metric name
+
+        Returns:
+            metric (Summary): summary
+
+        """
+        return self._get_or_create(name, Summary)
+
+    def to_dict(self) -> dict:
+        """
+        Convert all metrics to json-format.
+
+        Returns:
+            serialized (dict): metrics by name
+
+        """
+        return {
+            name: metric.to_dict()
+            for name, metric in sorted(self.metrics.items())
+        }
+
+    def _get_or_create(self, name: str, metric_class: type):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = metric_class(name)
+            self.metrics[name] = metric
+        return metric
+
+
+registry = Registry()
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    """
+    Return all metrics.
+
+    Args:
+        request (web.Request): aiohttp request
+
+    Returns:
+        response (web.Response): metrics in json-format
+
+    """
+    return web.json_response(registry.to_dict())
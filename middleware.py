@@ -32,6 +32,9 @@ async def check_login(
     """
     Check request for session.
 
+    Decoded JWT claims are stored on request (`TOKEN_DATA_KEY`),
+    so handlers do not decode the token again.
+
     Args:
         request (web.Request): request to process
         handler (_WebHandler): handler to process
@@ -46,6 +49,64 @@ async def check_login(
     return await handler(request)
 
 
+@web.middleware
+async def track_requests(
+    request: web.Request,
+    handler: _WebHandler,  # noqa:WPS110
+) -> web.StreamResponse:
+    """
+    Count requests in flight, so shutdown waits for them.
+
+    While app is draining, responses close keep-alive connection.
+
+    Args:
+        request (web.Request): request to process
+        handler (_WebHandler): handler to process
+
+    Returns:
+        processed data
+
+    """
+    tracker = request.app.get('requests')
+    if tracker is None or not tracker.is_tracked(request):
+        return await handler(request)
+    with tracker.track():
+        response = await handler(request)
+    if tracker.draining:
+        response.force_close()
+    return response
+
+
+@web.middleware
+async def admission_control(
+    request: web.Request,
+    handler: _WebHandler,  # noqa:WPS110
+) -> web.StreamResponse:
+    """
+    Limit number of concurrent requests per route.
+
+    Request waits in bounded queue if route limit is reached
+    and fails fast with 503 if queue is full.
+
+    Args:
+        request (web.Request): request to process
+        handler (_WebHandler): handler to process
+
+    Returns:
+        processed data
+
+    """
+    admission = request.app.get('admission')
+    limiter = admission.limiter_for(request) if admission else None
+    if limiter is None:
+        return await handler(request)
+    await limiter.acquire()
+    try:
+        return await handler(request)
+    finally:
+        limiter.release()
+
+
 @web.middleware
 async def check_for_body(
     request: web.Request,
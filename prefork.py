@@ -0,0 +1,386 @@
+"""
+Pre-fork multi-process launcher module.
+
+Supervisor imports the app once, freezes imported objects for garbage
+collector, so their memory pages stay shared copy-on-write, and forks
+workers. Every worker runs its own event loop and binds the same port
+with `SO_REUSEPORT`, kernel spreads connections between them. Pools of
+db and SMTP connections are split between workers, so total number of
+pooled connections stays as configured, unless pool is smaller than
+number of workers, every worker has at least one connection. Besides
+pool every worker opens own db connections: letter change listener
+and, with `postgres` Socket.IO manager, publishing and listening bus
+connections, i.e. `workers * 3` more connections at most. While worker
+is restarted by `SIGHUP`, old and new workers are connected both.
+Inbound receiver and mailbox sync run only in the first worker.
+
+Dead workers are restarted, with growing delay if they keep crashing.
+`SIGHUP` restarts workers one by one, new worker is started before the
+old one is stopped, so the port is served all the time. `SIGTERM` and
+`SIGINT` stop all workers gracefully, every worker drains its requests
+and outbox deliveries before exit.
+"""
+import gc
+import logging
+import math
+import os
+import random
+import select
+import signal
+import time
+from typing import Dict, Optional, Set
+
+from config_model import MainConfig
+from event_loop import run_app
+from web_app import Application
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5  # seconds, supervisor loop
+READY_TIMEOUT = 60.0  # seconds, max wait for worker startup
+STOP_TIMEOUT = 15.0  # seconds, cleanup after draining, then worker is killed
+MIN_UPTIME = 5.0  # seconds, worker exited earlier is crashing
+MAX_RESTART_DELAY = 30.0  # seconds
+
+
+def share(total: int, workers: int, index: int) -> int:
+    """
+    Split total between workers, remainder goes to the first ones.
+
+    Args:
+        total (int): total number
+        workers (int): number of workers
+        index (int): worker index, from 0
+
+    Returns:
+        share (int): part of worker, shares sum up to total
+
+    """
+    return total // workers + int(index < total % workers)
+
+
+def worker_config(config: MainConfig, workers: int, index: int) -> MainConfig:
+    """
+    Make config of single worker.
+
+    Args:
+        config (MainConfig): app config, pool sizes are totals
+        workers (int): number of workers
+        index (int): worker index, from 0
+
+    Returns:
+        config (MainConfig): config with pools split between workers
+
+    """
+    db = config.db.copy(
+        update={
+            'pool_size': max(1, share(config.db.pool_size, workers, index)),
+            'max_overflow': share(config.db.max_overflow, workers, index),
+        },
+    )
+    smtp = config.smtp.copy(
+        update={
+            'pool_size': max(
+                1,
+                share(config.smtp.pool_size, workers, index),
+            ),
+        },
+    )
+    update = {'db': db, 'smtp': smtp}
+    if index:
+        update['inbound'] = config.inbound.copy(update={'enabled': False})
+        update['sync'] = config.sync.copy(update={'enabled': False})
+    return config.copy(update=update)
+
+
+class Worker(object):
+    """Forked worker process."""
+
+    def __init__(self, index: int, pid: int, ready_fd: int):
+        """
+        Init class instance.
+
+        Args:
+            index (int): worker index
+            pid (int): process id
+            ready_fd (int): pipe, worker writes to it after startup
+
+        """
+        self.index = index
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.started = time.monotonic()
+
+
+class Supervisor(object):
+    """Supervisor of pre-forked app workers."""
+
+    def __init__(
+        self,
+        config: MainConfig,
+        workers: int,
+        config_path: Optional[str] = None,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            config (MainConfig): app config
+            workers (int): number of workers
+            config_path (Optional[str]): config file, reloaded on `SIGHUP`
+
+        """
+        self.config = config
+        self.workers = workers
+        self.config_path = config_path
+        self._workers: Dict[int, Worker] = {}
+        self._exited: Set[int] = set()
+        self._restart_at: Dict[int, float] = {}
+        self._restart_delay: Dict[int, float] = {}
+        self._stopping = False
+        self._rolling = False
+
+    def run(self):
+        """Fork workers and supervise them until `SIGTERM` or `SIGINT`."""
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        if self.config.socketio.manager in {'local', 'memory'}:
+            logger.warning(
+                'Socket.IO events do not reach other workers, '
+                'use `unix` or `postgres` manager.',
+            )
+        gc.disable()
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info('Supervisor has started {0} workers.'.format(self.workers))
+        while not self._stopping:
+            time.sleep(POLL_INTERVAL)
+            self._reap()
+            self._restart_exited()
+            if self._rolling and not self._stopping:
+                self._rolling = False
+                self._roll()
+        self._stop_all()
+        logger.info('Supervisor has been stopped.')
+
+    def _on_stop(self, *args):
+        self._stopping = True
+
+    def _on_reload(self, *args):
+        self._rolling = True
+
+    def _spawn(self, index: int) -> Worker:
+        """
+        Fork worker.
+
+        Args:
+            index (int): worker index
+
+        Returns:
+            worker (Worker): started worker, it may be not ready yet
+
+        """
+        ready_fd, notify_fd = os.pipe()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_fd)
+            for other in self._workers.values():
+                self._close_ready(other)
+            self._run_worker(index, notify_fd)
+        os.close(notify_fd)
+        worker = Worker(index=index, pid=pid, ready_fd=ready_fd)
+        self._workers[index] = worker
+        logger.info('Worker #{0} was started, pid {1}.'.format(index, pid))
+        return worker
+
+    def _run_worker(self, index: int, notify_fd: int):
+        """
+        Run app in forked process, never returns.
+
+        Args:
+            index (int): worker index
+            notify_fd (int): pipe to notify supervisor after startup
+
+        """
+        code = 0
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            gc.enable()
+            random.seed()
+            config = worker_config(self.config, self.workers, index)
+            app = Application(config)
+
+            async def notify_ready(*args):  # noqa:WPS430
+                os.write(notify_fd, b'1')
+                os.close(notify_fd)
+
+            app.on_startup.append(notify_ready)
+            run_app(app=app, config=config.app, reuse_port=True, print=None)
+        except Exception as exception:
+            logger.exception(
+                'Worker #{0} was failed. {1!r}'.format(index, exception),
+            )
+            code = 1
+        finally:
+            logging.shutdown()
+            os._exit(code)  # noqa:WPS437
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        """
+        Wait for worker startup.
+
+        Args:
+            worker (Worker): started worker
+
+        Returns:
+            ready (bool): False if worker exited or did not start in time
+
+        """
+        try:
+            readable, _, _ = select.select(
+                [worker.ready_fd],
+                [],
+                [],
+                READY_TIMEOUT,
+            )
+            return bool(readable) and os.read(worker.ready_fd, 1) == b'1'
+        finally:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+
+    def _reap(self):
+        while True:  # noqa:WPS457
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._exited.add(pid)
+            logger.info(
+                'Worker process {0} has exited with status {1}.'.format(
+                    pid,
+                    status,
+                ),
+            )
+
+    def _restart_exited(self):
+        """Restart exited workers, with delay if they are crashing."""
+        now = time.monotonic()
+        for index, worker in list(self._workers.items()):
+            if worker.pid not in self._exited:
+                continue
+            if index not in self._restart_at:
+                delay = 0.0
+                if now - worker.started < MIN_UPTIME:
+                    delay = min(
+                        max(self._restart_delay.get(index, 0), 0.5) * 2,
+                        MAX_RESTART_DELAY,
+                    )
+                self._restart_delay[index] = delay
+                self._restart_at[index] = now + delay
+                if delay:
+                    logger.warning(
+                        'Worker #{0} is crashing, restart in {1}s.'.format(
+                            index,
+                            delay,
+                        ),
+                    )
+            if now >= self._restart_at[index]:
+                del self._restart_at[index]  # noqa:WPS420
+                self._exited.discard(worker.pid)
+                self._close_ready(worker)
+                self._spawn(index)
+
+    def _roll(self):
+        """Reload config and replace workers one by one."""
+        self._reload_config()
+        logger.info('Rolling restart of workers.')
+        for index in sorted(self._workers):
+            old = self._workers[index]
+            self._close_ready(old)
+            if index == 0 and self._has_singletons():
+                # inbound port and sync can not be shared with new worker
+                self._stop(old)
+                self._spawn(index)
+                continue
+            new = self._spawn(index)
+            if not self._wait_ready(new):
+                logger.error(
+                    'Worker #{0} did not start, rolling restart was '
+                    'stopped.'.format(index),
+                )
+                self._stop(new)
+                self._workers[index] = old
+                return
+            self._stop(old)
+        logger.info('Rolling restart is completed.')
+
+    def _reload_config(self):
+        if not self.config_path:
+            return
+        try:
+            with open(self.config_path) as config_file:
+                self.config = MainConfig.parse_raw(config_file.read())
+        except Exception as exception:
+            logger.exception(
+                'Config was not reloaded, old one is used. {0}'.format(
+                    exception,
+                ),
+            )
+
+    def _has_singletons(self) -> bool:
+        return self.config.inbound.enabled or self.config.sync.enabled
+
+    def _stop(self, worker: Worker):
+        """
+        Stop worker gracefully, kill it if it does not exit in time.
+
+        Args:
+            worker (Worker): worker to stop
+
+        """
+        self._signal(worker.pid, signal.SIGTERM)
+        self._wait_exit({worker.pid})
+        self._exited.discard(worker.pid)
+
+    def _stop_all(self):
+        pids = set()
+        for worker in self._workers.values():
+            self._close_ready(worker)
+            if worker.pid not in self._exited:
+                self._signal(worker.pid, signal.SIGTERM)
+                pids.add(worker.pid)
+        self._wait_exit(pids)
+        self._workers = {}
+
+    def _wait_exit(self, pids: Set[int]):
+        # draining and cancelling of requests are limited by shutdown timeout
+        deadline = time.monotonic() + STOP_TIMEOUT + (
+            2 * self.config.app.shutdown_timeout
+        )
+        while pids - self._exited:
+            if time.monotonic() > deadline:
+                for pid in pids - self._exited:
+                    logger.warning('Worker process {0} is killed.'.format(pid))
+                    self._signal(pid, signal.SIGKILL)
+                deadline = math.inf
+            time.sleep(0.1)
+            self._reap()
+
+    @staticmethod
+    def _signal(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass  # noqa:WPS420
+
+    @staticmethod
+    def _close_ready(worker: Worker):
+        if worker.ready_fd >= 0:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
@@ -52,7 +52,7 @@ class BaseRepository(IRepository):
         stmt = sa.insert(
            self.table,
         )
-        async with self.db_engine.session_maker() as session:
+        async with self.db_engine.session() as session:
             async with session.begin():
                 try:
                     result_insert = await session.execute(
@@ -97,7 +97,7 @@ class BaseRepository(IRepository):
         ).execution_options(
             synchronize_session='fetch',
         )
-        async with self.db_engine.session_maker() as session:
+        async with self.db_engine.session() as session:
             async with session.begin():
                 try:
                     result_update = await session.execute(stmt)
@@ -135,7 +135,7 @@ class BaseRepository(IRepository):
         ).execution_options(
             synchronize_session='fetch',
         )
-        async with self.db_engine.session_maker() as session:
+        async with self.db_engine.session() as session:
             async with session.begin():
                 try:
                     result_delete = await session.execute(stmt)
@@ -255,7 +255,7 @@ class BaseRepository(IRepository):
             stmt = stmt.order_by(
                 *[sa.text(ob) for ob in order_by],
             )
-        async with self.db_engine.session_maker() as session:
+        async with self.db_engine.session() as session:
             async with session.begin():
                 try:
                     select_result = await session.execute(stmt)
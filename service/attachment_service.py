@@ -0,0 +1,232 @@
+"""Attachment service module."""
+import logging
+import os
+from typing import AsyncIterable, AsyncIterator
+
+from aiohttp import BodyPartReader, MultipartReader, hdrs
+
+from attachment.store import DEFAULT_CONTENT_TYPE
+from emailing.email_message import normalize_content_type
+from service.base_service import BaseService
+from service.mapper import BodyUploadCreate
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentService(BaseService):
+    """Attachment service, repository works with letter table."""
+
+    async def upload(
+        self,
+        multipart: MultipartReader,
+        entity_id: int,
+        user_id: int,
+    ) -> dict:
+        """
+        Store files of multipart request and attach them to letter.
+
+        Parts are streamed to attachment store chunk by chunk,
+        fields without file name are skipped. Invalid part type is
+        replaced with generic one.
+
+        Args:
+            multipart (MultipartReader): request body reader
+            entity_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): ids, hashes and sizes of attachments
+
+        Raises:
+            KeyError: if letter does not exist
+
+        """
+        letter = await self.repo.select_first(
+            where=[
+                self.repo.table.id == int(entity_id),
+                self.repo.table.user == user_id,
+            ],
+        )
+        if not letter:
+            raise KeyError
+        store = self.app['attachments']
+        uploaded = []
+        while True:  # noqa:WPS457
+            part = await multipart.next()  # noqa:B305 , aiohttp usage
+            if part is None:
+                break
+            if not isinstance(part, BodyPartReader) or not part.filename:
+                continue
+            upload = await store.write(self._read_chunks(part))
+            try:
+                attachment_pk = await store.link(
+                    upload=upload,
+                    letter=letter.id,
+                    filename=os.path.basename(part.filename),
+                    content_type=normalize_content_type(
+                        part.headers.get(hdrs.CONTENT_TYPE),
+                    ) or DEFAULT_CONTENT_TYPE,
+                )
+            except Exception:
+                store.discard(upload)
+                raise
+            uploaded.append(
+                {
+                    'attachment_pk': attachment_pk,
+                    'sha256': upload.sha256,
+                    'size': upload.size,
+                },
+            )
+        return {
+            'data': uploaded,
+        }
+
+    async def get_attachment(
+        self,
+        entity_id: int,
+        user_id: int,
+        number: int,
+    ) -> dict:
+        """
+        Get attachment of letter by its number.
+
+        Args:
+            entity_id (int): letter id
+            user_id (int): current user id
+            number (int): attachment number, from 0
+
+        Returns:
+            attachment (dict): file name, MIME type, hash, size and path
+
+        Raises:
+            KeyError: if letter or attachment does not exist
+
+        """
+        letter = await self.repo.select_first(
+            where=[
+                self.repo.table.id == int(entity_id),
+                self.repo.table.user == user_id,
+            ],
+        )
+        if not letter:
+            raise KeyError
+        attachment = await self.app['attachments'].get_letter_attachment(
+            letter=letter.id,
+            number=int(number),
+        )
+        if not attachment:
+            raise KeyError
+        return attachment
+
+    async def create_upload(
+        self,
+        request_body: dict,
+        entity_id: int,
+        user_id: int,
+    ) -> dict:
+        """
+        Create resumable upload of letter attachment.
+
+        Args:
+            request_body (dict): file name, size and MIME type
+            entity_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): upload session id
+
+        Raises:
+            KeyError: if request body has wrong mapping or letter
+                does not exist
+
+        """
+        try:
+            request_body = BodyUploadCreate(**request_body)
+        except Exception as exception:
+            logger.exception(exception)
+            raise KeyError
+        letter = await self.repo.select_first(
+            where=[
+                self.repo.table.id == int(entity_id),
+                self.repo.table.user == user_id,
+            ],
+        )
+        if not letter:
+            raise KeyError
+        upload_id = self.app['uploads'].create(
+            user=user_id,
+            letter=letter.id,
+            filename=os.path.basename(request_body.filename),
+            content_type=request_body.content_type or DEFAULT_CONTENT_TYPE,
+            length=request_body.length,
+        )
+        return {
+            'upload_id': upload_id,
+        }
+
+    async def get_upload(self, upload_id: str, user_id: int) -> dict:
+        """
+        Get state of resumable upload.
+
+        Args:
+            upload_id (str): upload session id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): received bytes and declared size
+
+        """
+        return self.app['uploads'].status(upload_id=upload_id, user=user_id)
+
+    async def append_upload(
+        self,
+        upload_id: str,
+        user_id: int,
+        offset: int,
+        chunks: AsyncIterable[bytes],
+    ) -> int:
+        """
+        Write chunk of resumable upload.
+
+        Args:
+            upload_id (str): upload session id
+            user_id (int): current user id
+            offset (int): position of first byte
+            chunks (AsyncIterable[bytes]): request content
+
+        Returns:
+            offset (int): received bytes
+
+        """
+        return await self.app['uploads'].append(
+            upload_id=upload_id,
+            user=user_id,
+            offset=offset,
+            chunks=chunks,
+        )
+
+    async def finalize_upload(self, upload_id: str, user_id: int) -> dict:
+        """
+        Attach complete upload to letter.
+
+        Args:
+            upload_id (str): upload session id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): id, hash and size of attachment
+
+        """
+        return await self.app['uploads'].finalize(
+            upload_id=upload_id,
+            user=user_id,
+        )
+
+    async def _read_chunks(self, part: BodyPartReader) -> AsyncIterator[bytes]:
+        while True:  # noqa:WPS457
+            chunk = await part.read_chunk(
+                self.app['attachments'].config.chunk_size,
+            )
+            if not chunk:
+                return
+            yield chunk
@@ -271,20 +271,3 @@ class BaseService(IService):  # noqa:WPS214
                 attr_val = format_datetime(attr_val)
             serialized[attr.key] = attr_val
         return serialized
-
-    """
-    async def download_files(self):  # TODO move to service
-        if 'multipart/form-data' in self.request.headers.get('Content-Type'):
-            multipart = await self.request.multipart()
-            while not multipart.at_eof():
-                part = await multipart.next()  # noqa:B305 , aiohttp usage
-                if not part:
-                    break
-                with open(part.filename, 'wb') as new_file:
-                    while True:
-                        chunk = await part.read_chunk()
-                        if not chunk:
-                            break
-                        new_file.write(chunk)
-                    new_file.seek(0)
-    """
\ No newline at end of file
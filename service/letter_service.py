@@ -1,19 +1,223 @@
 """Letter service module."""
 import logging
+from email.utils import getaddresses, parseaddr
+from typing import List, Optional, Tuple
 
+from emailing.bulk import plan_batches
+from emailing.email_message import Message
 from service.base_service import BaseService
+from service.mapper import BodyBulkSend
 
 logger = logging.getLogger(__name__)
 
+RECIPIENT_HEADERS = ('To', 'CC', 'BCC')
+
 
 class LetterService(BaseService):
     """Letter service."""
 
-    async def send_email(self):  # TODO
-        """Get letter from db by id, create email and send it."""
-        # smtp = self.app['smtp']
-        # letter = await self.retrieve(bake='first')
-        # email = Message(raw_data=letter)
-        # rr = await smtp.send_msg(msg=email)
+    async def retrieve(
+        self,
+        entity_id: Optional[int] = None,
+        url_query: Optional[dict] = None,
+        user_id: Optional[int] = None,
+        bake: str = 'all',
+    ) -> dict:
+        """
+        Run select method.
+
+        Body of synced letter is fetched from mail server
+        when letter is requested by id.
+
+        Args:
+            entity_id (Optional[int]): letter id
+            url_query(Optional[dict]): url query
+            bake (str): form-factor for return
+            user_id (int): current user id
+
+        Returns:
+            result (dict): result of repo command
+
+        """
+        retrieved = await super().retrieve(
+            entity_id=entity_id,
+            url_query=url_query,
+            user_id=user_id,
+            bake=bake,
+        )
+        if not entity_id or 'sync' not in self.app:
+            return retrieved
+        letters = retrieved['data'] if bake == 'all' else [retrieved]
+        for letter in letters:
+            if letter.get('id') and not letter.get('body_fetched'):
+                body = await self.app['sync'].fetch_body(
+                    int(entity_id),
+                    user_id,
+                )
+                if body is not None:
+                    letter['body'] = body
+                    letter['body_fetched'] = True
+        return retrieved
+
+    async def changes(self, url_query: dict, user_id: int) -> dict:
+        """
+        Get changes of letters after `since` sequence number.
+
+        Args:
+            url_query (dict): url query with `since` and optional `limit`
+            user_id (int): current user id
+
+        Returns:
+            result (dict): merged changes, see `ChangeLog.changes`
+
+        Raises:
+            ValueError: if query values are not numbers, `since` is
+                negative or `limit` is less than 1
+
+        """
+        since = int(url_query.get('since') or 0)
+        limit = url_query.get('limit')
+        limit = int(limit) if limit else None
+        if since < 0 or (limit is not None and limit < 1):
+            raise ValueError
+        return await self.app['changelog'].changes(
+            user_id=user_id,
+            since=since,
+            limit=limit,
+        )
+
+    async def send_email(self, entity_id: int, user_id: int) -> dict:
+        """
+        Get letter from db by id, create email and put it to outbox.
+
+        Message is delivered by outbox workers, so method returns
+        as soon as message is enqueued.
+
+        Args:
+            entity_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): id of queued message
+
+        """
+        letter, email, recipients = await self._render(entity_id, user_id)
+        payload, attachments = email.to_segments()
+        queued_pk = await self.app['outbox'].enqueue(
+            user=user_id,
+            letter=letter['id'],
+            sender=parseaddr(letter['sender'])[1],
+            recipients=recipients,
+            payload=payload,
+            attachments=attachments,
+        )
+        return {
+            'queued_pk': queued_pk,
+        }
+
+    async def send_bulk(
+        self,
+        request_body: dict,
+        entity_id: int,
+        user_id: int,
+    ) -> dict:
+        """
+        Send letter to many recipients.
+
+        Message is rendered once, recipients are grouped by domain and
+        split into transactions up to RCPT limit, every transaction
+        is queued in outbox.
+
+        Args:
+            request_body (dict): request body with recipients
+            entity_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            result (dict): ids of queued transactions
+
+        Raises:
+            KeyError: if request body has wrong mapping
+
+        """
+        try:
+            request_body = BodyBulkSend(**request_body)
+        except Exception as exception:
+            logger.exception(exception)
+            raise KeyError
+        letter, email, _ = await self._render(entity_id, user_id)
+        payload, attachments = email.to_segments()
+        queued = await self.app['outbox'].enqueue_many(
+            user=user_id,
+            letter=letter['id'],
+            sender=parseaddr(letter['sender'])[1],
+            batches=plan_batches(
+                request_body.recipients,
+                self.app['smtp'].config.max_rcpt_per_transaction,
+            ),
+            payload=payload,
+            attachments=attachments,
+        )
+        return {
+            'queued_pk': queued,
+        }
+
+    async def _render(
+        self,
+        entity_id: int,
+        user_id: int,
+    ) -> Tuple[dict, Message, List[str]]:
+        """
+        Get letter from db and create email.
+
+        Attachments are referenced by path in store,
+        they are encoded from disk while sending.
+
+        Args:
+            entity_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            rendered (Tuple[dict, Message, List[str]]): letter, email without
+                `BCC` header and envelope recipients
+
+        Raises:
+            KeyError: if letter does not exist
 
-        raise NotImplementedError
+        """
+        letter = await self.repo.select_first(
+            where=[
+                self.repo.table.id == int(entity_id),
+                self.repo.table.user == user_id,
+            ],
+        )
+        if not letter:
+            raise KeyError
+        letter = self.to_dict(letter)
+        attachments = await self.app['attachments'].get_letter_attachments(
+            letter['id'],
+        )
+        email = Message(
+            raw_data=letter,
+            attachments=[
+                (
+                    attachment['path'],
+                    attachment['filename'],
+                    attachment['content_type'],
+                )
+                for attachment in attachments
+            ],
+        )
+        recipients = [
+            address
+            for _, address in getaddresses(
+                [
+                    value
+                    for header in RECIPIENT_HEADERS
+                    for value in email.get_all(header, [])
+                ],
+            )
+            if address
+        ]
+        del email['BCC']  # noqa:WPS420
+        return letter, email, recipients
@@ -4,8 +4,10 @@ Config module.
 Module describe structure of application config.
 """
 
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, validator
+from typing import List, Optional
+
+from emailing.email_message import normalize_content_type
 
 
 class BodyDelete(BaseModel):
@@ -28,3 +30,42 @@ class BodyUpdate(BaseModel):
 class POSTBody(BaseModel):
     filter_set: Optional[dict]
     payload: Optional[dict]
+
+
+class BodyBulkSend(BaseModel):
+    """Body structure for bulk sending."""
+
+    recipients: List[str]
+
+
+class BodyUploadCreate(BaseModel):
+    """Body structure for creating resumable upload."""
+
+    filename: str
+    length: int
+    content_type: Optional[str]
+
+    @validator('content_type')
+    def check_content_type(  # noqa:N805 , pydantic validator
+        cls,
+        content_type: Optional[str],
+    ) -> Optional[str]:
+        """
+        Normalize MIME type, it is put into headers of letter and download.
+
+        Args:
+            content_type (Optional[str]): MIME type given by client
+
+        Returns:
+            content_type (Optional[str]): lowercased `type/subtype`
+
+        Raises:
+            ValueError: if type does not match `type/subtype` grammar
+
+        """
+        if not content_type:
+            return None
+        normalized = normalize_content_type(content_type)
+        if normalized is None:
+            raise ValueError('Invalid content type')
+        return normalized
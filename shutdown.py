@@ -0,0 +1,104 @@
+"""
+Graceful shutdown module.
+
+On stop aiohttp closes listening socket, runs `on_shutdown` hooks,
+then aborts reading of request bodies and cancels requests which are
+not completed in `shutdown_timeout`. App waits for requests in flight
+in `on_shutdown` first, so uploads are not cut, requests queued by
+admission control are completed and responses of draining app close
+keep-alive connections, clients reconnect to other worker. Long-lived
+routes, Socket.IO connections, are not waited, clients reconnect.
+"""
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from aiohttp import web
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTracker(object):
+    """Counter of requests in flight, waited on shutdown."""
+
+    def __init__(self, exclude: Iterable[str] = ()):
+        """
+        Init class instance.
+
+        Args:
+            exclude (Iterable[str]): routes not waited, e.g. `/socket.io/`
+
+        """
+        self.exclude = set(exclude)
+        self.in_flight = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._gauge = registry.gauge('http_requests_in_flight')
+        self._cut = registry.counter('http_requests_cut')
+
+    def is_tracked(self, request: web.Request) -> bool:
+        """
+        Check if request is waited on shutdown.
+
+        Args:
+            request (web.Request): aiohttp request
+
+        Returns:
+            is_tracked (bool): route is not excluded
+
+        """
+        resource = request.match_info.route.resource
+        return resource is None or resource.canonical not in self.exclude
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        Count request while it is handled.
+
+        Yields:
+            nothing, request is handled inside
+
+        """
+        self.in_flight += 1
+        self._gauge.set(self.in_flight)
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._gauge.set(self.in_flight)
+            if not self.in_flight:
+                self._idle.set()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Switch to draining and wait for requests in flight.
+
+        Args:
+            timeout (Optional[float]): seconds, wait without limit if None
+
+        Returns:
+            drained (bool): False if requests were left after timeout
+
+        """
+        self.draining = True
+        logger.info(
+            'Draining {0} requests in flight.'.format(self.in_flight),
+        )
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._cut.inc(self.in_flight)
+            logger.warning(
+                '{0} requests were not completed in {1}s.'.format(
+                    self.in_flight,
+                    timeout,
+                ),
+            )
+            return False
+        logger.info('Requests have been drained.')
+        return True
@@ -0,0 +1,121 @@
+"""
+Letter change listener module.
+
+`letter` table trigger publishes compact JSON payload on every change
+with `NOTIFY`. Every worker keeps single listening connection and
+passes payloads of connected users to event aggregator, so clients get
+new letters, read flags and unread deltas without polling. After
+listening connection was lost, connected clients are asked to resync.
+
+Every worker gets all notifications itself, so changes are emitted
+only to its own sessions, bypassing message bus of Socket.IO manager.
+"""
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import asyncpg
+
+from config_model import PostgresConfig
+from metrics import registry
+from socket_io.namespace import (
+    EVENT_RESYNC,
+    NAMESPACE_INBOX,
+    EventAggregator,
+    sio,
+)
+from socket_io.registry import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'letter_change'
+RECONNECT_DELAY = 1.0  # seconds
+
+
+class LetterChangeListener(object):
+    """Fan-out of `letter_change` notifications to Socket.IO sessions."""
+
+    def __init__(
+        self,
+        config: PostgresConfig,
+        sessions: SessionRegistry,
+        events: EventAggregator,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            config (PostgresConfig): db config
+            sessions (SessionRegistry): connected sessions
+            events (EventAggregator): aggregator emitting changes
+
+        """
+        self.config = config
+        self.sessions = sessions
+        self.events = events
+        self._task: Optional[asyncio.Task] = None
+        self._connection: Optional[asyncpg.Connection] = None
+        self._received = registry.counter('notify_received')
+
+    def start(self):
+        """Start listening."""
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """Stop listening."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._connection is not None:
+            await self._connection.close()
+        logger.info('Letter change listener has been stopped.')
+
+    async def _listen(self):
+        """Keep listening connection, reconnect if it was lost."""
+        reconnected = False
+        while True:  # noqa:WPS457
+            lost = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(
+                    user=self.config.user,
+                    password=self.config.password,
+                    host=self.config.hostname,
+                    port=self.config.port,
+                    database=self.config.database,
+                )
+                self._connection.add_termination_listener(
+                    lambda _: lost.set(),
+                )
+                await self._connection.add_listener(CHANNEL, self._on_notify)
+            except (OSError, asyncpg.PostgresError) as exception:
+                logger.warning(
+                    'Letter change listener can not connect. {0!r}'.format(
+                        exception,
+                    ),
+                )
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            logger.info('Letter change listener has been started.')
+            if reconnected:
+                # changes were missed while connection was lost
+                self.events.clear()
+                await sio.emit(
+                    EVENT_RESYNC,
+                    {},
+                    namespace=NAMESPACE_INBOX,
+                    ignore_queue=True,
+                )
+            reconnected = True
+            await lost.wait()
+            logger.warning('Letter change listener connection was lost.')
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        self._received.inc()
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.warning('Wrong letter change payload {0}.'.format(payload))
+            return
+        if change.get('u') in self.sessions:
+            self.events.add(change)
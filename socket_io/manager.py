@@ -0,0 +1,391 @@
+"""
+Socket.IO client managers module.
+
+Default manager of `sio` delivers events only to sessions of its own
+process. Pub/sub managers publish every emit to message bus, and every
+worker connected to the bus emits it to its own sessions, so events
+reach users wherever they are connected. Backends are:
+
+* `postgres`, `NOTIFY` of db the workers already share, for many nodes;
+* `unix`, datagram UNIX sockets of workers on one host;
+* `memory`, servers of single process, for tests.
+
+Messages are stamped with publish time, delay from publish to local
+emit is observed as fan-out latency.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import socket
+import time
+from typing import Dict, Optional, Set
+
+import asyncpg
+from socketio import AsyncManager
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+from config_model import PostgresConfig, SocketIOConfig
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+FANOUT_METRIC = 'socketio_fanout_seconds'
+NOTIFY_LIMIT = 7999  # bytes, max `NOTIFY` payload
+DATAGRAM_LIMIT = 65536  # bytes, below default socket buffer size
+RECONNECT_DELAY = 1.0  # seconds
+SEND_TIMEOUT = 1.0  # seconds, max wait for full socket of worker
+
+
+class BusManager(AsyncPubSubManager):
+    """
+    Base of pub/sub managers with JSON messages.
+
+    Subclasses implement `_send` and `_receive` of encoded messages.
+    Emits larger than `max_message` bytes are delivered only to sessions
+    of publishing worker.
+    """
+
+    name = 'bus'
+    max_message: Optional[int] = None
+
+    def __init__(self, channel: str = 'socketio', write_only: bool = False):
+        """
+        Init class instance.
+
+        Args:
+            channel (str): bus channel name
+            write_only (bool): only publish, do not receive messages
+
+        """
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._fanout = registry.summary(FANOUT_METRIC)
+        self._sent = registry.counter('socketio_bus_sent')
+        self._failed = registry.counter('socketio_bus_failed')
+
+    async def close(self):
+        """Stop receiving and release bus resources."""
+        thread = getattr(self, 'thread', None)
+        if thread is not None:
+            thread.cancel()
+            await asyncio.gather(thread, return_exceptions=True)
+
+    async def _publish(self, data: dict):
+        data['ts'] = time.time()
+        message = json.dumps(data, separators=(',', ':'))
+        if self.max_message and len(message.encode()) > self.max_message:
+            self._failed.inc()
+            logger.warning(
+                'Socket.IO message of {0} bytes is too large for bus.'.format(
+                    len(message),
+                ),
+            )
+            if data.get('method') == 'emit':
+                await self._handle_emit(data)  # to local sessions only
+            return
+        try:
+            await self._send(message)
+        except (OSError, asyncpg.PostgresError) as exception:
+            self._failed.inc()
+            logger.warning(
+                'Socket.IO message was not published. {0!r}'.format(
+                    exception,
+                ),
+            )
+            return
+        self._sent.inc()
+
+    async def _listen(self):
+        async for message in self._receive():
+            yield json.loads(message)
+
+    async def _handle_emit(self, message: dict):
+        await super()._handle_emit(message)
+        published = message.get('ts')
+        if published is not None:
+            self._fanout.observe(max(time.time() - published, 0))
+
+    async def _send(self, message: str):
+        raise NotImplementedError
+
+    async def _receive(self):
+        raise NotImplementedError
+
+
+class MemoryManager(BusManager):
+    """Bus of Socket.IO servers of single process."""
+
+    name = 'memory'
+    _channels: Dict[str, Set[asyncio.Queue]] = {}
+
+    def __init__(self, channel: str = 'socketio', write_only: bool = False):
+        """
+        Init class instance.
+
+        Args:
+            channel (str): bus channel name
+            write_only (bool): only publish, do not receive messages
+
+        """
+        super().__init__(channel=channel, write_only=write_only)
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def close(self):
+        """Leave channel."""
+        self._channels.get(self.channel, set()).discard(self._queue)
+        await super().close()
+
+    async def _send(self, message: str):
+        for queue in self._channels.get(self.channel, ()):
+            queue.put_nowait(message)
+
+    async def _receive(self):
+        self._channels.setdefault(self.channel, set()).add(self._queue)
+        while True:  # noqa:WPS457
+            yield await self._queue.get()
+
+
+class UnixSocketManager(BusManager):
+    """
+    Bus of workers of one host over datagram UNIX sockets.
+
+    Every worker binds socket `<channel>.<host id>.sock` in shared
+    directory and publishes message to all sockets found there. Sockets
+    of dead workers are removed by first publisher which gets refused.
+    Publisher waits while queue of receiver is full, message is dropped
+    if receiver does not read it in `SEND_TIMEOUT`.
+    """
+
+    name = 'unix'
+    max_message = DATAGRAM_LIMIT
+
+    def __init__(
+        self,
+        directory: str,
+        channel: str = 'socketio',
+        write_only: bool = False,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            directory (str): directory of worker sockets
+            channel (str): bus channel name
+            write_only (bool): only publish, do not receive messages
+
+        """
+        super().__init__(channel=channel, write_only=write_only)
+        self.directory = directory
+        self.path = os.path.join(
+            directory,
+            '{0}.{1}.sock'.format(channel, self.host_id),
+        )
+        self._peers: Dict[str, socket.socket] = {}
+        self._receiver: Optional[socket.socket] = None
+
+    def initialize(self):
+        """Bind socket of worker before receiving is started."""
+        if not self.write_only:
+            os.makedirs(self.directory, exist_ok=True)
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.setblocking(False)
+            self._receiver.bind(self.path)
+        super().initialize()
+
+    async def close(self):
+        """Close and remove socket of worker."""
+        await super().close()
+        for peer in self._peers.values():
+            peer.close()
+        self._peers = {}
+        if self._receiver is not None:
+            self._receiver.close()
+            self._unlink(self.path)
+            self._receiver = None
+
+    async def _send(self, message: str):
+        data = message.encode()
+        pattern = os.path.join(
+            glob.escape(self.directory),
+            '{0}.*.sock'.format(glob.escape(self.channel)),
+        )
+        paths = set(glob.glob(pattern))
+        for gone in set(self._peers) - paths:
+            self._peers.pop(gone).close()
+        for path in paths:
+            try:
+                await self._send_peer(path, data)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._peers.pop(path).close()
+                self._unlink(path)  # worker is dead
+            except asyncio.TimeoutError:
+                self._failed.inc()  # receiver does not keep up
+
+    async def _send_peer(self, path: str, data: bytes):
+        """
+        Send datagram to worker, wait while its queue is full.
+
+        Args:
+            path (str): socket path of worker
+            data (bytes): message
+
+        """
+        peer = self._peers.get(path)
+        if peer is None:
+            peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            peer.setblocking(False)
+            self._peers[path] = peer
+            peer.connect(path)
+        loop = asyncio.get_running_loop()
+        while True:  # noqa:WPS457
+            try:
+                peer.send(data)
+            except BlockingIOError:
+                writable = loop.create_future()
+                loop.add_writer(
+                    peer.fileno(),
+                    lambda: writable.done() or writable.set_result(None),
+                )
+                try:
+                    await asyncio.wait_for(writable, SEND_TIMEOUT)
+                finally:
+                    loop.remove_writer(peer.fileno())
+            else:
+                return
+
+    async def _receive(self):
+        loop = asyncio.get_running_loop()
+        while True:  # noqa:WPS457
+            data = await loop.sock_recv(self._receiver, DATAGRAM_LIMIT)
+            yield data.decode()
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # noqa:WPS420
+
+
+class PostgresManager(BusManager):
+    """
+    Bus of workers of many nodes over Postgres `LISTEN`/`NOTIFY`.
+
+    Worker keeps one connection publishing with `pg_notify` and one
+    listening connection. Payload of `NOTIFY` is limited to 8000 bytes.
+    """
+
+    name = 'postgres'
+    max_message = NOTIFY_LIMIT
+
+    def __init__(
+        self,
+        config: PostgresConfig,
+        channel: str = 'socketio',
+        write_only: bool = False,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            config (PostgresConfig): db config
+            channel (str): `NOTIFY` channel name
+            write_only (bool): only publish, do not receive messages
+
+        """
+        super().__init__(channel=channel, write_only=write_only)
+        self.config = config
+        self._publisher: Optional[asyncpg.Connection] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def close(self):
+        """Close db connections."""
+        await super().close()
+        for connection in (self._publisher, self._listener):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._publisher = None
+        self._listener = None
+
+    async def _send(self, message: str):
+        async with self._lock:
+            if self._publisher is None or self._publisher.is_closed():
+                self._publisher = await self._connect()
+            try:
+                await self._publisher.execute(
+                    'SELECT pg_notify($1, $2)',
+                    self.channel,
+                    message,
+                )
+            except (OSError, asyncpg.PostgresError):
+                await self._publisher.close()
+                raise
+
+    async def _receive(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        while True:  # noqa:WPS457
+            try:
+                self._listener = await self._connect()
+                self._listener.add_termination_listener(
+                    lambda _: queue.put_nowait(None),
+                )
+                await self._listener.add_listener(
+                    self.channel,
+                    lambda *args: queue.put_nowait(args[-1]),
+                )
+            except (OSError, asyncpg.PostgresError) as exception:
+                logger.warning(
+                    'Socket.IO bus can not connect. {0!r}'.format(exception),
+                )
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            message = await queue.get()
+            while message is not None:
+                yield message
+                message = await queue.get()
+            logger.warning('Socket.IO bus connection was lost.')
+
+    async def _connect(self) -> asyncpg.Connection:
+        return await asyncpg.connect(
+            user=self.config.user,
+            password=self.config.password,
+            host=self.config.hostname,
+            port=self.config.port,
+            database=self.config.database,
+        )
+
+
+def create_manager(
+    config: SocketIOConfig,
+    db_config: PostgresConfig,
+) -> AsyncManager:
+    """
+    Create client manager selected by config.
+
+    Args:
+        config (SocketIOConfig): Socket.IO config
+        db_config (PostgresConfig): db config for `postgres` manager
+
+    Returns:
+        manager (AsyncManager): client manager
+
+    Raises:
+        ValueError: if manager is unknown
+
+    """
+    if config.manager == 'local':
+        return AsyncManager()
+    if config.manager == MemoryManager.name:
+        return MemoryManager(channel=config.channel)
+    if config.manager == UnixSocketManager.name:
+        return UnixSocketManager(
+            directory=config.socket_dir,
+            channel=config.channel,
+        )
+    if config.manager == PostgresManager.name:
+        return PostgresManager(config=db_config, channel=config.channel)
+    raise ValueError(
+        'Unknown Socket.IO manager {0}.'.format(config.manager),
+    )
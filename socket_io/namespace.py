@@ -1,51 +1,468 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, FrozenSet, Optional, Set
+
 import socketio
-from socketio.exceptions import ConnectionRefusedError
-from middleware import require_login
+from socketio.exceptions import ConnectionRefusedError, TimeoutError
 from aiohttp import web
+from config_model import SocketIOConfig
+from metrics import registry
 from middleware import require_login
-from aiohttp_session import get_session
-from aiohttp_security import authorized_userid
+from auth.policy import get_current_user_id
+from changelog.log import ChangeLog
+from socket_io.registry import SessionRegistry
 
+logger = logging.getLogger(__name__)
 
 sio = socketio.AsyncServer(async_mode='aiohttp')
 
 NAMESPACE_INBOX = '/ws'
+EVENT_CHANGES = 'letter_changes'
+EVENT_RESYNC = 'resync'
+MAX_SUBSCRIPTIONS = 100  # mailboxes of single session
+
+
+def user_room(user_id: int) -> str:
+    """
+    Get name of room with all sessions of user.
+
+    Args:
+        user_id (int): user id
+
+    Returns:
+        room (str): room name
+
+    """
+    return 'user:{0}'.format(user_id)
+
+
+class ChangeBatch(object):
+    """
+    Letter changes of user merged for single emit.
+
+    Batch keeps only the last state of every letter: letter inserted
+    and deleted within batch is dropped, update of new letter is left
+    to its fetch. Changes of many rows sent without letter ids mark
+    their mailbox as stale, client reloads it. Payload is made for
+    subscribed mailboxes of session, letter moved out of them is sent
+    as deleted.
+    """
+
+    def __init__(self):
+        """Init class instance."""
+        self.new: Dict[int, int] = {}  # mailbox by letter
+        self.deleted: Dict[int, Set[int]] = {}  # mailboxes by letter
+        self.changed: Dict[int, dict] = {}
+        self.moved: Dict[int, int] = {}  # previous mailbox by letter
+        self.unread: Dict[int, int] = {}
+        self.stale: Set[int] = set()
+        self.count = 0
+
+    def add(self, change: dict):
+        """
+        Merge change notification.
+
+        Args:
+            change (dict): `letter_change` payload
+
+        """
+        self.count += 1
+        mailbox = change['m']
+        self._add_unread(mailbox, change.get('d', 0))
+        if 'pm' in change:
+            self._add_unread(change['pm'], change.get('pd', 0))
+        if 'l' not in change:
+            self.stale.add(mailbox)
+            return
+        letter_id = change['l']
+        if change['op'] == 'I':
+            self.new[letter_id] = mailbox
+        elif change['op'] == 'D':
+            self.changed.pop(letter_id, None)
+            previous = self.moved.pop(letter_id, mailbox)
+            if self.new.pop(letter_id, None) is None:
+                self.deleted[letter_id] = {mailbox, previous}
+        elif letter_id in self.new:
+            self.new[letter_id] = mailbox
+        else:
+            if 'pm' in change:
+                self.moved.setdefault(letter_id, change['pm'])
+            self.changed[letter_id] = {
+                'l': letter_id,
+                'm': mailbox,
+                'r': change.get('r'),
+            }
+
+    def to_dict(self, mailboxes: Optional[FrozenSet[int]] = None) -> dict:
+        """
+        Make event payload.
+
+        Args:
+            mailboxes (Optional[FrozenSet[int]]): subscribed mailboxes,
+                all of them if None
+
+        Returns:
+            payload (dict): `new`, `changed` and `deleted` letters,
+                `unread` deltas and `stale` mailboxes
+
+        """
+        def visible(mailbox: int) -> bool:  # noqa:WPS430
+            return mailboxes is None or mailbox in mailboxes
+
+        changed = [
+            letter for letter in self.changed.values()
+            if visible(letter['m'])
+        ]
+        deleted = [
+            letter_id for letter_id, previous in self.deleted.items()
+            if any(visible(mailbox) for mailbox in previous)
+        ]
+        deleted.extend(
+            letter_id for letter_id, previous in self.moved.items()
+            if visible(previous) and not visible(
+                self.changed[letter_id]['m'],
+            )
+        )
+        return {
+            'new': sorted(
+                letter_id for letter_id, mailbox in self.new.items()
+                if visible(mailbox)
+            ),
+            'changed': changed,
+            'deleted': sorted(deleted),
+            'unread': {
+                str(mailbox): delta
+                for mailbox, delta in self.unread.items()
+                if delta and visible(mailbox)
+            },
+            'stale': sorted(
+                mailbox for mailbox in self.stale if visible(mailbox)
+            ),
+        }
+
+    def _add_unread(self, mailbox: int, delta: int):
+        self.unread[mailbox] = self.unread.get(mailbox, 0) + delta
+
+
+class _Client(object):
+    """Batches waiting for emit to single session."""
+
+    def __init__(self, size: int):
+        self.batches: Deque[dict] = deque()
+        self.size = size
+        self.resync = False
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.counters: Dict[int, int] = {}  # unread deltas, not sent yet
+        self.counters_at = 0.0  # loop time, when counters may be sent
+
+    def put(self, batch: dict) -> bool:
+        if len(self.batches) >= self.size:
+            self.ask_resync()
+            return False
+        self.batches.append(batch)
+        self.ready.set()
+        return True
+
+    def ask_resync(self):
+        self.batches.clear()
+        self.resync = True
+        self.ready.set()
+
+
+class EventAggregator(object):
+    """
+    Debounced and batched letter changes of connected users.
+
+    Changes of user are merged for `batch_interval` and emitted as single
+    `letter_changes` event. Every session has its own queue of batches,
+    the next batch is emitted after client acknowledged previous one.
+    If client does not acknowledge in `ack_timeout` or its queue is full,
+    its batches are dropped and client is asked to resync instead.
+
+    Session subscribed to mailboxes gets only their changes, unread
+    deltas of other mailboxes are merged and sent at most once per
+    `counter_interval`. Sessions with the same subscriptions share
+    payload of batch.
+    """
+
+    def __init__(self, config: SocketIOConfig, sessions: SessionRegistry):
+        """
+        Init class instance.
+
+        Args:
+            config (SocketIOConfig): Socket.IO config
+            sessions (SessionRegistry): connected sessions
+
+        """
+        self.config = config
+        self.sessions = sessions
+        self._pending: Dict[int, ChangeBatch] = {}
+        self._clients: Dict[str, _Client] = {}
+        self._counting: Set[str] = set()  # sessions with pending counters
+        self._task: Optional[asyncio.Task] = None
+        self._merged = registry.counter('socketio_changes_merged')
+        self._batches = registry.counter('socketio_batches_emitted')
+        self._resyncs = registry.counter('socketio_resyncs')
+
+    def start(self):
+        """Start flushing batches."""
+        self._task = asyncio.create_task(self._flush())
+
+    async def stop(self):
+        """Stop flushing and emitting."""
+        tasks = [self._task] if self._task else []
+        tasks.extend(
+            client.task for client in self._clients.values() if client.task
+        )
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._clients = {}
+        logger.info('Event aggregator has been stopped.')
+
+    def add(self, change: dict):
+        """
+        Add change of user, it is emitted with the next batch.
+
+        Args:
+            change (dict): `letter_change` payload
+
+        """
+        batch = self._pending.get(change['u'])
+        if batch is None:
+            batch = self._pending[change['u']] = ChangeBatch()
+        batch.add(change)
+
+    def resync(self, user_id: int):
+        """
+        Ask all sessions of user to resync.
+
+        Args:
+            user_id (int): user id
+
+        """
+        self._pending.pop(user_id, None)
+        for sid in self.sessions.sids(user_id):
+            self._client(sid).ask_resync()
+
+    def discard(self, sid: str):
+        """
+        Drop queue of disconnected session.
+
+        Args:
+            sid (str): Socket.IO session id
+
+        """
+        self._counting.discard(sid)
+        client = self._clients.pop(sid, None)
+        if client is not None and client.task is not None:
+            client.task.cancel()
+
+    def clear(self):
+        """Drop all pending changes, e.g. when clients resync anyway."""
+        self._pending = {}
+        self._counting = set()
+        for client in self._clients.values():
+            client.batches.clear()
+            client.counters = {}
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while True:  # noqa:WPS457
+            await asyncio.sleep(self.config.batch_interval)
+            pending, self._pending = self._pending, {}
+            for user_id, batch in pending.items():
+                self._merged.inc(batch.count)
+                self._flush_batch(user_id, batch)
+            self._flush_counters(loop.time())
+
+    def _flush_batch(self, user_id: int, batch: ChangeBatch):
+        payloads: Dict[Optional[FrozenSet[int]], dict] = {}
+        for sid in self.sessions.sids(user_id):
+            mailboxes = self.sessions.mailboxes(sid)
+            payload = payloads.get(mailboxes)
+            if payload is None:
+                payload = payloads[mailboxes] = batch.to_dict(mailboxes)
+            client = self._client(sid)
+            if mailboxes is not None:
+                for mailbox, delta in batch.unread.items():
+                    if delta and mailbox not in mailboxes:
+                        client.counters[mailbox] = (
+                            client.counters.get(mailbox, 0) + delta
+                        )
+                        self._counting.add(sid)
+            if any(payload.values()):
+                self._put(sid, client, payload)
+
+    def _flush_counters(self, now: float):
+        for sid in list(self._counting):
+            client = self._clients.get(sid)
+            if client is None:
+                self._counting.discard(sid)
+                continue
+            if now < client.counters_at:
+                continue
+            self._counting.discard(sid)
+            counters = ChangeBatch()
+            counters.unread, client.counters = client.counters, {}
+            client.counters_at = now + self.config.counter_interval
+            payload = counters.to_dict()
+            if payload['unread']:
+                self._put(sid, client, payload)
+
+    def _put(self, sid: str, client: _Client, payload: dict):
+        if not client.put(payload):
+            logger.warning('Session {0} is too slow, resync.'.format(sid))
+
+    def _client(self, sid: str) -> _Client:
+        client = self._clients.get(sid)
+        if client is None:
+            client = self._clients[sid] = _Client(self.config.queue_size)
+            client.task = asyncio.create_task(self._send(sid, client))
+        return client
+
+    async def _send(self, sid: str, client: _Client):
+        """
+        Emit batches of session one by one.
+
+        Args:
+            sid (str): Socket.IO session id
+            client (_Client): queue of session
+
+        """
+        while True:  # noqa:WPS457
+            await client.ready.wait()
+            client.ready.clear()
+            while client.resync or client.batches:
+                if client.resync:
+                    client.resync = False
+                    self._resyncs.inc()
+                    await sio.emit(
+                        EVENT_RESYNC,
+                        {},
+                        to=sid,
+                        namespace=NAMESPACE_INBOX,
+                        ignore_queue=True,
+                    )
+                    continue
+                batch = client.batches.popleft()
+                try:
+                    await sio.call(
+                        EVENT_CHANGES,
+                        batch,
+                        to=sid,
+                        namespace=NAMESPACE_INBOX,
+                        timeout=self.config.ack_timeout,
+                        ignore_queue=True,
+                    )
+                except TimeoutError:
+                    client.ask_resync()
+                    continue
+                except Exception as exception:
+                    logger.exception(
+                        'Letter changes emit was failed. {0}'.format(
+                            exception,
+                        ),
+                    )
+                    continue
+                self._batches.inc()
 
 
 class WSInboxNamespace(socketio.AsyncNamespace):
 
+    def __init__(self, namespace: str):
+        super().__init__(namespace)
+        self.sessions = SessionRegistry()
+        self.events: Optional[EventAggregator] = None
+        self.changelog: Optional[ChangeLog] = None
+
     async def on_connect(self, sid, environ):
         """
-        TODO: Now app doesnt care about many sessions for 1 user.
-        TODO: IF there is new session than just update sid
+        Authorize session by JWT of handshake request.
+
+        User may have many sessions, all of them join room of user.
 
         """
         aiohttp_request = environ.get('aiohttp.request')
-        user = await authorized_userid(aiohttp_request)
-        aiohttp_request.app['socketio_session'].update({user.username: sid})  # TODO what to do with many sessions
-        if user:
-            await sio.save_session(
-                sid,
-                {'username': user.username},
-                namespace=NAMESPACE_INBOX,
-            )
-        #raise ConnectionRefusedError
+        try:
+            user_id = await get_current_user_id(aiohttp_request)
+        except web.HTTPUnauthorized:
+            raise ConnectionRefusedError('unauthorized')
+        self.enter_room(sid, user_room(user_id))
+        self.sessions.add(user_id, sid)
+
+    async def on_changes(self, sid, data):
+        """
+        Get letter changes after `since`, as `/api/crud/letter/changes`.
+
+        Reconnected client sends `seq` of the last change it has seen,
+        changes are returned with acknowledge.
+
+        """
+        user_id = self.sessions.user(sid)
+        if user_id is None or self.changelog is None:
+            return {'error': 'unavailable'}
+        try:
+            since = int((data or {}).get('since') or 0)
+        except (AttributeError, TypeError, ValueError):
+            return {'error': 'bad request'}
+        return await self.changelog.changes(user_id=user_id, since=since)
+
+    async def on_subscribe(self, sid, data):
+        """
+        Subscribe session to changes of mailboxes.
+
+        Returns all subscribed mailboxes with acknowledge.
+
+        """
+        mailboxes = self._parse_mailboxes(data)
+        if mailboxes is None:
+            return {'error': 'bad request'}
+        subscribed = self.sessions.mailboxes(sid) or frozenset()
+        if len(subscribed | mailboxes) > MAX_SUBSCRIPTIONS:
+            return {'error': 'too many mailboxes'}
+        try:
+            subscribed = self.sessions.subscribe(sid, mailboxes)
+        except KeyError:
+            return {'error': 'unavailable'}
+        return {'mailboxes': sorted(subscribed)}
+
+    async def on_unsubscribe(self, sid, data):
+        """
+        Unsubscribe session from mailboxes.
+
+        Session without subscriptions gets changes of all mailboxes.
+
+        """
+        mailboxes = self._parse_mailboxes(data)
+        if mailboxes is None:
+            return {'error': 'bad request'}
+        return {
+            'mailboxes': sorted(self.sessions.unsubscribe(sid, mailboxes)),
+        }
 
     async def on_disconnect(self, sid):
-        session = await sio.get_session(sid, namespace=NAMESPACE_INBOX)
-        session.pop('username')
-        print('SIO disconnected')
+        """Unregister session, Socket.IO leaves its rooms itself."""
+        self.sessions.remove(sid)
+        if self.events is not None:
+            self.events.discard(sid)
 
-    async def on_message(self, sid, data):
-        print('MSG', data)
-        print('sid', sid)
-        session = await sio.get_session(sid, namespace=NAMESPACE_INBOX)
-        if session.get('username'):
-            print(session['username'])
-            await self.emit('message', {'new': 123})
 
+    @staticmethod
+    def _parse_mailboxes(data) -> Optional[FrozenSet[int]]:
+        mailboxes = data.get('mailboxes') if isinstance(data, dict) else None
+        if not isinstance(mailboxes, list):
+            return None
+        try:
+            return frozenset(int(mailbox) for mailbox in mailboxes)
+        except (TypeError, ValueError):
+            return None
 
-sio.register_namespace(WSInboxNamespace('/ws'))
+
+inbox = WSInboxNamespace(NAMESPACE_INBOX)
+sio.register_namespace(inbox)
 
 
 @require_login
@@ -54,15 +471,9 @@ async def socket_test(request: web.Request):
 
 
 async def close_sio_session(request: web.Request):
-    user = await authorized_userid(request)
-    sid = request.app['socketio_session'][user.username]
-    session = await sio.get_session(
-        sid=sid,
-        namespace=NAMESPACE_INBOX,
-    )
-    session.pop('username')
-    await sio.disconnect(
-        sid=sid,
-        namespace=NAMESPACE_INBOX,
-    )
-
+    user_id = await get_current_user_id(request)
+    for sid in request.app['socketio_session'].sids(user_id):
+        await sio.disconnect(
+            sid=sid,
+            namespace=NAMESPACE_INBOX,
+        )
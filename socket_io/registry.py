@@ -0,0 +1,177 @@
+"""Socket.IO session registry module."""
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Set
+
+from metrics import registry
+
+EMPTY: FrozenSet[Any] = frozenset()
+
+
+class SessionRegistry(object):
+    """
+    Connected Socket.IO sessions of users.
+
+    Both directions are kept, user to sids and sid to user, so adding
+    and removing session is O(1) and users without sessions are removed,
+    the registry holds only connected sessions. Session may subscribe
+    to mailboxes of its user, session without subscriptions gets changes
+    of all mailboxes.
+    """
+
+    def __init__(self):
+        """Init class instance."""
+        self._sids: Dict[int, Set[str]] = {}
+        self._users: Dict[str, int] = {}
+        self._mailboxes: Dict[str, FrozenSet[int]] = {}
+        self._sessions_gauge = registry.gauge('socketio_sessions')
+        self._users_gauge = registry.gauge('socketio_users')
+
+    def __contains__(self, user_id: int) -> bool:
+        """
+        Check if user has connected sessions.
+
+        Args:
+            user_id (int): user id
+
+        Returns:
+            contains (bool): True if user is connected
+
+        """
+        return user_id in self._sids
+
+    def __len__(self) -> int:
+        """
+        Get number of connected sessions.
+
+        Returns:
+            size (int): number of sessions
+
+        """
+        return len(self._users)
+
+    def add(self, user_id: int, sid: str):
+        """
+        Register session of user.
+
+        Args:
+            user_id (int): user id
+            sid (str): Socket.IO session id
+
+        """
+        self.remove(sid)
+        self._users[sid] = user_id
+        self._sids.setdefault(user_id, set()).add(sid)
+        self._update_gauges()
+
+    def remove(self, sid: str) -> Optional[int]:
+        """
+        Unregister session.
+
+        Args:
+            sid (str): Socket.IO session id
+
+        Returns:
+            user_id (Optional[int]): user of session, None if it is unknown
+
+        """
+        user_id = self._users.pop(sid, None)
+        if user_id is None:
+            return None
+        self._mailboxes.pop(sid, None)
+        sids = self._sids[user_id]
+        sids.discard(sid)
+        if not sids:
+            del self._sids[user_id]  # noqa:WPS420
+        self._update_gauges()
+        return user_id
+
+    def sids(self, user_id: int) -> FrozenSet[str]:
+        """
+        Get sessions of user.
+
+        Args:
+            user_id (int): user id
+
+        Returns:
+            sids (FrozenSet[str]): session ids, empty if user is not connected
+
+        """
+        sids = self._sids.get(user_id)
+        return frozenset(sids) if sids else EMPTY
+
+    def user(self, sid: str) -> Optional[int]:
+        """
+        Get user of session.
+
+        Args:
+            sid (str): Socket.IO session id
+
+        Returns:
+            user_id (Optional[int]): user id, None if session is unknown
+
+        """
+        return self._users.get(sid)
+
+    def subscribe(self, sid: str, mailboxes: Iterable[int]) -> FrozenSet[int]:
+        """
+        Subscribe session to mailboxes.
+
+        Args:
+            sid (str): Socket.IO session id
+            mailboxes (Iterable[int]): mailbox ids
+
+        Returns:
+            mailboxes (FrozenSet[int]): all subscribed mailboxes
+
+        Raises:
+            KeyError: if session is unknown
+
+        """
+        if sid not in self._users:
+            raise KeyError(sid)
+        subscribed = self._mailboxes.get(sid, EMPTY) | frozenset(mailboxes)
+        self._mailboxes[sid] = subscribed
+        return subscribed
+
+    def unsubscribe(
+        self,
+        sid: str,
+        mailboxes: Iterable[int],
+    ) -> FrozenSet[int]:
+        """
+        Unsubscribe session from mailboxes.
+
+        Session unsubscribed from all mailboxes gets changes of all of
+        them again.
+
+        Args:
+            sid (str): Socket.IO session id
+            mailboxes (Iterable[int]): mailbox ids
+
+        Returns:
+            mailboxes (FrozenSet[int]): remaining subscribed mailboxes
+
+        """
+        subscribed = self._mailboxes.get(sid, EMPTY) - frozenset(mailboxes)
+        if subscribed:
+            self._mailboxes[sid] = subscribed
+        else:
+            self._mailboxes.pop(sid, None)
+        return subscribed
+
+    def mailboxes(self, sid: str) -> Optional[FrozenSet[int]]:
+        """
+        Get mailboxes of session.
+
+        Args:
+            sid (str): Socket.IO session id
+
+        Returns:
+            mailboxes (Optional[FrozenSet[int]]): subscribed mailboxes,
+                None if session is not subscribed, i.e. gets all of them
+
+        """
+        return self._mailboxes.get(sid)
+
+    def _update_gauges(self):
+        self._sessions_gauge.set(len(self._users))
+        self._users_gauge.set(len(self._sids))
@@ -0,0 +1,321 @@
+"""
+Bloom filter guard of stored letter keys module.
+
+Sync and import have to skip messages which are already stored, i.e.
+whose key exists in `letter` table within the same scope: UID of
+synced letter (`id_external`) within its source folder, hash of
+imported letter (`import_hash`) within user mailbox. Guard keeps Bloom
+filter of stored keys for every scope, so most candidates are known
+to be new without query. Only keys which may be stored are checked in
+db with single query per batch. Filters are built from `letter` table
+on first use after start and rebuilt when they are full.
+"""
+import asyncio
+import functools
+import logging
+import math
+import random
+from array import array
+from typing import Dict, Iterable, List, Mapping, Sequence, Set, Tuple
+
+import sqlalchemy as sa
+
+from db.psql_engine import PostgresEngine
+from db.schema import Letter
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MASK64 = (1 << 64) - 1
+GOLDEN64 = 0x9E3779B97F4A7C15
+MIX64 = 0xBF58476D1CE4E5B9
+MASKS = 1 << 16  # size of mask table
+TABLE_MASK = MASKS - 1
+BLOCKING_PENALTY = 1.2  # extra bits per key of blocked filter
+BUILD_PARTITION = 50000  # ids read from db at once
+CHECK_CHUNK = 10000  # ids checked with single query
+
+# letter columns with their values, e.g. `(('sync_folder', 1),)`
+_Scope = Tuple[Tuple[str, int], ...]
+
+
+@functools.lru_cache(maxsize=None)
+def _masks(bits: int, seed: int) -> Tuple[int, ...]:
+    """
+    Make table of random 64-bit masks.
+
+    Args:
+        bits (int): bits set in every mask
+        seed (int): random seed
+
+    Returns:
+        masks (Tuple[int, ...]): `MASKS` masks
+
+    """
+    generator = random.Random(seed)
+    return tuple(
+        sum(1 << bit for bit in generator.sample(range(64), bits))
+        for _ in range(MASKS)
+    )
+
+
+class BloomFilter(object):
+    """
+    Blocked Bloom filter of integer keys.
+
+    All bits of key are set in single 64-bit word, so key is added or
+    checked with one word access instead of one access per hash.
+    Word mask is combined from two precomputed tables. Blocking costs
+    some bits per key to keep the same error rate, and rates below
+    about 0.0005 are not reached with 64-bit words.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        Init class instance.
+
+        Args:
+            capacity (int): expected number of keys
+            error_rate (float): false positive rate at capacity
+
+        """
+        self.capacity = max(capacity, 1)
+        bits_per_key = (
+            -math.log(error_rate) / math.log(2) ** 2 * BLOCKING_PENALTY
+        )
+        self.words = math.ceil(self.capacity * bits_per_key / 64)
+        table_bits = max(1, min(4, round(bits_per_key * math.log(2) / 4)))
+        self.hashes = table_bits * 2
+        self.count = 0
+        self._low = _masks(table_bits, 1)
+        self._high = _masks(table_bits, 2)
+        self._bits = array('Q', bytes(self.words * 8))
+
+    @property
+    def is_full(self) -> bool:
+        """
+        Check if error rate is higher than expected.
+
+        Returns:
+            is_full (bool): True if filter has more keys than capacity
+
+        """
+        return self.count > self.capacity
+
+    def update(self, keys: Iterable[int]):
+        """
+        Add keys.
+
+        Args:
+            keys (Iterable[int]): keys
+
+        """
+        bits, words, low, high = self._bits, self.words, self._low, self._high
+        count = 0
+        for key in keys:
+            # splitmix64 mixing, the first hash picks word, the second mask
+            first = (key * GOLDEN64) & MASK64
+            second = ((first ^ (first >> 31)) * MIX64) & MASK64
+            bits[first % words] |= (
+                low[second & TABLE_MASK] | high[(second >> 16) & TABLE_MASK]
+            )
+            count += 1
+        self.count += count
+
+    def possible(self, keys: Iterable[int]) -> List[int]:
+        """
+        Find keys which may be added.
+
+        Args:
+            keys (Iterable[int]): keys
+
+        Returns:
+            keys (List[int]): keys which may be added, other keys
+                were never added
+
+        """
+        bits, words, low, high = self._bits, self.words, self._low, self._high
+        found = []
+        for key in keys:
+            first = (key * GOLDEN64) & MASK64
+            second = ((first ^ (first >> 31)) * MIX64) & MASK64
+            mask = (
+                low[second & TABLE_MASK] | high[(second >> 16) & TABLE_MASK]
+            )
+            if bits[first % words] & mask == mask:
+                found.append(key)
+        return found
+
+
+class ExternalIdGuard(object):
+    """Check of stored letter keys with Bloom filter per scope."""
+
+    def __init__(
+        self,
+        db_engine: PostgresEngine,
+        key: str = 'id_external',
+        error_rate: float = 0.001,
+        min_capacity: int = 10000,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            db_engine (PostgresEngine): db engine
+            key (str): `letter` column of keys, `id_external`
+                or `import_hash`
+            error_rate (float): false positive rate of filters
+            min_capacity (int): min capacity of filter
+
+        """
+        self.db_engine = db_engine
+        self.column = getattr(Letter, key)
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self._filters: Dict[_Scope, BloomFilter] = {}
+        self._building: Dict[_Scope, asyncio.Lock] = {}
+        self._checked = registry.counter('bloom_checked')
+        self._queried = registry.counter('bloom_queried')
+        self._false_positives = registry.counter('bloom_false_positives')
+
+    async def new_ids(
+        self,
+        scope: Mapping[str, int],
+        ids: Sequence[int],
+    ) -> List[int]:
+        """
+        Filter out keys which are stored in scope.
+
+        Args:
+            scope (Mapping[str, int]): values of `letter` columns,
+                e.g. `{'user': 1, 'mailbox': 2}`
+            ids (Sequence[int]): candidate keys
+
+        Returns:
+            ids (List[int]): keys which are not stored, in the same order
+
+        """
+        scope = self._scope(scope)
+        bloom = await self._get_filter(scope)
+        possible = bloom.possible(ids)
+        self._checked.inc(len(ids))
+        if not possible:
+            return list(ids)
+        stored = await self._select_stored(scope, possible)
+        self._queried.inc(len(possible))
+        self._false_positives.inc(len(possible) - len(stored))
+        return [ext_id for ext_id in ids if ext_id not in stored]
+
+    def add(self, scope: Mapping[str, int], ids: Iterable[int]):
+        """
+        Add keys of committed letters.
+
+        Full filter is dropped, it is rebuilt with larger capacity
+        on next check.
+
+        Args:
+            scope (Mapping[str, int]): values of `letter` columns
+            ids (Iterable[int]): keys
+
+        """
+        scope = self._scope(scope)
+        bloom = self._filters.get(scope)
+        if bloom is None:
+            return
+        bloom.update(ids)
+        if bloom.is_full:
+            self._filters.pop(scope, None)
+
+    def reset(self, scope: Mapping[str, int]):
+        """
+        Drop filter of scope, e.g. after its letters were removed.
+
+        Args:
+            scope (Mapping[str, int]): values of `letter` columns
+
+        """
+        self._filters.pop(self._scope(scope), None)
+
+    @staticmethod
+    def _scope(scope: Mapping[str, int]) -> _Scope:
+        return tuple(sorted(scope.items()))
+
+    def _where(self, scope: _Scope) -> list:
+        return [
+            getattr(Letter, column) == column_value
+            for column, column_value in scope
+        ] + [self.column.isnot(None)]
+
+    async def _get_filter(self, scope: _Scope) -> BloomFilter:
+        bloom = self._filters.get(scope)
+        if bloom is not None:
+            return bloom
+        lock = self._building.setdefault(scope, asyncio.Lock())
+        async with lock:
+            bloom = self._filters.get(scope)
+            if bloom is None:
+                bloom = await self._build(scope)
+                self._filters[scope] = bloom
+        self._building.pop(scope, None)
+        return bloom
+
+    async def _build(self, scope: _Scope) -> BloomFilter:
+        """
+        Build filter from keys stored in scope.
+
+        Args:
+            scope (_Scope): values of `letter` columns
+
+        Returns:
+            bloom (BloomFilter): filter with capacity for twice more keys
+
+        """
+        where = self._where(scope)
+        async with self.db_engine.engine.connect() as connection:
+            count = (
+                await connection.execute(
+                    sa.select(sa.func.count()).select_from(Letter).where(
+                        *where,
+                    ),
+                )
+            ).scalar()
+            bloom = BloomFilter(
+                capacity=max(self.min_capacity, count * 2),
+                error_rate=self.error_rate,
+            )
+            stored = await connection.stream(
+                sa.select(self.column).where(*where),
+            )
+            async for partition in stored.partitions(BUILD_PARTITION):
+                bloom.update(row[0] for row in partition)
+        logger.info(
+            'Bloom filter of {0}={1} was built, {2} keys.'.format(
+                self.column.key,
+                dict(scope),
+                bloom.count,
+            ),
+        )
+        return bloom
+
+    async def _select_stored(
+        self,
+        scope: _Scope,
+        ids: List[int],
+    ) -> Set[int]:
+        where = self._where(scope)
+        stored = set()
+        async with self.db_engine.session() as session:
+            for start in range(0, len(ids), CHECK_CHUNK):
+                stored.update(
+                    (
+                        await session.execute(
+                            sa.select(self.column).where(
+                                *where,
+                                self.column.in_(
+                                    ids[start:start + CHECK_CHUNK],
+                                ),
+                            ),
+                        )
+                    ).scalars(),
+                )
+        return stored
@@ -0,0 +1,495 @@
+"""
+IMAP sync module.
+
+Letters of upstream IMAP accounts are synced incrementally: for every
+folder UIDVALIDITY and next UID to fetch are stored in `sync_folder`
+table and only messages above this high-water mark are fetched.
+Synced letters refer to their source folder, UIDs which are already
+stored, e.g. after high-water mark was lost, are skipped by Bloom
+filter guard keyed by folder.
+Headers are fetched in batches, bodies are fetched on demand when
+letter is opened. Accounts share bounded number of IMAP connections,
+connection waits for new messages with `IDLE` until another account
+needs it.
+"""
+import asyncio
+import datetime
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config_model import SyncConfig
+from db.psql_engine import PostgresEngine
+from db.schema import Letter, MailBox, SyncAccount, SyncFolder
+from emailing.mail_import import LETTER_COLUMNS, SourceMessage, parse_message
+from metrics import registry
+from sync.bloom import ExternalIdGuard
+from sync.imap_client import (
+    BODY_ITEMS,
+    FetchedMessage,
+    FolderStatus,
+    IMAPClient,
+    parse_flags,
+    split_uids,
+)
+
+logger = logging.getLogger(__name__)
+
+SYNC_COLUMNS = LETTER_COLUMNS + ('id_external', 'sync_folder', 'body_fetched')
+IDLE_CAPABILITY = 'IDLE'
+
+
+class SyncEngine(object):  # noqa:WPS214
+    """Incremental sync of upstream IMAP accounts."""
+
+    def __init__(self, config: SyncConfig, db_engine: PostgresEngine):
+        """
+        Init class instance.
+
+        Args:
+            config (SyncConfig): sync config
+            db_engine (PostgresEngine): db engine
+
+        """
+        self.config = config
+        self.db_engine = db_engine
+        self.guard = ExternalIdGuard(
+            db_engine=db_engine,
+            error_rate=config.bloom_error_rate,
+        )
+        self._connections = asyncio.Semaphore(config.max_connections)
+        # interrupts of idling connections, the oldest first
+        self._idlers: Dict[int, asyncio.Event] = {}
+        self._accounts: Dict[int, asyncio.Task] = {}
+        self._supervisor: Optional[asyncio.Task] = None
+        self._synced = registry.counter('sync_messages')
+        self._failures = registry.counter('sync_failures')
+        self._open = registry.gauge('sync_connections')
+
+    def start(self):
+        """Start syncing of active accounts."""
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info('IMAP sync has been started.')
+
+    async def stop(self):
+        """Stop syncing, open connections are logged out."""
+        tasks = list(self._accounts.values())
+        if self._supervisor:
+            tasks.append(self._supervisor)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._accounts.clear()
+        logger.info('IMAP sync has been stopped.')
+
+    async def fetch_body(self, letter_id: int, user_id: int) -> Optional[str]:
+        """
+        Fetch body of synced letter from mail server and store it.
+
+        Args:
+            letter_id (int): letter id
+            user_id (int): current user id
+
+        Returns:
+            body (Optional[str]): body, None if letter is not synced one
+                or it was removed from server
+
+        """
+        stmt = sa.select(
+            Letter.id_external,
+            SyncFolder.folder,
+            SyncFolder.uidvalidity,
+            SyncAccount,
+        ).join(
+            SyncFolder,
+            SyncFolder.id == Letter.sync_folder,
+        ).join(
+            SyncAccount,
+            SyncAccount.id == SyncFolder.account,
+        ).where(
+            Letter.id == letter_id,
+            Letter.user == user_id,
+            Letter.body_fetched.is_(False),
+        )
+        async with self.db_engine.session() as session:
+            row = (await session.execute(stmt)).first()
+        if row is None:
+            return None
+        async with self._connection(row.SyncAccount) as client:
+            status = await client.select(row.folder)
+            if status.uidvalidity != row.uidvalidity:
+                return None
+            messages = await client.fetch([row.id_external], BODY_ITEMS)
+        if not messages:
+            return None
+        record = parse_message(
+            SourceMessage(position=0, key='', raw=messages[0].data, flags=''),
+            user_id,
+            0,
+        )
+        body = record[LETTER_COLUMNS.index('body')]
+        async with self.db_engine.session() as session:
+            async with session.begin():
+                await session.execute(
+                    sa.update(Letter).values(
+                        body=body,
+                        size=len(messages[0].data),
+                        body_fetched=True,
+                    ).where(
+                        Letter.id == letter_id,
+                    ),
+                )
+        return body
+
+    async def _supervise(self):
+        """Start tasks of new accounts and cancel ones of removed."""
+        while True:  # noqa:WPS457
+            try:
+                accounts = await self._load_accounts()
+            except Exception as exception:
+                logger.exception(
+                    'Sync accounts loading was failed. {0}'.format(exception),
+                )
+                accounts = None
+            if accounts is not None:
+                for account_id in set(self._accounts) - set(accounts):
+                    self._accounts.pop(account_id).cancel()
+                for account_id, account in accounts.items():
+                    if account_id not in self._accounts:
+                        self._accounts[account_id] = asyncio.create_task(
+                            self._run_account(account),
+                        )
+            await asyncio.sleep(self.config.accounts_interval)
+
+    async def _load_accounts(self) -> Dict[int, SyncAccount]:
+        async with self.db_engine.session() as session:
+            accounts = (
+                await session.execute(
+                    sa.select(SyncAccount).where(
+                        SyncAccount.is_active.is_(True),
+                    ),
+                )
+            ).scalars().all()
+        return {account.id: account for account in accounts}
+
+    async def _run_account(self, account: SyncAccount):
+        """
+        Sync account forever.
+
+        Connection is kept in `IDLE` while it is not needed by other
+        account, otherwise it is released and account is polled.
+
+        Args:
+            account (SyncAccount): account
+
+        """
+        while True:  # noqa:WPS457
+            try:
+                async with self._connection(account) as client:
+                    while await self._sync_account(client, account):
+                        logger.debug(
+                            'Account #{0} was synced.'.format(account.id),
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:
+                self._failures.inc()
+                logger.warning(
+                    'Sync of account #{0} was failed. {1!r}'.format(
+                        account.id,
+                        exception,
+                    ),
+                )
+                await asyncio.sleep(self.config.retry_delay)
+                continue
+            await asyncio.sleep(self.config.poll_interval)
+
+    async def _sync_account(
+        self,
+        client: IMAPClient,
+        account: SyncAccount,
+    ) -> bool:
+        """
+        Sync folders of account and wait for changes with `IDLE`.
+
+        Args:
+            client (IMAPClient): connected client
+            account (SyncAccount): account
+
+        Returns:
+            keep (bool): True if `IDLE` was finished by server or timeout,
+                False if connection should be released
+
+        """
+        for folder, mailbox_name in self.config.folders.items():
+            await self._sync_folder(client, account, folder, mailbox_name)
+        if IDLE_CAPABILITY not in client.capabilities:
+            return False
+        interrupt = asyncio.Event()
+        self._idlers[account.id] = interrupt
+        try:
+            await client.select(next(iter(self.config.folders)))
+            await client.idle(self.config.idle_timeout, interrupt)
+        finally:
+            self._idlers.pop(account.id, None)
+        return not interrupt.is_set()
+
+    async def _sync_folder(
+        self,
+        client: IMAPClient,
+        account: SyncAccount,
+        folder: str,
+        mailbox_name: str,
+    ):
+        """
+        Fetch headers of messages above high-water mark of folder.
+
+        If UIDVALIDITY was changed, letters synced before are removed
+        and folder is synced from the beginning.
+
+        Args:
+            client (IMAPClient): connected client
+            account (SyncAccount): account
+            folder (str): IMAP folder name
+            mailbox_name (str): name of local mailbox
+
+        """
+        status = await client.select(folder)
+        async with self.db_engine.engine.connect() as connection:
+            state = (
+                await connection.execute(
+                    sa.select(SyncFolder).where(
+                        SyncFolder.account == account.id,
+                        SyncFolder.folder == folder,
+                    ),
+                )
+            ).first()
+            await connection.rollback()
+            if state is None:
+                mailbox = await self._get_mailbox(
+                    connection,
+                    account.user,
+                    mailbox_name,
+                )
+                folder_id = await self._create_folder(
+                    connection,
+                    account,
+                    folder,
+                    mailbox,
+                    status,
+                )
+                uidnext = 1
+            else:
+                mailbox = state.mailbox
+                folder_id = state.id
+                uidnext = state.uidnext
+                if state.uidvalidity != status.uidvalidity:
+                    await self._reset_folder(connection, account, folder_id)
+                    uidnext = 1
+                elif status.uidnext and status.uidnext <= uidnext:
+                    return
+            found = await client.search_uids(uidnext, status.uidnext)
+            scope = {'sync_folder': folder_id}
+            uids = await self.guard.new_ids(scope, found)
+            written = uidnext
+            for batch in split_uids(uids, self.config.batch_size):
+                messages = await client.fetch(batch)
+                await self._write(
+                    connection,
+                    account,
+                    folder_id,
+                    mailbox,
+                    status,
+                    messages,
+                    batch[-1] + 1,
+                )
+                self.guard.add(scope, [message.uid for message in messages])
+                written = batch[-1] + 1
+            # messages after the last fetched one are stored or expunged
+            highest = max(written, status.uidnext)
+            if found:
+                highest = max(highest, found[-1] + 1)
+            if not uids or highest > written:
+                await self._write(
+                    connection,
+                    account,
+                    folder_id,
+                    mailbox,
+                    status,
+                    [],
+                    highest,
+                )
+
+    async def _get_mailbox(
+        self,
+        connection: AsyncConnection,
+        user: int,
+        mailbox_name: str,
+    ) -> int:
+        mailbox = (
+            await connection.execute(
+                sa.select(MailBox.id).where(
+                    sa.or_(MailBox.user == user, MailBox.user.is_(None)),
+                    MailBox.name == mailbox_name,
+                ).order_by(
+                    MailBox.user.nullslast(),
+                ).limit(1),
+            )
+        ).scalar()
+        await connection.rollback()
+        if mailbox is None:
+            raise LookupError(
+                'Mailbox `{0}` does not exist'.format(mailbox_name),
+            )
+        return mailbox
+
+    async def _create_folder(  # noqa:WPS211
+        self,
+        connection: AsyncConnection,
+        account: SyncAccount,
+        folder: str,
+        mailbox: int,
+        status: FolderStatus,
+    ) -> int:
+        """
+        Store state of new folder, so synced letters can refer to it.
+
+        Args:
+            connection (AsyncConnection): db connection
+            account (SyncAccount): account
+            folder (str): IMAP folder name
+            mailbox (int): local mailbox id
+            status (FolderStatus): state of selected folder
+
+        Returns:
+            folder_id (int): `sync_folder` id
+
+        """
+        upsert = insert(SyncFolder).values(
+            account=account.id,
+            folder=folder,
+            mailbox=mailbox,
+            uidvalidity=status.uidvalidity,
+            uidnext=1,
+            updated=datetime.datetime.utcnow(),
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[SyncFolder.account, SyncFolder.folder],
+            set_={'updated': upsert.excluded.updated},
+        ).returning(SyncFolder.id)
+        async with connection.begin():
+            return (await connection.execute(upsert)).scalar()
+
+    async def _reset_folder(
+        self,
+        connection: AsyncConnection,
+        account: SyncAccount,
+        folder_id: int,
+    ):
+        logger.warning(
+            'UIDVALIDITY of account #{0} was changed, resync.'.format(
+                account.id,
+            ),
+        )
+        self.guard.reset({'sync_folder': folder_id})
+        async with connection.begin():
+            await connection.execute(
+                sa.delete(Letter).where(Letter.sync_folder == folder_id),
+            )
+
+    async def _write(  # noqa:WPS211
+        self,
+        connection: AsyncConnection,
+        account: SyncAccount,
+        folder_id: int,
+        mailbox: int,
+        status: FolderStatus,
+        messages: List[FetchedMessage],
+        uidnext: int,
+    ):
+        """
+        Write letters with `COPY` and move high-water mark in one transaction.
+
+        Args:
+            connection (AsyncConnection): db connection
+            account (SyncAccount): account
+            folder_id (int): `sync_folder` id
+            mailbox (int): local mailbox id
+            status (FolderStatus): state of selected folder
+            messages (List[FetchedMessage]): fetched headers
+            uidnext (int): next UID to fetch
+
+        """
+        records = []
+        for message in messages:
+            record = list(
+                parse_message(
+                    SourceMessage(
+                        position=message.uid,
+                        key='',
+                        raw=message.data,
+                        flags=parse_flags(message.flags),
+                    ),
+                    account.user,
+                    mailbox,
+                ),
+            )
+            record[LETTER_COLUMNS.index('size')] = message.size
+            records.append((*record, message.uid, folder_id, False))
+        async with connection.begin():
+            await connection.execute(
+                sa.update(SyncFolder).values(
+                    uidvalidity=status.uidvalidity,
+                    uidnext=uidnext,
+                    updated=datetime.datetime.utcnow(),
+                ).where(
+                    SyncFolder.id == folder_id,
+                ),
+            )
+            if records:
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    'letter',
+                    records=records,
+                    columns=SYNC_COLUMNS,
+                )
+        self._synced.inc(len(records))
+
+    @asynccontextmanager
+    async def _connection(
+        self,
+        account: SyncAccount,
+    ) -> AsyncIterator[IMAPClient]:
+        """
+        Open logged in connection within connections limit.
+
+        If all connections are taken, the longest idling one is released.
+
+        Args:
+            account (SyncAccount): account
+
+        Yields:
+            client (IMAPClient): logged in client
+
+        """
+        if self._connections.locked() and self._idlers:
+            self._idlers.pop(next(iter(self._idlers))).set()
+        async with self._connections:
+            client = IMAPClient(
+                host=account.host,
+                port=account.port,
+                use_ssl=account.use_ssl,
+                timeout=self.config.timeout,
+            )
+            self._open.inc()
+            try:
+                await client.connect()
+                await client.login(account.login, account.password)
+                yield client
+            finally:
+                self._open.dec()
+                await client.logout()
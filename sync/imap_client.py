@@ -0,0 +1,449 @@
+"""
+Minimal async IMAP4rev1 client module.
+
+Client implements only commands used by mailbox sync: `LOGIN`,
+`SELECT`, `UID SEARCH`, `UID FETCH`, `IDLE` and `LOGOUT`, RFC 3501.
+Literals of server responses are read into memory, so only headers
+and bodies of single messages should be fetched with them.
+"""
+import asyncio
+import re
+import ssl
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+IMAP_PORT = 143
+IMAPS_PORT = 993
+LITERAL_PATTERN = re.compile(rb'\{(\d+)\}\r\n$')
+FETCH_PATTERN = re.compile(rb'^\* \d+ FETCH ', re.I)
+UID_PATTERN = re.compile(rb'\bUID (\d+)', re.I)
+SIZE_PATTERN = re.compile(rb'\bRFC822\.SIZE (\d+)', re.I)
+FLAGS_PATTERN = re.compile(rb'\bFLAGS \(([^)]*)\)', re.I)
+CODE_PATTERN = re.compile(rb'\[(UIDVALIDITY|UIDNEXT) (\d+)\]', re.I)
+EXISTS_PATTERN = re.compile(rb'^\* (\d+) EXISTS', re.I)
+CAPABILITY_PATTERN = re.compile(rb'CAPABILITY ([^\]\r\n]*)', re.I)
+HEADER_ITEMS = '(UID FLAGS RFC822.SIZE BODY.PEEK[HEADER])'
+BODY_ITEMS = '(UID BODY.PEEK[])'
+# max response line, `* SEARCH` lists all found UIDs in one line
+LINE_LIMIT = 16 * 1024 * 1024
+SEARCH_RANGE = 1000000  # UIDs searched at once, fit `LINE_LIMIT`
+
+
+class IMAPError(Exception):
+    """Command was not completed with `OK`."""
+
+
+class FetchedMessage(NamedTuple):
+    """Message data fetched by UID."""
+
+    uid: int
+    size: int
+    flags: List[str]  # e.g. `\\Seen`
+    data: bytes  # headers or whole message
+
+
+class FolderStatus(NamedTuple):
+    """State of selected folder."""
+
+    uidvalidity: int
+    uidnext: int  # 0 if server did not send it
+    exists: int
+
+
+class _Response(NamedTuple):
+    """Server response with its literals."""
+
+    line: bytes  # response line, literals are replaced with `{}`
+    literals: List[bytes]
+
+
+def quote(string: str) -> str:
+    """
+    Make IMAP quoted string.
+
+    Args:
+        string (str): string to quote
+
+    Returns:
+        quoted (str): string in double quotes with escaped specials
+
+    """
+    return '"{0}"'.format(string.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def uid_set(uids: Iterable[int]) -> str:
+    """
+    Make compact sequence set of UIDs, e.g. `1:3,7,9:10`.
+
+    Args:
+        uids (Iterable[int]): UIDs
+
+    Returns:
+        sequence_set (str): UIDs with consecutive runs joined as ranges
+
+    """
+    ranges: List[List[int]] = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(
+        str(first) if first == last else '{0}:{1}'.format(first, last)
+        for first, last in ranges
+    )
+
+
+class IMAPClient(object):
+    """Single IMAP connection."""
+
+    def __init__(
+        self,
+        host: str,
+        port: Optional[int] = None,
+        use_ssl: bool = True,
+        timeout: float = 60.0,
+    ):
+        """
+        Init class instance.
+
+        Args:
+            host (str): server host
+            port (Optional[int]): server port, default by `use_ssl` if None
+            use_ssl (bool): use implicit TLS
+            timeout (float): seconds, max wait for command completion
+
+        """
+        self.host = host
+        self.port = port or (IMAPS_PORT if use_ssl else IMAP_PORT)
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.capabilities: List[str] = []
+        self.selected: Optional[str] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tag = 0
+
+    @property
+    def is_connected(self) -> bool:
+        """
+        Check connection state.
+
+        Returns:
+            is_connected (bool): True if connection is open
+
+        """
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        """
+        Open connection and read server greeting.
+
+        Raises:
+            IMAPError: if server rejected connection
+
+        """
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=ssl.create_default_context() if self.use_ssl else None,
+                limit=LINE_LIMIT,
+            ),
+            self.timeout,
+        )
+        greeting = await self._read_response()
+        if not greeting.line.startswith((b'* OK', b'* PREAUTH')):
+            raise IMAPError(greeting.line.decode(errors='replace'))
+        self._parse_capabilities(greeting.line)
+        if not self.capabilities:
+            self._parse_capabilities(
+                b' '.join(
+                    response.line for response in
+                    await self.command('CAPABILITY')
+                ),
+            )
+
+    async def login(self, login: str, password: str):
+        """
+        Authenticate with plain `LOGIN` command.
+
+        Args:
+            login (str): user name
+            password (str): user password
+
+        """
+        responses = await self.command(
+            'LOGIN {0} {1}'.format(quote(login), quote(password)),
+        )
+        self._parse_capabilities(responses[-1].line)
+
+    async def select(self, folder: str) -> FolderStatus:
+        """
+        Select folder read-only.
+
+        `EXAMINE` is used, so fetched messages are not marked as read.
+
+        Args:
+            folder (str): folder name, e.g. `INBOX`
+
+        Returns:
+            status (FolderStatus): UIDVALIDITY, UIDNEXT and message count
+
+        """
+        responses = await self.command('EXAMINE {0}'.format(quote(folder)))
+        codes: Dict[bytes, int] = {}
+        exists = 0
+        for response in responses:
+            for name, number in CODE_PATTERN.findall(response.line):
+                codes[name.upper()] = int(number)
+            match = EXISTS_PATTERN.match(response.line)
+            if match:
+                exists = int(match.group(1))
+        self.selected = folder
+        return FolderStatus(
+            uidvalidity=codes.get(b'UIDVALIDITY', 0),
+            uidnext=codes.get(b'UIDNEXT', 0),
+            exists=exists,
+        )
+
+    async def search_uids(self, first: int, uidnext: int = 0) -> List[int]:
+        """
+        Find UIDs of selected folder starting from `first`.
+
+        UIDs below `uidnext` are searched in ranges of `SEARCH_RANGE`,
+        so response line of large folder does not exceed `LINE_LIMIT`.
+
+        Args:
+            first (int): min UID
+            uidnext (int): UIDNEXT of folder, 0 if it is unknown
+
+        Returns:
+            uids (List[int]): sorted UIDs, not less than `first`
+
+        """
+        uids = set()
+        for start in range(first, uidnext, SEARCH_RANGE):
+            end = min(start + SEARCH_RANGE, uidnext) - 1
+            uids.update(await self._search('{0}:{1}'.format(start, end)))
+        uids.update(await self._search('{0}:*'.format(max(first, uidnext))))
+        # `n:*` matches the last message even if its UID is less than `n`
+        return sorted(uid for uid in uids if uid >= first)
+
+    async def fetch(
+        self,
+        uids: Iterable[int],
+        items: str = HEADER_ITEMS,
+    ) -> List[FetchedMessage]:
+        """
+        Fetch messages by UIDs.
+
+        Args:
+            uids (Iterable[int]): UIDs
+            items (str): fetch items with single literal,
+                `HEADER_ITEMS` or `BODY_ITEMS`
+
+        Returns:
+            messages (List[FetchedMessage]): fetched messages in UID order
+
+        """
+        responses = await self.command(
+            'UID FETCH {0} {1}'.format(uid_set(uids), items),
+        )
+        messages = []
+        for response in responses:
+            if not FETCH_PATTERN.match(response.line):
+                continue
+            uid = UID_PATTERN.search(response.line)
+            if uid is None:
+                continue  # unsolicited flags update
+            size = SIZE_PATTERN.search(response.line)
+            flags = FLAGS_PATTERN.search(response.line)
+            messages.append(
+                FetchedMessage(
+                    uid=int(uid.group(1)),
+                    size=int(size.group(1)) if size else 0,
+                    flags=flags.group(1).decode().split() if flags else [],
+                    data=response.literals[0] if response.literals else b'',
+                ),
+            )
+        return sorted(messages)
+
+    async def idle(
+        self,
+        timeout: float,
+        interrupt: Optional[asyncio.Event] = None,
+    ) -> bool:
+        """
+        Wait for changes of selected folder with `IDLE`, RFC 2177.
+
+        Args:
+            timeout (float): seconds, max wait
+            interrupt (Optional[asyncio.Event]): stops waiting if set
+
+        Returns:
+            changed (bool): True if server reported new messages
+
+        Raises:
+            IMAPError: if server does not accept `IDLE`
+
+        """
+        tag = await self._send('IDLE')
+        continuation = await self._read_response()
+        if not continuation.line.startswith(b'+'):
+            raise IMAPError(continuation.line.decode(errors='replace'))
+        waiters = [asyncio.create_task(self._read_response())]
+        if interrupt is not None:
+            waiters.append(asyncio.create_task(interrupt.wait()))
+        try:
+            await asyncio.wait(
+                waiters,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            self._writer.write(b'DONE\r\n')
+            reading = waiters[0]
+            changed = False
+            while True:  # noqa:WPS457
+                response = await asyncio.wait_for(reading, self.timeout)
+                if response.line.startswith(tag):
+                    self._check(response, tag)
+                    return changed
+                changed = changed or bool(EXISTS_PATTERN.match(response.line))
+                reading = asyncio.ensure_future(self._read_response())
+        except BaseException:
+            # server may still be idling, connection is unusable
+            self.close()
+            raise
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def logout(self):
+        """Log out and close connection, errors are ignored."""
+        if self.is_connected:
+            try:
+                await asyncio.wait_for(self.command('LOGOUT'), self.timeout)
+            except (IMAPError, OSError, asyncio.TimeoutError):
+                pass  # noqa:WPS420
+        self.close()
+
+    def close(self):
+        """Close connection."""
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._reader = None
+        self.selected = None
+
+    async def command(self, command: str) -> List[_Response]:
+        """
+        Run command and read its responses.
+
+        Args:
+            command (str): command without tag
+
+        Returns:
+            responses (List[_Response]): untagged responses, tagged one last
+
+        """
+        tag = await self._send(command)
+        return await asyncio.wait_for(self._read_until(tag), self.timeout)
+
+    async def _send(self, command: str) -> bytes:
+        self._tag += 1
+        tag = 'A{0:04d}'.format(self._tag).encode()
+        self._writer.write(tag + b' ' + command.encode() + b'\r\n')
+        await self._writer.drain()
+        return tag
+
+    async def _read_until(self, tag: bytes) -> List[_Response]:
+        responses = []
+        while True:  # noqa:WPS457
+            response = await self._read_response()
+            responses.append(response)
+            if response.line.startswith(tag + b' '):
+                self._check(response, tag)
+                return responses
+
+    async def _read_response(self) -> _Response:
+        """
+        Read response line with literals following it.
+
+        Returns:
+            response (_Response): response
+
+        Raises:
+            ConnectionError: if connection was closed
+
+        """
+        parts = []
+        literals = []
+        while True:  # noqa:WPS457
+            line = await self._reader.readline()
+            if not line:
+                self.close()
+                raise ConnectionError('IMAP connection was closed')
+            literal = LITERAL_PATTERN.search(line)
+            if literal is None:
+                parts.append(line.rstrip(b'\r\n'))
+                return _Response(line=b''.join(parts), literals=literals)
+            parts.append(line[:literal.start()] + b'{}')
+            literals.append(
+                await self._reader.readexactly(int(literal.group(1))),
+            )
+
+    async def _search(self, uid_set: str) -> List[int]:
+        responses = await self.command('UID SEARCH UID {0}'.format(uid_set))
+        uids = []
+        for response in responses:
+            if response.line.upper().startswith(b'* SEARCH'):
+                uids.extend(int(uid) for uid in response.line.split()[2:])
+        return uids
+
+    @staticmethod
+    def _check(response: _Response, tag: bytes):
+        status = response.line[len(tag) + 1:]
+        if not status.upper().startswith(b'OK'):
+            raise IMAPError(status.decode(errors='replace'))
+
+    def _parse_capabilities(self, line: bytes):
+        match = CAPABILITY_PATTERN.search(line)
+        if match:
+            self.capabilities = match.group(1).decode().upper().split()
+
+
+def parse_flags(flags: List[str]) -> str:
+    """
+    Map IMAP flags to Maildir ones used by message parser.
+
+    Args:
+        flags (List[str]): IMAP flags, e.g. `\\Seen`
+
+    Returns:
+        flags (str): Maildir flags, e.g. `FS`
+
+    """
+    imap_flags = {flag.lower() for flag in flags}
+    return ''.join(
+        maildir_flag
+        for maildir_flag, imap_flag in (('F', '\\flagged'), ('S', '\\seen'))
+        if imap_flag in imap_flags
+    )
+
+
+def split_uids(uids: List[int], size: int) -> List[Tuple[int, ...]]:
+    """
+    Split UIDs into batches.
+
+    Args:
+        uids (List[int]): UIDs
+        size (int): max UIDs in batch
+
+    Returns:
+        batches (List[Tuple[int, ...]]): batches in UID order
+
+    """
+    return [
+        tuple(uids[start:start + size])
+        for start in range(0, len(uids), size)
+    ]
@@ -0,0 +1,76 @@
+"""Attachment service tests."""
+import unittest
+from types import SimpleNamespace
+
+from service.attachment_service import AttachmentService
+
+
+class FakeRepository(object):
+    """Repository finding any letter."""
+
+    table = SimpleNamespace(id=SimpleNamespace(), user=SimpleNamespace())
+
+    async def select_first(self, where):
+        return SimpleNamespace(id=1)
+
+
+class FakeUploads(object):
+    """Upload manager keeping created sessions."""
+
+    def __init__(self):
+        self.created = []
+
+    def create(self, **session):
+        self.created.append(session)
+        return 'upload'
+
+
+class CreateUploadTestCase(unittest.IsolatedAsyncioTestCase):
+    """Content type of resumable upload."""
+
+    def setUp(self):
+        self.uploads = FakeUploads()
+        self.service = AttachmentService(
+            repository=FakeRepository(),
+            filter_class=None,
+            app={'uploads': self.uploads},
+        )
+
+    async def create(self, content_type):
+        return await self.service.create_upload(
+            request_body={
+                'filename': 'report.pdf',
+                'length': 10,
+                'content_type': content_type,
+            },
+            entity_id=1,
+            user_id=1,
+        )
+
+    async def test_crlf_is_rejected(self):
+        with self.assertRaises(KeyError):
+            await self.create('text/plain\r\nX-Injected: 1')
+        self.assertEqual(self.uploads.created, [])
+
+    async def test_type_without_slash_is_rejected(self):
+        with self.assertRaises(KeyError):
+            await self.create('bogus')
+        self.assertEqual(self.uploads.created, [])
+
+    async def test_type_is_normalized(self):
+        await self.create('Application/PDF; name="report.pdf"')
+        self.assertEqual(
+            self.uploads.created[0]['content_type'],
+            'application/pdf',
+        )
+
+    async def test_missing_type_is_default(self):
+        await self.create(None)
+        self.assertEqual(
+            self.uploads.created[0]['content_type'],
+            'application/octet-stream',
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+"""Attachment views."""
+import logging
+
+from aiohttp import hdrs, web
+from aiohttp.helpers import content_disposition_header
+
+from db.schema import Letter
+from emailing.email_message import get_content_type
+from middleware import require_login
+from service.attachment_service import AttachmentService
+from view.base_view import BaseProcessingView
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_OFFSET = 'Upload-Offset'
+UPLOAD_LENGTH = 'Upload-Length'
+
+
+@require_login
+class AttachmentUploadView(BaseProcessingView):
+    """Upload of letter attachments."""
+
+    _tabel = Letter
+    _service = AttachmentService
+
+    async def post(self) -> web.Response:
+        """
+        Handle multipart POST request with attachments.
+
+        Returns:
+            response (web.Response): response
+
+        Raises:
+            AttributeError: if `pk` was not provided
+
+        """
+        entity_id = self.request.match_info.get('id')
+        if not entity_id:
+            raise AttributeError
+        if not self.request.content_type.startswith('multipart/'):
+            return web.HTTPBadRequest()
+        try:
+            response = await self.service.upload(
+                multipart=await self.request.multipart(),
+                entity_id=entity_id,
+                user_id=await self.current_user,
+            )
+        except web.HTTPException:
+            raise
+        except Exception as exception:
+            logger.exception(exception)
+            return web.HTTPBadRequest()
+        return web.json_response(
+            response,
+        )
+
+
+@require_login
+class AttachmentDownloadView(BaseProcessingView):
+    """Download of letter attachment."""
+
+    _tabel = Letter
+    _service = AttachmentService
+
+    async def get(self) -> web.StreamResponse:
+        """
+        Handle GET request of attachment.
+
+        File is sent with `sendfile`, `FileResponse` handles `Range`,
+        `If-Range`, `If-None-Match` and `If-Modified-Since` headers,
+        so interrupted downloads are resumed. Stored files are never
+        changed, so `ETag` stays the same while file exists.
+
+        Returns:
+            response (web.StreamResponse): file response
+
+        Raises:
+            HTTPNotFound: if attachment does not exist
+
+        """
+        try:
+            attachment = await self.service.get_attachment(
+                entity_id=self.request.match_info['id'],
+                user_id=await self.current_user,
+                number=self.request.match_info['n'],
+            )
+        except KeyError:
+            raise web.HTTPNotFound()
+        return web.FileResponse(
+            attachment['path'],
+            headers={
+                hdrs.CONTENT_TYPE: get_content_type(
+                    attachment['filename'],
+                    attachment['content_type'],
+                ),
+                hdrs.CONTENT_DISPOSITION: content_disposition_header(
+                    'attachment',
+                    filename=attachment['filename'],
+                ),
+            },
+        )
+
+
+@require_login
+class ResumableUploadCreateView(BaseProcessingView):
+    """Creation of resumable attachment upload."""
+
+    _tabel = Letter
+    _service = AttachmentService
+
+    async def post(self) -> web.Response:
+        """
+        Handle POST request creating upload session.
+
+        Returns:
+            response (web.Response): response with upload id
+
+        Raises:
+            AttributeError: if `pk` was not provided
+
+        """
+        entity_id = self.request.match_info.get('id')
+        if not entity_id:
+            raise AttributeError
+        body = await self.prepare_body()
+        try:
+            response = await self.service.create_upload(
+                request_body=body,
+                entity_id=entity_id,
+                user_id=await self.current_user,
+            )
+        except web.HTTPException:
+            raise
+        except Exception as exception:
+            logger.exception(exception)
+            return web.HTTPBadRequest()
+        return web.json_response(
+            response,
+            status=web.HTTPCreated.status_code,
+            headers={
+                hdrs.LOCATION: '/api/upload/{0}'.format(
+                    response['upload_id'],
+                ),
+            },
+        )
+
+
+@require_login
+class ResumableUploadView(BaseProcessingView):
+    """
+    Resumable attachment upload.
+
+    `HEAD` returns received bytes in `Upload-Offset` header,
+    `PATCH` appends request body at `Upload-Offset`,
+    `POST` finalizes upload and attaches file to letter.
+
+    """
+
+    _tabel = Letter
+    _service = AttachmentService
+
+    async def head(self) -> web.Response:
+        """
+        Handle HEAD request with upload state.
+
+        Returns:
+            response (web.Response): response with offset headers
+
+        """
+        status = await self.service.get_upload(
+            upload_id=self.request.match_info['upload_id'],
+            user_id=await self.current_user,
+        )
+        return web.Response(
+            headers={
+                UPLOAD_OFFSET: str(status['offset']),
+                UPLOAD_LENGTH: str(status['length']),
+                hdrs.CACHE_CONTROL: 'no-store',
+            },
+        )
+
+    async def patch(self) -> web.Response:
+        """
+        Handle PATCH request with upload chunk.
+
+        Body is streamed to disk, it is not buffered in memory.
+
+        Returns:
+            response (web.Response): response with new offset
+
+        """
+        try:
+            offset = int(self.request.headers[UPLOAD_OFFSET])
+        except (KeyError, ValueError):
+            return web.HTTPBadRequest(text='Upload-Offset is required.')
+        if offset < 0:
+            return web.HTTPBadRequest(text='Upload-Offset is negative.')
+        offset = await self.service.append_upload(
+            upload_id=self.request.match_info['upload_id'],
+            user_id=await self.current_user,
+            offset=offset,
+            chunks=self.request.content.iter_chunked(
+                self.request.app['attachments'].config.chunk_size,
+            ),
+        )
+        return web.HTTPNoContent(
+            headers={
+                UPLOAD_OFFSET: str(offset),
+            },
+        )
+
+    async def post(self) -> web.Response:
+        """
+        Handle POST request finalizing upload.
+
+        Returns:
+            response (web.Response): response with attachment id
+
+        """
+        try:
+            response = await self.service.finalize_upload(
+                upload_id=self.request.match_info['upload_id'],
+                user_id=await self.current_user,
+            )
+        except web.HTTPException:
+            raise
+        except Exception as exception:
+            logger.exception(exception)
+            return web.HTTPBadRequest()
+        return web.json_response(
+            response,
+        )
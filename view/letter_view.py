@@ -1,12 +1,14 @@
 """Letter views."""
 import logging
 
+from aiohttp import web
+
 from db.schema import Letter
 from middleware import require_login
 from service.letter_service import LetterService
 
 from filter.letter_filter import LetterAlchemyFilter
-from view.base_view import BaseEntityView, BaseManyView
+from view.base_view import BaseEntityView, BaseManyView, BaseProcessingView
 
 logger = logging.getLogger(__name__)
 
@@ -27,3 +29,30 @@ class LetterManyView(BaseManyView):
     _tabel = Letter
     _service = LetterService
     _filter = LetterAlchemyFilter
+
+
+@require_login
+class LetterChangesView(BaseProcessingView):
+    """Letter changes view."""
+
+    _tabel = Letter
+    _service = LetterService
+
+    async def get(self) -> web.Response:
+        """
+        Handle GET request of changes after `since` sequence number.
+
+        Returns:
+            response (web.Response): response
+
+        """
+        try:
+            response = await self.service.changes(
+                url_query=self._url_query_to_dict(self.request.rel_url.query),
+                user_id=await self.current_user,
+            )
+        except ValueError:
+            return web.HTTPBadRequest()
+        return web.json_response(
+            response,
+        )
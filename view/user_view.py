@@ -65,9 +65,12 @@ class CreateUserView(web.View):
         try:
             await create_credentials(
                 service=service,
+                hasher=self.request.app['hasher'],
                 password=body['password'],
                 username=body['username'],
             )
+        except web.HTTPServiceUnavailable:
+            raise
         except Exception as exception:
             logger.exception(exception)
             return web.HTTPBadRequest()
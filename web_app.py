@@ -1,14 +1,37 @@
 """Web application module."""
+import asyncio
 import logging
 
 from aiohttp import web
 
+from attachment.store import AttachmentStore
+from attachment.upload import UploadManager
+from auth.hasher import PasswordHasher
+from changelog.log import ChangeLog
 from config_model import MainConfig
-from db.psql_engine import PostgresEngine
+from db.psql_engine import DB_LATENCY_METRIC, PostgresEngine
+from emailing.outbox import OutboxWorkerPool
 from emailing.smtp_client import SMTPClient
-from middleware import check_login
-from socket_io.namespace import sio, socket_test
-from view.letter_view import LetterEntityView, LetterManyView
+from inbound.receiver import InboundReceiver
+from limiter.admission import AdmissionController
+from metrics import metrics_view, registry
+from middleware import admission_control, check_login, track_requests
+from shutdown import RequestTracker
+from socket_io.listener import LetterChangeListener
+from socket_io.manager import BusManager, create_manager
+from socket_io.namespace import EventAggregator, inbox, sio, socket_test
+from sync.engine import SyncEngine
+from view.attachment_view import (
+    AttachmentDownloadView,
+    AttachmentUploadView,
+    ResumableUploadCreateView,
+    ResumableUploadView,
+)
+from view.letter_view import (
+    LetterChangesView,
+    LetterEntityView,
+    LetterManyView,
+)
 from view.user_view import CreateUserView
 
 logger = logging.getLogger(__name__)
@@ -32,9 +55,30 @@ class Application(web.Application):
         self._prepare_app()
 
     def _prepare_app(self):
+        self.on_startup.append(self._setup_requests)
         self.on_startup.append(self._setup_db)
         self.on_startup.append(self._setup_smtp)
-        self['socketio_session'] = {}
+        self.on_startup.append(self._setup_attachments)
+        self.on_cleanup.append(self._stop_attachments)
+        self.on_startup.append(self._setup_outbox)
+        self.on_cleanup.append(self._stop_outbox)
+        self.on_startup.append(self._setup_inbound)
+        self.on_cleanup.append(self._stop_inbound)
+        self.on_startup.append(self._setup_sync)
+        self.on_cleanup.append(self._stop_sync)
+        self.on_startup.append(self._setup_changelog)
+        self.on_cleanup.append(self._stop_changelog)
+        self.on_startup.append(self._setup_listener)
+        self.on_cleanup.append(self._stop_listener)
+        self.on_startup.append(self._setup_hasher)
+        self.on_cleanup.append(self._stop_hasher)
+        self.on_startup.append(self._setup_admission)
+        self.on_cleanup.append(self._stop_admission)
+        self.on_cleanup.append(self._stop_socketio)
+        self.on_shutdown.append(self._drain)
+        self.on_cleanup.append(self._stop_smtp)
+        self.on_cleanup.append(self._stop_db)
+        self['socketio_session'] = inbox.sessions
         self._setup_routes()
         self._setup_socketio()
         self._setup_middleware()
@@ -55,6 +99,11 @@ class Application(web.Application):
                         socket_test,
                     ),
 
+                    web.get(
+                        '/metrics',
+                        metrics_view,
+                    ),
+
                     web.view(
                         '/create_user',
                         CreateUserView,
@@ -69,6 +118,27 @@ class Application(web.Application):
                         LetterEntityView,
                     ),
 
+                    web.view(
+                        r'/api/crud/letter/{id:\d+}/attachment',
+                        AttachmentUploadView,
+                    ),
+                    web.view(
+                        r'/api/crud/letter/{id:\d+}/attachment/{n:\d+}',
+                        AttachmentDownloadView,
+                    ),
+                    web.view(
+                        r'/api/crud/letter/{id:\d+}/upload',
+                        ResumableUploadCreateView,
+                    ),
+                    web.view(
+                        '/api/upload/{upload_id}',
+                        ResumableUploadView,
+                    ),
+
+                    web.view(
+                        '/api/crud/letter/changes',
+                        LetterChangesView,
+                    ),
                     web.view(
                         '/api/crud/letter/{command}',
                         LetterManyView,
@@ -102,13 +172,160 @@ class Application(web.Application):
         await db_engine.run_session_maker()
         self['db'] = db_engine
 
+    async def _stop_db(self, *args):
+        if 'db' in self:
+            await self['db'].stop()
+
     def _setup_middleware(self):
+        self.middlewares.append(track_requests)
         self.middlewares.append(check_login)
+        self.middlewares.append(admission_control)
 
     def _setup_socketio(self):
+        manager = create_manager(
+            config=self.config.socketio,
+            db_config=self.config.db,
+        )
+        manager.set_server(sio)
+        sio.manager = manager
+        sio.manager_initialized = False
         sio.attach(self)
 
+    async def _stop_socketio(self, *args):
+        if isinstance(sio.manager, BusManager):
+            await sio.manager.close()
+
     async def _setup_smtp(self, *args):
         smtp = SMTPClient(config=self.config.smtp)
         await smtp.connect()
         self['smtp'] = smtp
+
+    async def _stop_smtp(self, *args):
+        if 'smtp' in self:
+            await self['smtp'].close()
+
+    async def _setup_requests(self, *args):
+        self['requests'] = RequestTracker(
+            exclude=self.config.app.drain_exclude,
+        )
+
+    async def _drain(self, *args):
+        """
+        Wait for requests in flight and outbox deliveries before stop.
+
+        Listening socket is already closed, requests which are not
+        completed in `shutdown_timeout` are cancelled by aiohttp.
+
+        Args:
+            args: extra parameter, required
+
+        """
+        await asyncio.gather(
+            self['requests'].drain(self.config.app.shutdown_timeout),
+            self['outbox'].drain(self.config.app.shutdown_timeout),
+        )
+
+    async def _setup_attachments(self, *args):
+        attachments = AttachmentStore(
+            config=self.config.storage,
+            db_engine=self['db'],
+        )
+        attachments.start()
+        self['attachments'] = attachments
+        self['uploads'] = UploadManager(store=attachments)
+
+    async def _stop_attachments(self, *args):
+        await self['attachments'].stop()
+
+    async def _setup_inbound(self, *args):
+        if not self.config.inbound.enabled:
+            return
+        inbound = InboundReceiver(
+            config=self.config.inbound,
+            db_engine=self['db'],
+            domain=self.config.smtp.domain,
+        )
+        await inbound.start()
+        self['inbound'] = inbound
+
+    async def _stop_inbound(self, *args):
+        if 'inbound' in self:
+            await self['inbound'].stop()
+
+    async def _setup_sync(self, *args):
+        if not self.config.sync.enabled:
+            return
+        sync = SyncEngine(config=self.config.sync, db_engine=self['db'])
+        sync.start()
+        self['sync'] = sync
+
+    async def _stop_sync(self, *args):
+        if 'sync' in self:
+            await self['sync'].stop()
+
+    async def _setup_changelog(self, *args):
+        changelog = ChangeLog(
+            config=self.config.changelog,
+            db_engine=self['db'],
+        )
+        changelog.start()
+        inbox.changelog = changelog
+        self['changelog'] = changelog
+
+    async def _stop_changelog(self, *args):
+        await self['changelog'].stop()
+        inbox.changelog = None
+
+    async def _setup_listener(self, *args):
+        events = EventAggregator(
+            config=self.config.socketio,
+            sessions=self['socketio_session'],
+        )
+        events.start()
+        inbox.events = events
+        listener = LetterChangeListener(
+            config=self.config.db,
+            sessions=self['socketio_session'],
+            events=events,
+        )
+        listener.start()
+        self['listener'] = listener
+
+    async def _stop_listener(self, *args):
+        await self['listener'].stop()
+        await self['listener'].events.stop()
+        inbox.events = None
+
+    async def _setup_hasher(self, *args):
+        hasher = PasswordHasher(config=self.config.auth)
+        hasher.start()
+        self['hasher'] = hasher
+
+    async def _stop_hasher(self, *args):
+        self['hasher'].stop()
+
+    async def _setup_admission(self, *args):
+        if not self.config.admission.enabled:
+            return
+        admission = AdmissionController(
+            config=self.config.admission,
+            latency=registry.summary(DB_LATENCY_METRIC),
+        )
+        admission.start()
+        self['admission'] = admission
+
+    async def _stop_admission(self, *args):
+        if 'admission' in self:
+            await self['admission'].stop()
+
+    async def _setup_outbox(self, *args):
+        outbox = OutboxWorkerPool(
+            db_engine=self['db'],
+            smtp=self['smtp'],
+            config=self.config.outbox,
+        )
+        outbox.start()
+        self['outbox'] = outbox
+
+    async def _stop_outbox(self, *args):
+        await self['outbox'].stop()